@@ -1,5 +1,4 @@
 import os
-from matplotlib.colors import ListedColormap
 from pathlib import Path
 
 
@@ -12,16 +11,19 @@ MMD_SEED_DIRNAME: str = "mmd_seeds"
 SMD_SEED_FILENAME: str = "actual"
 POP_COL: str = "TOTAL"
 DISTRICT_NO_COL = "DISTRICTNO"
+COUNTY_COLS: list[str] = ["COUNTYFP20", "COUNTYFP", "COUNTY_FIP", "CDE_COUNTY", "COUNTY", "CountyID", "JURSCODE"] # county columns of the state graphs, in order of preference
 POP_UPDATER: str = "population"
 CUT_EDGE_UPDATER: str = "cut_edges"
-DISTINCT_COLORS: ListedColormap = ListedColormap(['#e6194b', '#3cb44b',
+DISTRICT_ADJACENCY_UPDATER: str = "district_adjacency"
+DISTINCT_COLORS: list[str] = ['#e6194b', '#3cb44b',
 '#ffe119', '#4363d8', '#f58231', '#911eb4', '#46f0f0', '#f032e6', '#bcf60c',
 '#fabebe', '#008080', '#e6beff', '#9a6324', '#fffac8', '#800000', '#aaffc3',
-'#808000', '#ffd8b1', '#000075', '#808080'])
+'#808000', '#ffd8b1', '#000075', '#808080'] # plotting.distinct_colormap() turns these into a colormap
 
 
 STATE_DIRPATH = lambda state: STATE_DATA_BASE_DIRPATH / state
 STATE_GEOMETRY_FILEPATH = lambda state: STATE_DIRPATH(state) / STATE_GEOMETRY_FILENAME
+STATE_GEOMETRY_CACHE_DIRPATH = lambda state: STATE_DIRPATH(state) / "geometry_cache"
 STATE_GRAPH_FILEPATH = lambda state: STATE_DIRPATH(state) / STATE_GRAPH_FILENAME
 SMD_SEEDS_DIRPATH = lambda state: STATE_DIRPATH(state) / SMD_SEED_DIRNAME
 MMD_SEEDS_DIRPATH = lambda state: STATE_DIRPATH(state) / MMD_SEED_DIRNAME
@@ -30,7 +32,10 @@ ELECTIONSRESULTS_FILENAME = lambda electionsresults: f"{electionsresults.ensembl
 ELECTIONSRESULTS_DIRPATH = lambda state: STATE_DIRPATH(state) / "elections_results"
 SMD_ENSEMBLE_DIRPATH = lambda state: STATE_DIRPATH(state) / "smd_ensembles"
 MMD_ENSEMBLE_DIRPATH = lambda state: STATE_DIRPATH(state) / "mmd_ensembles"
+TRAJECTORY_DIRPATH = lambda state: STATE_DIRPATH(state) / "trajectories"
+OUTLIERS_DIRPATH = lambda state: STATE_DIRPATH(state) / "outliers"
 PLOT_DIRPATH = PROJ_ROOT / "plots"
+JOB_QUEUE_FILEPATH: Path = STATE_DATA_BASE_DIRPATH / "job_queue.sqlite"
 
 STATES = {
         'AK': 'Alaska',
@@ -1,7 +1,5 @@
 from pathlib import Path
-from src.custom_types import VotingComparator
-from src.modules.voting_models import party_line_voting_comparator
-from src.modules.mmd_seed_generation import pick_HR_3863_desired_mmd_config, pick_max_districts_config
+import importlib
 import logging
 
 
@@ -14,7 +12,29 @@ SMD_ENSEMBLE_SIZE: int = 10
 MMD_ENSEMBLE_SIZE: int = 10
 SMD_EPSILON: float = 0.01
 MMD_EPSILON: float = 0.01
-REP_VOTE_TALLY_COL: str = "2020_PRES_DEM"
-DEM_VOTE_TALLY_COL: str = "2020_PRES_REP"
-VOTING_MODEL: VotingComparator = party_line_voting_comparator
-MMD_CONFIG_CHOOSER = pick_HR_3863_desired_mmd_config
\ No newline at end of file
+TARGET_ESS: float = None # stop each chain once the effective sample size of its diagnostics reaches this (None runs every recom step)
+TARGET_RHAT: float = None # stop generating an ensemble once R-hat across its chains drops to this (None generates every map)
+COARSENING: float = None # run chains on super-nodes of at most this fraction of the ideal district population (see modules/coarsening.py; None runs on precincts)
+REFINE_COARSE_MAPS: bool = True # rebalance the population of coarse chain maps to within epsilon at precinct level
+SAVE_TRAJECTORIES: bool = False # also save the delta-encoded trajectory of every chain under each state's trajectories directory
+ARTIFACT_SUFFIX: str = ".gz" # compression of saved seeds, ensembles and election results (".gz", ".xz" or "" for none)
+REP_VOTE_TALLY_COL: str = "2020_PRES_REP"
+DEM_VOTE_TALLY_COL: str = "2020_PRES_DEM"
+ELECTION_VOTE_TALLY_COLS: list[tuple[str, str]] = None # (democrat, republican) vote column pairs of the elections run on each ensemble (None runs every *_DEM/*_REP pair in the state graph)
+
+# settings that refer to functions, as (module, function name). They are
+# imported the first time they are accessed (e.g. run_config.VOTING_MODEL), so
+# that importing run_config doesn't import the modules that define them.
+LAZY_SETTINGS: dict[str, tuple[str, str]] = {
+    "VOTING_MODEL": ("src.modules.voting_models", "party_line_voting_comparator"),
+    "MMD_CONFIG_CHOOSER": ("src.modules.mmd_seed_generation", "pick_HR_3863_desired_mmd_config"),
+}
+
+
+def __getattr__(name: str):
+    if name not in LAZY_SETTINGS:
+        raise AttributeError(f"module {__name__} has no attribute {name}")
+    module, attr = LAZY_SETTINGS[name]
+    value = getattr(importlib.import_module(module), attr)
+    globals()[name] = value
+    return value
@@ -0,0 +1,162 @@
+import argparse
+import subprocess
+import sys
+import json
+import logging
+import consts
+logger = logging.getLogger(__name__)
+
+"""
+Benchmarks that guard the startup cost of worker processes. Every pool worker
+(and MPI rank) imports the modules it runs before doing any work, so the
+modules that workers import must stay free of plotting, geospatial and
+presentation dependencies. Each module is imported in a fresh interpreter and
+timed against a budget measured on top of importing gerrychain, which every
+worker needs anyway. The script exits with a nonzero status if a budget is
+exceeded or a module pulls in one of the dependencies it must not import.
+
+With --coarsening, it instead measures the speedup versus fidelity tradeoff of
+running chains on coarsened graphs (see modules/coarsening.py) for a state's
+SMD seed, at each super-node population cap. With --speculative, it measures
+the time per step of a single chain whose splits are drawn by a
+SpeculativeSplitter (see modules/ensemble_generation.py) with each number of
+worker processes.
+
+Example:
+    python -m src.bin.benchmarks --repeats 5
+    python -m src.bin.benchmarks --coarsening UT --fractions 0.01 0.02 0.05
+    python -m src.bin.benchmarks --speculative UT --split-workers 1 2 4 8
+"""
+
+
+BASELINE_MODULE: str = "gerrychain"
+WORKER_MODULES: list[str] = ["consts", "run_config", "src.custom_types", "src.modules.election",
+                             "src.modules.ensemble_generation", "src.modules.data_processing"]
+IMPORT_BUDGETS: dict[str, float] = {module: 0.25 for module in WORKER_MODULES} # seconds on top of the baseline
+FORBIDDEN_IMPORTS: list[str] = ["matplotlib", "pptx"]
+TIMING_SCRIPT: str = """
+import time, sys, json
+start = time.perf_counter()
+import {module}
+print(json.dumps({{"seconds": time.perf_counter() - start, "modules": sorted(sys.modules)}}))
+"""
+
+
+def time_import(module: str, repeats: int) -> tuple[float, list[str]]:
+    """Returns the fastest import time of a module over several fresh interpreters, and the modules it loaded."""
+
+    best: float = float("inf")
+    modules: list[str] = []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, "-c", TIMING_SCRIPT.format(module=module)], cwd=consts.PROJ_ROOT,
+                             capture_output=True, text=True, check=True)
+        result: dict = json.loads(out.stdout.strip().splitlines()[-1])
+        best = min(best, result["seconds"])
+        modules = result["modules"]
+    return best, modules
+
+
+def import_benchmark(repeats: int) -> bool:
+    """Times the imports of the worker modules and returns whether all of them are within budget."""
+
+    baseline, _ = time_import(BASELINE_MODULE, repeats)
+    print(f"{BASELINE_MODULE + ' (baseline)':40} {baseline:8.3f}s")
+    ok: bool = True
+    for module in WORKER_MODULES:
+        seconds, modules = time_import(module, repeats)
+        overhead: float = seconds - baseline
+        forbidden: list[str] = [m for m in FORBIDDEN_IMPORTS if m in modules]
+        passed: bool = overhead <= IMPORT_BUDGETS[module] and not forbidden
+        ok &= passed
+        print(f"{module:40} {seconds:8.3f}s  +{max(overhead, 0):.3f}s / {IMPORT_BUDGETS[module]:.3f}s budget"
+              f"{'  imports ' + ', '.join(forbidden) if forbidden else ''}  {'ok' if passed else 'FAIL'}")
+    return ok
+
+
+def coarsening_benchmark(state: str, fractions: list[float], n_recom_steps: int, epsilon: float) -> list[dict]:
+    """
+    Runs one chain from a state's SMD seed on precincts and one per super-node
+    population cap on the coarsened graph, and reports for each the coarsening
+    stats, the time of the chain (including refinement), its speedup over the
+    precinct chain, and the largest district population deviation before and
+    after refinement.
+    """
+
+    import time
+    from ..custom_types import VMDPartition
+    from ..modules.coarsening import coarsen_graph, refine_population
+    from ..modules.ensemble_generation import gen_random_map
+
+    seed: VMDPartition = VMDPartition.from_file(consts.SMD_SEEDS_DIRPATH(state) / consts.SMD_SEED_FILENAME)
+    ideal_pop: float = sum(seed[consts.POP_UPDATER].values())/sum(seed.district_reps.values())
+    max_deviation = lambda p: max(abs(pop/(ideal_pop*p.district_reps[d]) - 1) for d, pop in p[consts.POP_UPDATER].items())
+    start: float = time.perf_counter()
+    gen_random_map(seed, n_recom_steps, epsilon, [])
+    precinct_seconds: float = time.perf_counter() - start
+    print(f"{'precincts':>10} {len(seed.graph.nodes):6} nodes {precinct_seconds:8.2f}s")
+    rows: list[dict] = []
+    for fraction in fractions:
+        coarse_graph = coarsen_graph(seed, fraction)
+        start = time.perf_counter()
+        coarse_map: VMDPartition = gen_random_map(coarse_graph.coarsen_partition(seed), n_recom_steps, max(epsilon, fraction), [])
+        partition: VMDPartition = coarse_graph.uncoarsen_partition(coarse_map, seed.graph)
+        deviation: float = max_deviation(partition)
+        refined_deviation: float = max_deviation(refine_population(partition, epsilon))
+        seconds: float = time.perf_counter() - start
+        rows.append(coarse_graph.stats() | {"seconds": seconds, "speedup": precinct_seconds/seconds,
+                                            "max_deviation": deviation, "refined_max_deviation": refined_deviation})
+        print(f"{fraction:10} {rows[-1]['n_nodes']:6} nodes {seconds:8.2f}s  {rows[-1]['speedup']:5.1f}x speedup  "
+              f"{rows[-1]['boundary_edge_fraction']:.0%} of edges cuttable  deviation {deviation:.4f} -> {refined_deviation:.4f}")
+    return rows
+
+
+def speculative_benchmark(state: str, split_workers: list[int], n_recom_steps: int, epsilon: float) -> list[dict]:
+    """
+    Runs one chain from a state's SMD seed with sequential splits and one per
+    number of split workers, from the same random seed, and reports the time
+    per step of each and its speedup over the sequential chain.
+    """
+
+    import time
+    import random
+    from ..custom_types import VMDPartition
+    from ..modules.ensemble_generation import gen_random_map, SpeculativeSplitter
+
+    seed: VMDPartition = VMDPartition.from_file(consts.SMD_SEEDS_DIRPATH(state) / consts.SMD_SEED_FILENAME)
+    random.seed(0)
+    start: float = time.perf_counter()
+    gen_random_map(seed, n_recom_steps, epsilon, [])
+    sequential_seconds: float = (time.perf_counter() - start)/n_recom_steps
+    print(f"{'sequential':>10} {sequential_seconds*1000:8.1f}ms/step")
+    rows: list[dict] = []
+    for n_workers in split_workers:
+        with SpeculativeSplitter(seed.graph.graph, n_workers) as splitter:
+            random.seed(0)
+            start = time.perf_counter()
+            gen_random_map(seed, n_recom_steps, epsilon, [], split=splitter)
+            seconds: float = (time.perf_counter() - start)/n_recom_steps
+        rows.append({"n_workers": n_workers, "seconds_per_step": seconds, "speedup": sequential_seconds/seconds})
+        print(f"{n_workers:10} {seconds*1000:8.1f}ms/step  {rows[-1]['speedup']:5.1f}x speedup")
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check the import time budget of the modules worker processes import, or measure the coarsening tradeoff or speculative split latency.")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--coarsening", metavar="STATE", help="measure the coarsening tradeoff on this state instead")
+    parser.add_argument("--fractions", type=float, nargs="+", default=[0.01, 0.02, 0.05])
+    parser.add_argument("--speculative", metavar="STATE", help="measure the per-step latency of speculative parallel splits on this state instead")
+    parser.add_argument("--split-workers", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--recom-steps", type=int, default=100)
+    parser.add_argument("--epsilon", type=float, default=0.01)
+    args = parser.parse_args()
+    if args.coarsening is not None:
+        coarsening_benchmark(args.coarsening, args.fractions, args.recom_steps, args.epsilon)
+    elif args.speculative is not None:
+        speculative_benchmark(args.speculative, args.split_workers, args.recom_steps, args.epsilon)
+    elif not import_benchmark(args.repeats):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
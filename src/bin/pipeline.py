@@ -0,0 +1,136 @@
+from pathlib import Path
+from threading import Lock
+from functools import partial
+import argparse
+import logging
+import matplotlib
+matplotlib.use("Agg") # stages run on worker threads, so plots can't use an interactive backend
+import matplotlib.pyplot as plt
+import consts
+import run_config
+from ..modules import mmd_seed_generation, election, voting_models
+from ..modules.data_processing import gen_smd_seeds, gen_mmd_seeds, gen_smd_ensembles, gen_mmd_ensembles, run_election, analyze_plan_outliers
+from ..modules.pipeline import Stage, run_pipeline
+from ..modules.plotting import plot_party_split
+from ..custom_types import MultiElectionsResults
+logger = logging.getLogger(__name__)
+
+"""
+Command line runner for the seed -> ensemble -> election -> plot pipeline that
+main() runs by hand. Every stage is cached by a content hash of its parameters
+and upstream artifacts (see modules/pipeline.py), so rerunning only does the
+work whose inputs changed. States run concurrently.
+
+Example:
+    python -m src.bin.pipeline --states NY MD --stages smd_plots mmd_plots --smd-ensemble-size 100
+"""
+
+
+plot_lock: Lock = Lock() # pyplot keeps global state, so only one thread may plot at a time
+
+
+def run_smd_seeds(state: str, params: dict, input_files: list[Path]) -> list[Path]:
+    return gen_smd_seeds([state])
+
+
+def run_mmd_seeds(state: str, params: dict, input_files: list[Path]) -> list[Path]:
+    return gen_mmd_seeds(getattr(mmd_seed_generation, params["strategy"]), [state])
+
+
+def run_smd_ensembles(state: str, params: dict, input_files: list[Path], n_workers: int) -> list[Path]:
+    return gen_smd_ensembles(params["ensemble_size"], params["n_recom_steps"], params["epsilon"], "actual", params["constraints"], [state], n_workers)
+
+
+def run_mmd_ensembles(state: str, params: dict, input_files: list[Path], n_workers: int) -> list[Path]:
+    return gen_mmd_ensembles(params["ensemble_size"], params["n_recom_steps"], params["epsilon"], params["strategy"], params["constraints"], [state], n_workers)
+
+
+def run_elections(state: str, params: dict, input_files: list[Path], n_workers: int) -> list[Path]:
+    return [run_election(input_files[0], getattr(voting_models, params["voting_model"]), getattr(election, params["tabulator"]), n_workers, state, params["vote_cols"])]
+
+
+def run_outliers(state: str, params: dict, input_files: list[Path], n_workers: int) -> list[Path]:
+    return analyze_plan_outliers(input_files[0], input_files[1:], state, n_workers, vote_col_pairs=params["vote_cols"])
+
+
+def run_plots(state: str, params: dict, input_files: list[Path]) -> list[Path]:
+    electionsresults: MultiElectionsResults = MultiElectionsResults.from_file(input_files[0])
+    files: list[Path] = []
+    for name in electionsresults.elections():
+        files.append(consts.PLOT_DIRPATH / state / (consts.ELECTIONSRESULTS_FILENAME(electionsresults) + f"-{name}.png"))
+        with plot_lock:
+            plt.figure()
+            plot_party_split(electionsresults.election(name), len(electionsresults.results[name][0]), files[-1])
+            plt.close()
+    return files
+
+
+def build_stages(n_workers: int) -> list[Stage]:
+    """The pipeline's stages in dependency order. The worker count is bound here rather than passed as a parameter since it doesn't change any artifact."""
+
+    return [
+        Stage("smd_seeds", [], run_smd_seeds, sources=lambda state: [consts.STATE_GRAPH_FILEPATH(state)]),
+        Stage("mmd_seeds", ["smd_seeds"], run_mmd_seeds),
+        Stage("smd_ensembles", ["smd_seeds"], partial(run_smd_ensembles, n_workers=n_workers)),
+        Stage("mmd_ensembles", ["mmd_seeds"], partial(run_mmd_ensembles, n_workers=n_workers)),
+        Stage("smd_elections", ["smd_ensembles"], partial(run_elections, n_workers=n_workers)),
+        Stage("mmd_elections", ["mmd_ensembles"], partial(run_elections, n_workers=n_workers)),
+        Stage("smd_outliers", ["smd_seeds", "smd_ensembles"], partial(run_outliers, n_workers=n_workers)),
+        Stage("smd_plots", ["smd_elections"], run_plots),
+        Stage("mmd_plots", ["mmd_elections"], run_plots),
+    ]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the cached redistricting pipeline on one or more states.")
+    parser.add_argument("--states", nargs="+", required=True)
+    parser.add_argument("--stages", nargs="+", default=["smd_plots", "mmd_plots"], choices=[s.name for s in build_stages(0)],
+                        help="stages to bring up to date, along with everything upstream of them")
+    parser.add_argument("--concurrent-states", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=4, help="worker processes per state")
+    parser.add_argument("--force", action="store_true", help="rerun stages even if they are up to date")
+    parser.add_argument("--log-level", default=logging.getLevelName(run_config.LOGGING_LEVEL))
+    parser.add_argument("--mmd-config-chooser", default=run_config.MMD_CONFIG_CHOOSER.__name__)
+    parser.add_argument("--smd-ensemble-size", type=int, default=run_config.SMD_ENSEMBLE_SIZE)
+    parser.add_argument("--mmd-ensemble-size", type=int, default=run_config.MMD_ENSEMBLE_SIZE)
+    parser.add_argument("--smd-recom-steps", type=int, default=run_config.SMD_NUM_RECOM_STEPS)
+    parser.add_argument("--mmd-recom-steps", type=int, default=run_config.MMD_NUM_RECOM_STEPS)
+    parser.add_argument("--smd-epsilon", type=float, default=run_config.SMD_EPSILON)
+    parser.add_argument("--mmd-epsilon", type=float, default=run_config.MMD_EPSILON)
+    parser.add_argument("--constraints", nargs="*", default=[])
+    parser.add_argument("--voting-model", default=run_config.VOTING_MODEL.__name__)
+    parser.add_argument("--smd-tabulator", default=election.single_seat_plurality_tabulation.__name__)
+    parser.add_argument("--mmd-tabulator", default=election.multi_seat_ranked_choice_fixed_point_tabulation.__name__)
+    return parser.parse_args()
+
+
+def stage_params(args: argparse.Namespace) -> dict[str, dict]:
+    """
+    Parameters of each stage. Everything that can change a stage's output must
+    be in here so that it is part of the cache key. Stages are run with these
+    exact parameters; vote_cols of None runs every election in the state
+    graph, which is a source of smd_seeds and so already upstream of the key.
+    """
+
+    chain_params: dict = {"constraints": args.constraints, "target_ess": run_config.TARGET_ESS, "target_rhat": run_config.TARGET_RHAT,
+                          "coarsening": run_config.COARSENING, "refine": run_config.REFINE_COARSE_MAPS}
+    return {"mmd_seeds": {"strategy": args.mmd_config_chooser},
+            "smd_ensembles": chain_params | {"ensemble_size": args.smd_ensemble_size, "n_recom_steps": args.smd_recom_steps, "epsilon": args.smd_epsilon},
+            "mmd_ensembles": chain_params | {"ensemble_size": args.mmd_ensemble_size, "n_recom_steps": args.mmd_recom_steps, "epsilon": args.mmd_epsilon,
+                                             "strategy": args.mmd_config_chooser},
+            "smd_elections": {"voting_model": args.voting_model, "tabulator": args.smd_tabulator,
+                              "vote_cols": run_config.ELECTION_VOTE_TALLY_COLS},
+            "mmd_elections": {"voting_model": args.voting_model, "tabulator": args.mmd_tabulator,
+                              "vote_cols": run_config.ELECTION_VOTE_TALLY_COLS},
+            "smd_outliers": {"vote_cols": run_config.ELECTION_VOTE_TALLY_COLS}}
+
+
+def main() -> None:
+    args = parse_args()
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(threadName)s %(name)s %(levelname)s: %(message)s")
+    logging.getLogger("fiona").setLevel(logging.WARNING)
+    run_pipeline(build_stages(args.workers), stage_params(args), args.stages, args.states, args.concurrent_states, args.force)
+
+
+if __name__ == "__main__":
+    main()
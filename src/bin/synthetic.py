@@ -0,0 +1,39 @@
+import argparse
+import logging
+from ..modules.synthetic_graphs import gen_synthetic_state, GRAPH_TYPES
+from ..modules.data_processing import gen_smd_seeds
+logger = logging.getLogger(__name__)
+
+"""
+Generates synthetic states of any size (see modules/synthetic_graphs.py) under
+state_data, so that chains, seed generation, elections and the benchmarks can
+be run on them like on real states to measure how they scale. With --seed, the
+SMD seed of each state is saved too.
+
+Example:
+    python -m src.bin.synthetic SYN_GRID_10K --type grid --precincts 10000 --districts 8 --seed
+    python -m src.bin.synthetic SYN_TRI_1M --type delaunay --precincts 1000000 --districts 50 --clustering 0.8 --seed
+"""
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate synthetic state graphs for scaling studies.")
+    parser.add_argument("state", help="name of the synthetic state's directory under state_data")
+    parser.add_argument("--type", choices=GRAPH_TYPES, default="delaunay")
+    parser.add_argument("--precincts", type=int, required=True)
+    parser.add_argument("--districts", type=int, required=True)
+    parser.add_argument("--pop-skew", type=float, default=0.5, help="standard deviation of the log of the precinct populations")
+    parser.add_argument("--clustering", type=float, default=0.5, help="spatially smooth fraction of the variance of partisanship, from 0 to 1")
+    parser.add_argument("--dem-share", type=float, default=0.5)
+    parser.add_argument("--random-seed", type=int, default=0)
+    parser.add_argument("--seed", action="store_true", help="also save the SMD seed of the state")
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level)
+    print(gen_synthetic_state(args.state, args.type, args.precincts, args.districts, args.pop_skew, args.clustering, args.dem_share, args.random_seed))
+    if args.seed:
+        print(*gen_smd_seeds([args.state]), sep="\n")
+
+
+if __name__ == "__main__":
+    main()
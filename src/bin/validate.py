@@ -0,0 +1,38 @@
+import argparse
+import json
+import sys
+import logging
+from pathlib import Path
+from ..modules.validation import validate_ensemble_file
+logger = logging.getLogger(__name__)
+
+"""
+Audits saved ensemble files: every map must cover every precinct, have exactly
+the districts of its district_reps, keep every district contiguous and within
+epsilon population balance (see modules/validation.py). Prints a report per
+file and exits with a nonzero status if any map is invalid.
+
+Example:
+    python -m src.bin.validate state_data/MD/smd_ensembles/actual-100-[]-10-0.01.gz --workers 8
+"""
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check that every map of saved ensembles is a valid districting plan.")
+    parser.add_argument("files", type=Path, nargs="+")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--epsilon", type=float, default=None, help="population balance to check instead of each ensemble's epsilon")
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level)
+    all_valid: bool = True
+    for file in args.files:
+        report: dict = validate_ensemble_file(file, args.workers, args.epsilon)
+        print(json.dumps(report, indent=4))
+        all_valid &= report["n_invalid"] == 0
+    if not all_valid:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
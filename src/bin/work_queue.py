@@ -0,0 +1,141 @@
+import argparse
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from itertools import groupby
+from pathlib import Path
+import consts
+import run_config
+from ..custom_types import VMDPartition, Ensemble
+from ..modules.ensemble_generation import EnsembleJob, gen_ensembles_scheduled
+from ..modules.job_queue import JobQueue, QueueJob, merge_results
+logger = logging.getLogger(__name__)
+
+"""
+Command line interface to the shared-filesystem job queue (see
+modules/job_queue.py). Submit batches of chains once, then start any number of
+workers on any machines that see the same project directory; each worker
+leases one batch at a time, keeps its lease alive with heartbeats while its
+process pool generates the maps, and saves the batch as an ensemble file.
+Batches of crashed workers are retried once their lease expires. When the
+queue is drained, merge combines the batches of each ensemble into one
+ensemble file.
+
+Example:
+    python -m src.bin.work_queue submit --states MD VA --district-type smd --seed-type actual --n-batches 100 --batch-size 10 --recom-steps 100 --epsilon 0.01
+    python -m src.bin.work_queue work --processes 16
+    python -m src.bin.work_queue status
+    python -m src.bin.work_queue merge
+"""
+
+
+def submit(queue: JobQueue, args: argparse.Namespace) -> None:
+    for state in args.states:
+        for _ in range(args.n_batches):
+            queue.submit(QueueJob(state, args.district_type, args.seed_type, args.recom_steps, args.epsilon, args.constraints, args.batch_size), args.max_attempts)
+    print(queue.counts())
+
+
+def run_job(queue: JobQueue, job: QueueJob, worker_id: str, n_processes: int, lease_seconds: float) -> None:
+    """Generates the maps of a leased job while a background thread heartbeats its lease, then saves and completes it."""
+
+    stop: threading.Event = threading.Event()
+    lost: threading.Event = threading.Event()
+    def heartbeat() -> None:
+        heartbeat_queue = JobQueue(queue.file) # sqlite connections can't be shared between threads
+        while not stop.wait(lease_seconds/3):
+            if not heartbeat_queue.heartbeat(job.id, worker_id, lease_seconds):
+                lost.set()
+                break
+        heartbeat_queue.close()
+    heartbeat_thread = threading.Thread(target=heartbeat, daemon=True) # safe to run while the pool starts, since its workers come from a forkserver (see utils.worker_context)
+    heartbeat_thread.start()
+    try:
+        random.seed(job.id) # the chain seeds are drawn from this, and every worker process starts from the same random state
+        seed_partition: VMDPartition = VMDPartition.from_file(job.seed_file())
+        ensemble: Ensemble = gen_ensembles_scheduled([EnsembleJob(seed_partition, job.batch_size, job.n_recom_steps, job.epsilon, job.seed_type, job.constraints)], n_processes)[0]
+        stop.set()
+        heartbeat_thread.join()
+        if lost.is_set():
+            logger.warning(f"lost the lease of job {job.id}; discarding its maps")
+            return
+        file: Path = job.ensemble_dirpath() / "queue_batches" / (consts.ENSEMBLE_FILENAME(ensemble) + f"-job{job.id}" + run_config.ARTIFACT_SUFFIX)
+        ensemble.to_file(file)
+        if not queue.complete(job.id, worker_id, file):
+            logger.warning(f"lost the lease of job {job.id} while saving it")
+    except Exception as e:
+        stop.set()
+        logger.exception(f"job {job.id} failed")
+        queue.fail(job.id, worker_id, repr(e))
+
+
+def work(queue: JobQueue, args: argparse.Namespace) -> None:
+    worker_id: str = args.worker_id if args.worker_id is not None else f"{socket.gethostname()}-{os.getpid()}"
+    logger.info(f"worker {worker_id} pulling jobs from {queue.file}")
+    while True:
+        job: QueueJob = queue.lease(worker_id, args.lease_seconds)
+        if job is None:
+            counts: dict[str, int] = queue.counts()
+            if counts["pending"] == 0 and counts["leased"] == 0:
+                logger.info("queue is drained")
+                break
+            time.sleep(args.poll_seconds) # other workers' leases may still expire
+            continue
+        logger.info(f"leased {job} (attempt {job.attempts})")
+        run_job(queue, job, worker_id, args.processes, args.lease_seconds)
+
+
+def status(queue: JobQueue, args: argparse.Namespace) -> None:
+    print(queue.counts())
+    for job in queue.jobs("failed"):
+        print(f"failed: {job}")
+
+
+def merge(queue: JobQueue, args: argparse.Namespace) -> None:
+    done: list[QueueJob] = sorted(queue.jobs("done"), key=lambda job: job.params())
+    for _, jobs in groupby(done, key=lambda job: job.params()):
+        jobs = list(jobs)
+        ensemble: Ensemble = merge_results(jobs)
+        file: Path = jobs[0].ensemble_dirpath() / (consts.ENSEMBLE_FILENAME(ensemble) + run_config.ARTIFACT_SUFFIX)
+        ensemble.to_file(file)
+        print(file)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Generate ensembles through a job queue on a shared filesystem.")
+    parser.add_argument("--queue", type=Path, default=consts.JOB_QUEUE_FILEPATH)
+    parser.add_argument("--log-level", default="INFO")
+    commands = parser.add_subparsers(dest="command", required=True)
+    submit_parser = commands.add_parser("submit", help="add batches of chains to the queue")
+    submit_parser.add_argument("--states", nargs="+", required=True)
+    submit_parser.add_argument("--district-type", choices=["smd", "mmd"], default="smd")
+    submit_parser.add_argument("--seed-type", default=consts.SMD_SEED_FILENAME)
+    submit_parser.add_argument("--n-batches", type=int, required=True)
+    submit_parser.add_argument("--batch-size", type=int, required=True)
+    submit_parser.add_argument("--recom-steps", type=int, default=run_config.SMD_NUM_RECOM_STEPS)
+    submit_parser.add_argument("--epsilon", type=float, default=run_config.SMD_EPSILON)
+    submit_parser.add_argument("--constraints", nargs="*", default=[])
+    submit_parser.add_argument("--max-attempts", type=int, default=3)
+    work_parser = commands.add_parser("work", help="lease and run jobs until the queue is drained")
+    work_parser.add_argument("--processes", type=int, default=os.cpu_count())
+    work_parser.add_argument("--lease-seconds", type=float, default=300)
+    work_parser.add_argument("--poll-seconds", type=float, default=30)
+    work_parser.add_argument("--worker-id", default=None)
+    commands.add_parser("status", help="print the number of jobs in each status, and the failed jobs")
+    commands.add_parser("merge", help="combine the finished batches of each ensemble into one ensemble file")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    logging.basicConfig(level=args.log_level)
+    queue = JobQueue(args.queue)
+    {"submit": submit, "work": work, "status": status, "merge": merge}[args.command](queue, args)
+    queue.close()
+
+
+if __name__ == "__main__":
+    main()
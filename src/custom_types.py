@@ -2,11 +2,13 @@ from __future__ import annotations
 from enum import Enum
 from gerrychain import Partition, Graph
 from gerrychain.updaters import cut_edges, Tally
-from geopandas import GeoSeries
 from typing import Callable, Dict, Union
-from .modules.utils import is_path_in_proj
+from .modules.utils import is_path_in_proj, load_state_graph
+from .modules.artifact_io import BackgroundWriter, read_artifact, write_artifact
+from .modules.adjacency import district_adjacency
 from pathlib import Path
 import jsonpickle
+import numpy as np
 import os
 import json
 import consts
@@ -18,6 +20,19 @@ RepsPerDistrict: type = Dict[int, int]
 Assignment: type = Dict[int, int]
 
 
+def vmd_updaters() -> dict[str, Callable]:
+    """
+    Fresh dict of the updaters every VMDPartition is built with. Pass it along
+    with use_default_updaters=False, since gerrychain otherwise adds the
+    updaters to its class-level default_updaters dict, which every Partition
+    shares.
+    """
+
+    return {consts.CUT_EDGE_UPDATER: cut_edges,
+            consts.POP_UPDATER: Tally(consts.POP_COL, consts.POP_UPDATER),
+            consts.DISTRICT_ADJACENCY_UPDATER: district_adjacency}
+
+
 class VMDPartition(Partition):
     """Class that extends Gerrychain Partition, adding a dict field mapping
     districts to the number of representatives in that district"""
@@ -40,28 +55,36 @@ class VMDPartition(Partition):
         """Loads partition data from json file and combines it with Graph data and optionally GeoSeries data."""
 
         logger.info(f"loading VMDPartition from {json_file}")
-        return VMDPartition.from_json_dict(json.loads(open(json_file, "r").read()), load_geoms)
+        return VMDPartition.from_json_dict(json.loads(read_artifact(json_file)), load_geoms)
 
     @staticmethod
     def from_json_dict(json_dict: dict, load_geoms: bool = False) -> VMDPartition:
         json_dict["assignment"] = {int(k): v for (k, v) in json_dict["assignment"].items()}
         json_dict["district_reps"] = {int(k): v for (k, v) in json_dict["district_reps"].items()}
-        prec_graph: Graph = Graph.from_json(consts.STATE_GRAPH_FILEPATH(json_dict["state"]))
-        if load_geoms:
-            prec_graph.geometry = GeoSeries.from_file(consts.STATE_GEOMETRY_FILEPATH(json_dict["state"]))
+        if load_geoms: # geometries are attached to the graph, so it can't be the shared one
+            prec_graph: Graph = Graph.from_json(consts.STATE_GRAPH_FILEPATH(json_dict["state"]))
+            from .modules.geometry_cache import load_state_geometries # only imported when geometries are needed, since geopandas is slow to import
+            prec_graph.geometry = load_state_geometries(json_dict["state"])
+        else:
+            prec_graph: Graph = load_state_graph(json_dict["state"])
         return VMDPartition(graph=prec_graph,  
                             assignment=json_dict["assignment"],
                             state=json_dict["state"],
                             district_reps=json_dict["district_reps"],
-                            updaters={consts.CUT_EDGE_UPDATER: cut_edges,
-                                      consts.POP_UPDATER: Tally(consts.POP_COL, consts.POP_UPDATER)})
+                            updaters=vmd_updaters(),
+                            use_default_updaters=False)
+
+    def to_file(self, file: Path, writer: BackgroundWriter = None) -> None: # maybe pass in a "filename formatter" function here like SMD_ENSEMBLE_FILENAME()
+        """Saves the partition, compressed according to the file extension, optionally through a BackgroundWriter."""
 
-    def to_file(self, file: Path) -> None: # maybe pass in a "filename formatter" function here like SMD_ENSEMBLE_FILENAME()
         if not is_path_in_proj(file):
             raise Exception("attempting to write in file outside of project directory")
         logger.info(f"saving VMDPartition to {file}")
-        file.parent.mkdir(exist_ok=True, parents=True)
-        open(file, "w+").write(json.dumps(self.to_json_dict()))
+        json_dict: dict = self.to_json_dict()
+        if writer is not None:
+            writer.submit(file, lambda: json.dumps(json_dict))
+        else:
+            write_artifact(file, json.dumps(json_dict))
 
     def to_json_dict(self) -> dict:
         return {"assignment": dict(self.assignment), "district_reps": self.district_reps, "state": self.state}
@@ -139,46 +162,59 @@ class Ballot:
     candidates.
 
     Fields:
-        choices_left: remaining list of ranked candidates on ballot that have
-        not yet been counted in a round of tabulation; the first element will be
-        the candidate that this ballot will next count for
+        choices: full ranked list of candidates on ballot
+        choice_idx: cursor into choices pointing at the candidate that this
+        ballot will next count for; choices before it have already been
+        counted in a previous round of tabulation
         was_transferred: flag to prevent double transfer of the same ballot
         during a surplus tabulation round in which there are multiple winners
         weight: used for summing the vote count for a candidate when this
         ballot is tabulated; is reweighted every surplus tabulation round
+        count: number of identical ballots this ballot stands for; each one
+        counts with the full weight, so a group of voters with the same ranking
+        can be tabulated as one ballot
 
     Methods:
-        curr_choice: returns candidate that this ballot will next count for (0th
-        element of choices_left)
-        next_continuing_choice: pops candidates from front of choices_left until
-        a continuing candidate is at the front; used after each round to
-        'transfer' a vote to the next candidate on that ballot
+        curr_choice: returns candidate that this ballot will next count for
+        (element of choices at choice_idx)
+        next_continuing_choice: advances choice_idx until it points at a
+        continuing candidate; used after each round to 'transfer' a vote to the
+        next candidate on that ballot
+        is_exhausted: whether every candidate on the ballot has been passed
     """
 
-    choices_left: list[Candidate]
+    choices: list[Candidate]
+    choice_idx: int
     was_transferred: bool = False
     weight: float = float(1)
+    count: int
 
-    def __init__(self, ranked_choices: list[Candidate]) -> None:
-        self.choices_left = ranked_choices
+    def __init__(self, ranked_choices: list[Candidate], count: int = 1) -> None:
+        self.choices = ranked_choices
+        self.choice_idx = 0
+        self.count = count
 
     def curr_choice(self) -> Candidate:
-        return self.choices_left[0]
+        return self.choices[self.choice_idx]
 
     def next_continuing_choice(self, continuing_candidates: set[Candidate]) -> None:
-        self.choices_left.pop(0)
-        while len(self.choices_left) > 0 and self.choices_left[0] not in continuing_candidates:
-            self.choices_left.pop(0)
+        self.choice_idx += 1
+        while self.choice_idx < len(self.choices) and self.choices[self.choice_idx] not in continuing_candidates:
+            self.choice_idx += 1
+
+    def is_exhausted(self) -> bool:
+        return self.choice_idx >= len(self.choices)
 
     def __repr__(self) -> str:
-        return "choices = %s, weight = %f" % (str(self.choices_left), self.weight)
+        return "choices = %s, weight = %f, count = %d" % (str(self.choices[self.choice_idx:]), self.weight, self.count)
 
 
 class Ensemble():
     """
     Wrapper class for an ensemble, or collection of random maps. Contains fields
     to describe parameters used to generate ensemble and helper methods for
-    serialization.
+    serialization. The metadata dict holds anything else recorded about how the
+    ensemble was generated, such as its convergence diagnostics.
     """
 
     maps: list[Partition]
@@ -186,18 +222,20 @@ class Ensemble():
     epsilon: float
     seed_type: str
     constraints: list[str]
+    metadata: dict
 
-    def __init__(self, maps: list[Partition], n_recom_steps: int, epsilon: float, seed_type: str, constraints: list[str]) -> None:
+    def __init__(self, maps: list[Partition], n_recom_steps: int, epsilon: float, seed_type: str, constraints: list[str], metadata: dict = None) -> None:
         self.maps = maps
         self.n_recom_steps = n_recom_steps
         self.epsilon = epsilon
         self.seed_type = seed_type
         self.constraints = constraints
+        self.metadata = metadata if metadata is not None else {}
 
     @staticmethod
     def from_file(file: Path, load_geoms: bool = False) -> str:
         logger.info(f"loading Ensemble from {file}")
-        return Ensemble.from_json_dict(json.loads(open(file, "r").read()), load_geoms)
+        return Ensemble.from_json_dict(json.loads(read_artifact(file)), load_geoms)
 
     @staticmethod
     def from_json_dict(json_dict: dict, load_geoms: bool = False) -> VMDPartition:
@@ -206,21 +244,29 @@ class Ensemble():
                         json_dict["n_recom_steps"],
                         json_dict["epsilon"], 
                         json_dict["seed_type"], 
-                        json_dict["constraints"])
+                        json_dict["constraints"],
+                        json_dict.get("metadata"))
+
+    def to_file(self, file: Path, writer: BackgroundWriter = None) -> None: 
+        """Saves the ensemble, compressed according to the file extension, optionally through a BackgroundWriter."""
 
-    def to_file(self, file: Path) -> None: 
         if not is_path_in_proj(file):
             raise Exception("attempting to write in file outside of project directory")
         logger.info(f"saving Ensemble to {file}")
-        file.parent.mkdir(exist_ok=True, parents=True)
-        open(file, "w+").write(json.dumps(self.to_json_dict()))
+        if writer is not None:
+            writer.submit(file, lambda: json.dumps(self.to_json_dict()))
+        else:
+            write_artifact(file, json.dumps(self.to_json_dict()))
 
     def to_json_dict(self) -> dict: 
-        return {"maps": [map.to_json_dict() for map in self.maps],
-                "n_recom_steps": self.n_recom_steps,
+        """The maps are saved last so that EnsembleView can read the parameters without reading the maps."""
+
+        return {"n_recom_steps": self.n_recom_steps,
                 "epsilon": self.epsilon,
                 "seed_type": self.seed_type,
-                "constraints": self.constraints}
+                "constraints": self.constraints,
+                "metadata": self.metadata,
+                "maps": [map.to_json_dict() for map in self.maps]}
 
 
 Precinct: type = Dict[str, Union[int, str]]
@@ -243,11 +289,137 @@ class ElectionsResults:
     
     @staticmethod
     def from_file(file: Path) -> str:
-        return jsonpickle.decode(open(file, "r").read())
+        return jsonpickle.decode(read_artifact(file))
+
+    def to_file(self, file: Path, writer: BackgroundWriter = None) -> None:
+        """Saves the results, compressed according to the file extension, optionally through a BackgroundWriter."""
 
-    def to_file(self, file: Path) -> None:
         if not is_path_in_proj(file):
             raise Exception("attempting to write in file outside of project directory")
         logger.info(f"saving ElectionsResults to {file}")
-        file.parent.mkdir(exist_ok=True, parents=True)
-        open(file, "w+").write(jsonpickle.encode(self))
\ No newline at end of file
+        if writer is not None:
+            writer.submit(file, lambda: jsonpickle.encode(self))
+        else:
+            write_artifact(file, jsonpickle.encode(self))
+
+
+class MultiElectionsResults:
+    """
+    Results of several elections (e.g. 2016 and 2020 presidential votes) run on
+    the same ensemble with the same voting model and tabulator.
+
+    Fields:
+        results: state winners of each map, by election name
+        vote_cols: (democrat, republican) precinct vote columns, by election name
+        voting_model: name of the voting model
+        ensemble_name: name of the ensemble
+        tabulator: name of the tabulator
+    """
+
+    results: dict[str, list[list[Candidate]]]
+    vote_cols: dict[str, tuple[str, str]]
+    voting_model: str
+    ensemble_name: str
+    tabulator: str
+
+    def __init__(self, results: dict[str, list[list[Candidate]]], vote_cols: dict[str, tuple[str, str]], voting_model: str, ensemble_name: str, tabulator: str) -> None:
+        self.results = results
+        self.vote_cols = vote_cols
+        self.voting_model = voting_model
+        self.ensemble_name = ensemble_name
+        self.tabulator = tabulator
+
+    def elections(self) -> list[str]:
+        return list(self.results.keys())
+
+    def election(self, name: str) -> ElectionsResults:
+        return ElectionsResults(self.results[name], self.voting_model, self.ensemble_name, self.tabulator)
+
+    @staticmethod
+    def from_file(file: Path) -> MultiElectionsResults:
+        return jsonpickle.decode(read_artifact(file))
+
+    def to_file(self, file: Path, writer: BackgroundWriter = None) -> None:
+        """Saves the results of all elections to one file, compressed according to the file extension, optionally through a BackgroundWriter."""
+
+        if not is_path_in_proj(file):
+            raise Exception("attempting to write in file outside of project directory")
+        logger.info(f"saving MultiElectionsResults of elections {self.elections()} to {file}")
+        if writer is not None:
+            writer.submit(file, lambda: jsonpickle.encode(self))
+        else:
+            write_artifact(file, jsonpickle.encode(self))
+
+
+class ReplicateElectionsResults:
+    """
+    Results of many random replicates of the same election on every map of an
+    ensemble, from which the outcome distributions are estimated.
+
+    Fields:
+        dem_seats: democrat seats won in each replicate, as a list (maps) of
+        lists (districts, in district ID order) of lists (replicates)
+        district_reps: number of representatives of each district of each map
+        election: name of the election
+        voting_model: name of the voting model
+        ensemble_name: name of the ensemble
+        tabulator: name of the tabulator
+        seed: seed the replicate seeds were derived from
+    """
+
+    dem_seats: list[list[list[int]]]
+    district_reps: list[RepsPerDistrict]
+    election: str
+    voting_model: str
+    ensemble_name: str
+    tabulator: str
+    seed: int
+
+    def __init__(self, dem_seats: list[list[list[int]]], district_reps: list[RepsPerDistrict], election: str, voting_model: str, ensemble_name: str, tabulator: str, seed: int) -> None:
+        self.dem_seats = dem_seats
+        self.district_reps = district_reps
+        self.election = election
+        self.voting_model = voting_model
+        self.ensemble_name = ensemble_name
+        self.tabulator = tabulator
+        self.seed = seed
+
+    def n_replicates(self) -> int:
+        return len(self.dem_seats[0][0]) if self.dem_seats else 0
+
+    def district_seat_distributions(self, map_idx: int) -> dict[int, np.ndarray]:
+        """Returns, for each district of a map, the probability that democrats win 0, 1, ..., n_reps of its seats."""
+
+        return {districtID: np.bincount(seats, minlength=self.district_reps[map_idx][districtID]+1)/len(seats)
+                for districtID, seats in zip(sorted(self.district_reps[map_idx].keys()), self.dem_seats[map_idx])}
+
+    def district_win_probabilities(self, map_idx: int) -> dict[int, float]:
+        """Returns, for each district of a map, the probability that democrats win a majority of its seats (the seat itself for SMDs)."""
+
+        return {districtID: float(np.mean(2*np.array(seats) > self.district_reps[map_idx][districtID]))
+                for districtID, seats in zip(sorted(self.district_reps[map_idx].keys()), self.dem_seats[map_idx])}
+
+    def seat_distribution(self, map_idx: int = None) -> np.ndarray:
+        """
+        Returns the probability that democrats win 0, 1, ..., all seats of the
+        state, on one map or, if map_idx is None, over the whole ensemble.
+        """
+
+        maps: list[int] = [map_idx] if map_idx is not None else list(range(len(self.dem_seats)))
+        statewide_seats = np.concatenate([np.sum(self.dem_seats[m], axis=0) for m in maps])
+        return np.bincount(statewide_seats, minlength=sum(self.district_reps[maps[0]].values())+1)/len(statewide_seats)
+
+    @staticmethod
+    def from_file(file: Path) -> ReplicateElectionsResults:
+        return jsonpickle.decode(read_artifact(file))
+
+    def to_file(self, file: Path, writer: BackgroundWriter = None) -> None:
+        """Saves the replicate results, compressed according to the file extension, optionally through a BackgroundWriter."""
+
+        if not is_path_in_proj(file):
+            raise Exception("attempting to write in file outside of project directory")
+        logger.info(f"saving ReplicateElectionsResults with {self.n_replicates()} replicates to {file}")
+        if writer is not None:
+            writer.submit(file, lambda: jsonpickle.encode(self))
+        else:
+            write_artifact(file, jsonpickle.encode(self))
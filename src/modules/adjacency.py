@@ -0,0 +1,191 @@
+from __future__ import annotations
+from gerrychain import Partition
+from collections import Counter
+from typing import Iterator
+import random
+import consts
+import logging
+logger = logging.getLogger(__name__)
+
+"""
+This module contains an incremental updater for the cut edges and district
+adjacency of a partition. gerrychain's cut_edges updater builds a new set on
+every step, and picking a random cut edge from it means converting it to a list,
+which costs time proportional to the number of cut edges. Here the cut edges of
+a chain live in one shared indexed set (O(1) random choice) together with the
+number of boundary edges between every pair of adjacent districts, and both are
+updated in place from each step's flips.
+
+Since the structure is shared by all partitions of a chain, each partition gets
+a view that checks the structure out to that partition before reading it: moving
+from a partition to its child applies the child's flips, and moving back (e.g.
+from a proposal rejected by a constraint to the current state, or to a sibling
+proposal) undoes them. Any other jump rebuilds the structure from scratch.
+"""
+
+
+Edge = tuple[int, int]
+
+
+def canonical_edge(u: int, v: int) -> Edge:
+    return (u, v) if u < v else (v, u)
+
+
+class IndexedEdgeSet:
+    """Set of edges that also supports picking a uniformly random element in O(1), by keeping the edges in a list and swap-removing."""
+
+    items: list[Edge]
+    positions: dict[Edge, int]
+
+    def __init__(self) -> None:
+        self.items = []
+        self.positions = {}
+
+    def add(self, edge: Edge) -> None:
+        if edge not in self.positions:
+            self.positions[edge] = len(self.items)
+            self.items.append(edge)
+
+    def remove(self, edge: Edge) -> None:
+        idx: int = self.positions.pop(edge)
+        last: Edge = self.items.pop()
+        if idx < len(self.items):
+            self.items[idx] = last
+            self.positions[last] = idx
+
+    def choice(self) -> Edge:
+        return self.items[random.randrange(len(self.items))]
+
+    def __contains__(self, edge: Edge) -> bool:
+        return edge in self.positions
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __iter__(self) -> Iterator[Edge]:
+        return iter(self.items)
+
+
+class AdjacencyState:
+    """
+    Cut edges and district pair boundary edge counts of one chain, at the
+    partition given by version. undo holds the partition this state was at
+    before the last applied step and that step's changes.
+    """
+
+    cut_edges: IndexedEdgeSet
+    pair_counts: Counter
+    version: Partition
+    undo: tuple[Partition, list[tuple[Edge, Edge, Edge]]]
+
+    def __init__(self, partition: Partition) -> None:
+        self.rebuild(partition)
+
+    def rebuild(self, partition: Partition) -> None:
+        self.cut_edges = IndexedEdgeSet()
+        self.pair_counts = Counter()
+        for u, v in partition.graph.edges:
+            if partition.assignment[u] != partition.assignment[v]:
+                self.cut_edges.add(canonical_edge(u, v))
+                self.pair_counts[canonical_edge(partition.assignment[u], partition.assignment[v])] += 1
+        self.version = partition
+        self.undo = None
+
+    def _edit(self, edge: Edge, old_pair: Edge, new_pair: Edge) -> None:
+        """Moves an edge from being cut between old_pair to being cut between new_pair; a None pair means the edge is not cut."""
+
+        if old_pair is not None:
+            self.pair_counts[old_pair] -= 1
+            if self.pair_counts[old_pair] == 0:
+                del self.pair_counts[old_pair]
+            if new_pair is None:
+                self.cut_edges.remove(edge)
+        if new_pair is not None:
+            self.pair_counts[new_pair] += 1
+            if old_pair is None:
+                self.cut_edges.add(edge)
+
+    def apply(self, partition: Partition) -> None:
+        """Advances the state from partition's parent (the current version) to partition, looking only at the edges around the flipped precincts."""
+
+        parent: Partition = partition.parent
+        changes: list[tuple[Edge, Edge, Edge]] = []
+        seen: set[Edge] = set()
+        for node in partition.flips:
+            if parent.assignment[node] == partition.assignment[node]:
+                continue
+            for neighbor in partition.graph.neighbors(node):
+                edge: Edge = canonical_edge(node, neighbor)
+                if edge in seen:
+                    continue
+                seen.add(edge)
+                old_u, old_v = parent.assignment[node], parent.assignment[neighbor]
+                new_u, new_v = partition.assignment[node], partition.assignment[neighbor]
+                old_pair: Edge = canonical_edge(old_u, old_v) if old_u != old_v else None
+                new_pair: Edge = canonical_edge(new_u, new_v) if new_u != new_v else None
+                if old_pair != new_pair:
+                    self._edit(edge, old_pair, new_pair)
+                    changes.append((edge, old_pair, new_pair))
+        self.undo = (parent, changes)
+        self.version = partition
+
+    def revert(self) -> None:
+        parent, changes = self.undo
+        for edge, old_pair, new_pair in reversed(changes):
+            self._edit(edge, new_pair, old_pair)
+        self.version = parent
+        self.undo = None
+
+    def checkout(self, partition: Partition) -> None:
+        if self.version is partition:
+            return
+        if self.undo is not None and self.undo[0] is partition: # back from a child
+            self.revert()
+        elif partition.parent is not None and partition.parent is self.version: # forward to a child
+            self.apply(partition)
+        elif partition.parent is not None and self.undo is not None and self.undo[0] is partition.parent: # over to a sibling
+            self.revert()
+            self.apply(partition)
+        else:
+            logger.debug("rebuilding district adjacency from scratch")
+            self.rebuild(partition)
+
+
+class DistrictAdjacency:
+    """
+    View of the shared AdjacencyState at one partition, returned by the
+    district_adjacency updater.
+    """
+
+    state: AdjacencyState
+    partition: Partition
+
+    def __init__(self, state: AdjacencyState, partition: Partition) -> None:
+        self.state = state
+        self.partition = partition
+
+    def _checkout(self) -> AdjacencyState:
+        self.state.checkout(self.partition)
+        return self.state
+
+    def random_cut_edge(self) -> Edge:
+        return self._checkout().cut_edges.choice()
+
+    def n_cut_edges(self) -> int:
+        return len(self._checkout().cut_edges)
+
+    def cut_edges(self) -> list[Edge]:
+        return list(self._checkout().cut_edges)
+
+    def district_pairs(self) -> dict[Edge, int]:
+        """Returns every pair of adjacent districts with the number of edges on their shared boundary."""
+
+        return dict(self._checkout().pair_counts)
+
+
+def district_adjacency(partition: Partition) -> DistrictAdjacency:
+    """Updater giving the DistrictAdjacency of a partition; children share their parent's state."""
+
+    if partition.parent is None:
+        return DistrictAdjacency(AdjacencyState(partition), partition)
+    return DistrictAdjacency(partition.parent[consts.DISTRICT_ADJACENCY_UPDATER].state, partition)
@@ -0,0 +1,125 @@
+from pathlib import Path
+from typing import Callable
+from threading import Thread
+from queue import Queue
+import gzip
+import lzma
+import os
+import logging
+logger = logging.getLogger(__name__)
+
+"""
+This module contains the reading and writing of saved artifacts (seeds,
+ensembles and election results). Artifacts are compressed with the stdlib
+compressor matching their file extension (.gz or .xz/.lzma) and written
+atomically through a temporary file. Reads detect compression from the file
+contents, so callers never need to know how an artifact was saved, and a path
+given without an extension also finds its compressed version.
+
+BackgroundWriter serializes, compresses and writes artifacts on a separate
+thread so that generation does not stall on I/O.
+"""
+
+
+COMPRESSED_OPENERS: dict[str, Callable] = {".gz": lambda f, mode: gzip.open(f, mode, compresslevel=6),
+                                           ".xz": lzma.open,
+                                           ".lzma": lzma.open}
+MAGIC_OPENERS: list[tuple[bytes, Callable]] = [(b"\x1f\x8b", gzip.open),
+                                               (b"\xfd7zXZ\x00", lzma.open)]
+
+
+def resolve_artifact(file: Path) -> Path:
+    """Returns the file, or its compressed version if only that exists."""
+
+    file = Path(file)
+    if not file.exists():
+        for suffix in COMPRESSED_OPENERS:
+            compressed: Path = file.with_name(file.name + suffix)
+            if compressed.exists():
+                return compressed
+    return file
+
+
+def write_artifact(file: Path, text: str) -> None:
+    file.parent.mkdir(exist_ok=True, parents=True)
+    tmp_file: Path = file.with_name(file.name + ".tmp")
+    opener: Callable = COMPRESSED_OPENERS.get(file.suffix, open)
+    with opener(tmp_file, "wt") as f:
+        f.write(text)
+    os.replace(tmp_file, file)
+
+
+def open_artifact(file: Path):
+    """Opens an artifact for reading as text, decompressing it if needed."""
+
+    file = resolve_artifact(file)
+    with open(file, "rb") as f:
+        head: bytes = f.read(6)
+    for magic, opener in MAGIC_OPENERS:
+        if head.startswith(magic):
+            return opener(file, "rt")
+    return open(file, "r")
+
+
+def read_artifact(file: Path) -> str:
+    with open_artifact(file) as f:
+        return f.read()
+
+
+class BackgroundWriter:
+    """
+    Writes artifacts on a background thread. submit() takes a function that
+    serializes the artifact, so serialization and compression also happen off
+    the calling thread. The queue is bounded so that at most max_pending
+    artifacts wait in memory; submit() blocks when it is full. Use as a context
+    manager, or call close() to wait for every pending write. Errors raised
+    while writing are re-raised by close(), except when the with block is
+    already exiting on an exception, which then propagates instead.
+    """
+
+    queue: Queue
+    thread: Thread
+    errors: list[Exception]
+
+    def __init__(self, max_pending: int = 2) -> None:
+        self.queue = Queue(maxsize=max_pending)
+        self.errors = []
+        self.thread = Thread(target=self._run, name="artifact-writer", daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            file, serialize = item
+            try:
+                write_artifact(file, serialize())
+                logger.info(f"finished writing {file}")
+            except Exception as e:
+                logger.error(f"writing {file} failed: {e}")
+                self.errors.append(e)
+
+    def submit(self, file: Path, serialize: Callable[[], str]) -> None:
+        if not self.thread.is_alive():
+            raise Exception("background writer is closed")
+        self.queue.put((file, serialize))
+
+    def close(self) -> None:
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if self.errors:
+            raise self.errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if exc[0] is None:
+            self.close()
+            return
+        try:
+            self.close()
+        except Exception:
+            logger.exception("closing background writer failed while handling another exception")
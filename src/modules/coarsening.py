@@ -0,0 +1,270 @@
+from __future__ import annotations
+from collections import deque
+from gerrychain import Graph
+from ..custom_types import VMDPartition, vmd_updaters
+from .ensemble_view import MapRecord
+from .plan_hashing import plan_hash
+from .election import discover_vote_col_pairs
+import networkx as nx
+import numpy as np
+import random
+import consts
+import logging
+logger = logging.getLogger(__name__)
+
+"""
+This module contains an optional coarsening layer for ReCom on large states.
+Every ReCom step draws random spanning trees of two merged districts, so its
+cost grows with the number of precincts. Here adjacent precincts are contracted
+into super-nodes in a few rounds of matching (each round pairs every super-node
+with its lightest neighbor, so the graph roughly halves per round), until no
+two neighbors fit under a population cap given as a fraction of the ideal
+district population. Precincts are only merged within the same seed district
+and county (if the graph has a county column), so super-nodes never straddle
+those boundaries, and every super-node keeps the list of its precincts.
+
+Chains then run on the coarse graph and their maps are expanded back to
+precincts. Since a split of the coarse graph can only be as balanced as its
+super-nodes are small, coarse chains use a looser epsilon, and an optional
+refinement pass moves single boundary precincts between districts until every
+district is within the real epsilon. The population cap is the tradeoff:
+larger super-nodes mean fewer nodes and faster steps, but coarser district
+boundaries and more refinement; CoarseGraph.stats() reports both sides.
+"""
+
+
+class CoarseGraph:
+    """
+    Contraction of a state graph into population-weighted super-nodes.
+
+    Fields:
+        graph: the coarse graph; each node sums the population, vote and
+        compactness columns of its precincts and has the DISTRICTNO of its
+        seed district, and each edge has the number of precinct edges it
+        stands for and their total shared_perim
+        members: precinct IDs of each super-node
+        node_of: super-node of each precinct, indexed by precinct ID
+        state: state of the precinct graph
+        max_pop_fraction: population cap of the super-nodes, as a fraction of
+        the ideal district population
+        ideal_pop: state population per representative
+        n_prec_edges: number of edges of the precinct graph
+    """
+
+    graph: Graph
+    members: list[list[int]]
+    node_of: np.ndarray
+    state: str
+    max_pop_fraction: float
+    ideal_pop: float
+    n_prec_edges: int
+
+    def __init__(self, graph: Graph, members: list[list[int]], state: str, max_pop_fraction: float, ideal_pop: float, n_prec_edges: int) -> None:
+        self.graph = graph
+        self.members = members
+        self.node_of = np.empty(sum(len(m) for m in members), dtype=np.int64)
+        for node, precIDs in enumerate(members):
+            self.node_of[precIDs] = node
+        self.state = state
+        self.max_pop_fraction = max_pop_fraction
+        self.ideal_pop = ideal_pop
+        self.n_prec_edges = n_prec_edges
+
+    def coarsen_partition(self, partition: VMDPartition) -> VMDPartition:
+        """Coarse version of a precinct partition, whose districts must not split any super-node (e.g. the seed the graph was built from)."""
+
+        assignment: dict[int, int] = {node: partition.assignment[precIDs[0]] for node, precIDs in enumerate(self.members)}
+        return VMDPartition(graph=self.graph, assignment=assignment, state=partition.state, district_reps=partition.district_reps,
+                            updaters=vmd_updaters(), use_default_updaters=False)
+
+    def uncoarsen_partition(self, partition: VMDPartition, prec_graph: Graph) -> VMDPartition:
+        """Expands a partition of the coarse graph to the precincts."""
+
+        assignment: dict[int, int] = {precID: districtID for node, districtID in partition.assignment.items() for precID in self.members[node]}
+        return VMDPartition(graph=prec_graph, assignment=assignment, state=self.state, district_reps=partition.district_reps,
+                            updaters=vmd_updaters(), use_default_updaters=False)
+
+    def stats(self) -> dict:
+        """Speedup versus fidelity numbers of the coarsening."""
+
+        n_prec_edges: int = sum(d["n_prec_edges"] for _, _, d in self.graph.edges(data=True))
+        pops = np.array([self.graph.nodes[n][consts.POP_COL] for n in self.graph.nodes], dtype=float)
+        return {"n_precincts": len(self.node_of),
+                "n_nodes": len(self.members),
+                "node_reduction": len(self.node_of)/len(self.members),
+                "max_pop_fraction": self.max_pop_fraction,
+                "largest_node_pop_fraction": float(pops.max()/self.ideal_pop),
+                "boundary_edge_fraction": n_prec_edges/self.n_prec_edges} # fraction of precinct edges that district boundaries can still cut
+
+
+def county_col(graph: Graph) -> str:
+    """Returns the first of consts.COUNTY_COLS that the graph's precincts have, or None."""
+
+    attrs: dict = graph.nodes[next(iter(graph.nodes))]
+    return next((col for col in consts.COUNTY_COLS if col in attrs), None)
+
+
+def coarse_shape_attrs(prec_graph: Graph, precIDs: list[int]) -> dict:
+    """
+    Compactness attributes of a super-node, so that the compactness
+    constraints work on the coarse graph: the total area of its precincts,
+    whether any of them is on the state boundary, and their total
+    boundary_perim. Attributes the precincts don't have are left out.
+    """
+
+    attrs: dict = {}
+    precincts: list[dict] = [prec_graph.nodes[p] for p in precIDs]
+    if all("area" in prec for prec in precincts):
+        attrs["area"] = sum(prec["area"] for prec in precincts)
+    boundary: list[dict] = [prec for prec in precincts if prec.get("boundary_node", False)]
+    if boundary:
+        attrs["boundary_node"] = True
+        if all("boundary_perim" in prec for prec in boundary):
+            attrs["boundary_perim"] = sum(prec["boundary_perim"] for prec in boundary)
+    return attrs
+
+
+def coarsen_graph(partition: VMDPartition, max_pop_fraction: float, max_levels: int = 10) -> CoarseGraph:
+    """
+    Contracts the precincts of a partition's graph into super-nodes of at most
+    max_pop_fraction times the ideal district population, without crossing
+    the partition's district boundaries or county lines.
+
+    Arguments:
+        partition: precinct partition whose districts bound the super-nodes, usually a chain's seed
+        max_pop_fraction: population cap of the super-nodes, as a fraction of the ideal district population
+        max_levels: maximum number of matching rounds
+    Returns:
+        the CoarseGraph, which only depends on the partition and
+        max_pop_fraction: the matching order is shuffled with a random
+        generator seeded by both, so every chain and worker coarsening the same
+        seed gets the same graph
+    """
+
+    rng = random.Random(f"{plan_hash(MapRecord.from_partition(partition))}-{max_pop_fraction}")
+    prec_graph: Graph = partition.graph
+    ideal_pop: float = sum(partition[consts.POP_UPDATER].values())/sum(partition.district_reps.values())
+    max_pop: float = max_pop_fraction*ideal_pop
+    county: str = county_col(prec_graph)
+    group: dict[int, tuple] = {p: (partition.assignment[p], prec_graph.nodes[p][county] if county is not None else None) for p in prec_graph.nodes}
+    pop: dict[int, float] = {p: prec_graph.nodes[p][consts.POP_COL] for p in prec_graph.nodes}
+    members: dict[int, list[int]] = {p: [p] for p in prec_graph.nodes}
+    adj: dict[int, set[int]] = {p: {q for q in prec_graph.neighbors(p) if group[q] == group[p]} for p in prec_graph.nodes}
+
+    for level in range(max_levels):
+        matched: set[int] = set()
+        merges: list[tuple[int, int]] = []
+        order: list[int] = list(members.keys())
+        rng.shuffle(order)
+        for node in order:
+            if node in matched:
+                continue
+            candidates: list[int] = [n for n in adj[node] if n not in matched and pop[node] + pop[n] <= max_pop]
+            if candidates:
+                neighbor: int = min(candidates, key=pop.get)
+                matched |= {node, neighbor}
+                merges.append((node, neighbor))
+        if not merges:
+            break
+        for node, neighbor in merges:
+            members[node].extend(members.pop(neighbor))
+            pop[node] += pop.pop(neighbor)
+            for n in adj.pop(neighbor):
+                adj[n].discard(neighbor)
+                if n != node:
+                    adj[n].add(node)
+                    adj[node].add(n)
+            adj[node].discard(node)
+        logger.debug(f"coarsening level {level}: {len(members)} nodes")
+
+    vote_cols: list[str] = [col for pair in discover_vote_col_pairs(prec_graph) for col in pair]
+    node_members: list[list[int]] = [sorted(m) for m in members.values()]
+    node_of: dict[int, int] = {p: node for node, precIDs in enumerate(node_members) for p in precIDs}
+    coarse = nx.Graph()
+    for node, precIDs in enumerate(node_members):
+        coarse.add_node(node, **{col: sum(prec_graph.nodes[p][col] for p in precIDs) for col in [consts.POP_COL] + vote_cols},
+                        **{consts.DISTRICT_NO_COL: partition.assignment[precIDs[0]]}, **coarse_shape_attrs(prec_graph, precIDs))
+    for u, v, attrs in prec_graph.edges(data=True):
+        if node_of[u] != node_of[v]:
+            if not coarse.has_edge(node_of[u], node_of[v]):
+                coarse.add_edge(node_of[u], node_of[v], n_prec_edges=0, shared_perim=0)
+            coarse.edges[node_of[u], node_of[v]]["n_prec_edges"] += 1
+            coarse.edges[node_of[u], node_of[v]]["shared_perim"] += attrs.get("shared_perim", 0)
+    coarse_graph = CoarseGraph(Graph.from_networkx(coarse), node_members, partition.state, max_pop_fraction, ideal_pop, prec_graph.number_of_edges())
+    logger.info(f"coarsened {len(prec_graph.nodes)} precincts into {len(node_members)} nodes (county column {county}): {coarse_graph.stats()}")
+    return coarse_graph
+
+
+_coarse_graphs: dict[tuple[str, float], CoarseGraph] = {}
+
+
+def load_coarse_graph(partition: VMDPartition, max_pop_fraction: float) -> CoarseGraph:
+    """Coarsens a seed partition's graph once per process, so worker processes reuse the coarse graph across all chains from the same seed."""
+
+    key: tuple[str, float] = (plan_hash(MapRecord.from_partition(partition)), max_pop_fraction)
+    if key not in _coarse_graphs:
+        _coarse_graphs[key] = coarsen_graph(partition, max_pop_fraction)
+    return _coarse_graphs[key]
+
+
+def _stays_connected(partition: VMDPartition, precID: int, districtID: int) -> bool:
+    """Whether a district is still connected (and nonempty) without one of its precincts."""
+
+    nodes: frozenset = partition.parts[districtID]
+    neighbors: list[int] = [n for n in partition.graph.neighbors(precID) if n in nodes]
+    if not neighbors:
+        return False
+    seen: set[int] = {precID, neighbors[0]}
+    queue: deque = deque([neighbors[0]])
+    while queue:
+        for n in partition.graph.neighbors(queue.popleft()):
+            if n in nodes and n not in seen:
+                seen.add(n)
+                queue.append(n)
+    return len(seen) == len(nodes)
+
+
+def refine_population(partition: VMDPartition, epsilon: float, max_moves: int = 10000) -> VMDPartition:
+    """
+    Rebalances the district populations of a precinct partition to within
+    epsilon by moving single boundary precincts. Each move takes the district
+    furthest from its target population and moves the boundary precinct (into
+    or out of it, from or to a neighboring district) that most reduces the
+    larger relative deviation of the two districts, keeping both contiguous.
+
+    Arguments:
+        partition: precinct partition, e.g. an uncoarsened coarse chain map
+        epsilon: acceptable relative population error of each district
+        max_moves: maximum number of precinct moves
+    Returns:
+        the rebalanced partition
+    """
+
+    ideal_pop: float = sum(partition[consts.POP_UPDATER].values())/sum(partition.district_reps.values())
+    for move in range(max_moves):
+        pops: dict[int, float] = partition[consts.POP_UPDATER]
+        deviation = lambda d, change=0: (pops[d] + change)/(ideal_pop*partition.district_reps[d]) - 1
+        worst: int = max(pops, key=lambda d: abs(deviation(d)))
+        if abs(deviation(worst)) <= epsilon:
+            logger.debug(f"refined population balance with {move} precinct moves")
+            return partition
+        moves: list[tuple[float, int, int, int]] = []
+        for u, v in partition[consts.DISTRICT_ADJACENCY_UPDATER].cut_edges():
+            for precID, other in ((u, v), (v, u)):
+                source, target = partition.assignment[precID], partition.assignment[other]
+                if not ((source == worst and deviation(worst) > 0) or (target == worst and deviation(worst) < 0)):
+                    continue
+                prec_pop: float = partition.graph.nodes[precID][consts.POP_COL]
+                new_deviation: float = max(abs(deviation(source, -prec_pop)), abs(deviation(target, prec_pop)))
+                if new_deviation < max(abs(deviation(source)), abs(deviation(target))):
+                    moves.append((new_deviation, precID, source, target))
+        moves.sort()
+        move_found: bool = False
+        for _, precID, source, target in moves:
+            if _stays_connected(partition, precID, source):
+                partition = partition.flip({precID: target})
+                move_found = True
+                break
+        if not move_found:
+            break
+    raise Exception(f"refinement failed; could not bring every district within {epsilon} of its target population")
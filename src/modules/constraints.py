@@ -0,0 +1,186 @@
+from gerrychain import Partition
+from typing import Callable
+from collections import deque
+from ..custom_types import VMDPartition
+import math
+import consts
+import logging
+logger = logging.getLogger(__name__)
+
+"""
+This module contains validity constraints for VMD Markov chains that only look
+at the districts changed by the most recent step, instead of recomputing over
+every precinct like gerrychain's built-in constraints. A vmd_recom step only
+redraws the two merged districts, so each check costs time proportional to the
+size of those two districts.
+
+Constraints are referred to by name in the constraints list passed to
+gen_random_map and stored in the Ensemble (and so in the ensemble filename). A
+name can carry a parameter after a colon, e.g. "pop_balance:0.02" or
+"cut_edge_bound:1.5"; get_constraints() turns the names into the callables
+that are passed to MarkovChain.
+"""
+
+
+def changed_districts(partition: Partition) -> set[int]:
+    """
+    Returns the districts changed by the step that produced this partition, or
+    every district if it has no parent (e.g. the initial state of a chain).
+    """
+
+    if partition.parent is None or not partition.flips:
+        return set(partition.parts.keys())
+    return set(partition.flips.values()) | {partition.parent.assignment[p] for p in partition.flips}
+
+
+def contiguous_changed_districts(partition: Partition) -> bool:
+    """Checks that every changed district is connected with a breadth first search restricted to that district."""
+
+    for districtID in changed_districts(partition):
+        nodes = partition.parts[districtID]
+        if len(nodes) == 0:
+            return False
+        start: int = next(iter(nodes))
+        seen: set[int] = {start}
+        queue: deque = deque([start])
+        while queue:
+            for neighbor in partition.graph.neighbors(queue.popleft()):
+                if neighbor in nodes and neighbor not in seen:
+                    seen.add(neighbor)
+                    queue.append(neighbor)
+        if len(seen) != len(nodes):
+            logger.debug(f"district {districtID} is not contiguous")
+            return False
+    return True
+
+
+class PopulationBalance:
+    """
+    Checks that the population of every changed district is within epsilon of
+    the ideal population scaled by its number of representatives, i.e.
+    |pop - ideal*reps| <= epsilon*ideal*reps, where ideal is the state
+    population per representative. The population updater is already a Tally
+    that updates from the flips, and the state population is only summed once.
+    """
+
+    epsilon: float
+    ideal_pop: float
+
+    def __init__(self, epsilon: float) -> None:
+        self.epsilon = epsilon
+        self.ideal_pop = None
+        self.__name__ = self.__class__.__name__ # MarkovChain reports failed constraints by name
+
+    def __call__(self, partition: VMDPartition) -> bool:
+        district_pops: dict[int, float] = partition[consts.POP_UPDATER]
+        if self.ideal_pop is None:
+            self.ideal_pop = sum(district_pops.values())/sum(partition.district_reps.values())
+        for districtID in changed_districts(partition):
+            target: float = self.ideal_pop*partition.district_reps[districtID]
+            if abs(district_pops[districtID] - target) > self.epsilon*target:
+                logger.debug(f"district {districtID} population {district_pops[districtID]} is not within {self.epsilon} of {target}")
+                return False
+        return True
+
+
+class CutEdgeBound:
+    """
+    Compactness bound on the number of cut edges. The bound is set to factor
+    times the cut edge count of the first partition checked, which is the
+    initial state of the chain. The district adjacency updater already updates
+    from the flips of each step.
+    """
+
+    factor: float
+    bound: float
+
+    def __init__(self, factor: float) -> None:
+        self.factor = factor
+        self.bound = None
+        self.__name__ = self.__class__.__name__ # MarkovChain reports failed constraints by name
+
+    def __call__(self, partition: Partition) -> bool:
+        n_cut_edges: int = partition[consts.DISTRICT_ADJACENCY_UPDATER].n_cut_edges()
+        if self.bound is None:
+            self.bound = self.factor*n_cut_edges
+        return n_cut_edges <= self.bound
+
+
+def polsby_popper(partition: Partition, districtID: int) -> float:
+    """
+    Computes the Polsby-Popper score 4*pi*area/perimeter^2 of a district from
+    the precinct area and boundary_perim attributes and the shared_perim of the
+    cut edges around the district. Edges without a shared_perim (e.g. water
+    crossings) add nothing to the perimeter, but precincts without an area, or
+    on the state boundary without a boundary_perim, are an error, since the
+    score would silently be wrong.
+    """
+
+    nodes = partition.parts[districtID]
+    area: float = 0
+    perimeter: float = 0
+    for node in nodes:
+        attrs: dict = partition.graph.nodes[node]
+        if "area" not in attrs:
+            raise Exception(f"precinct {node} has no area attribute, which polsby_popper_bound needs")
+        area += attrs["area"]
+        if attrs.get("boundary_node", False):
+            if "boundary_perim" not in attrs:
+                raise Exception(f"boundary precinct {node} has no boundary_perim attribute, which polsby_popper_bound needs")
+            perimeter += attrs["boundary_perim"]
+        for neighbor in partition.graph.neighbors(node):
+            if neighbor not in nodes:
+                perimeter += partition.graph.edges[node, neighbor].get("shared_perim", 0)
+    return 4*math.pi*area/perimeter**2 if perimeter > 0 else 0
+
+
+class PolsbyPopperBound:
+    """
+    Compactness bound requiring each changed district's Polsby-Popper score to
+    be at least factor times the lowest score among the districts of the first
+    partition checked (the initial state of the chain). Needs the area,
+    boundary_perim and shared_perim attributes of the state graph.
+    """
+
+    factor: float
+    bound: float
+
+    def __init__(self, factor: float) -> None:
+        self.factor = factor
+        self.bound = None
+        self.__name__ = self.__class__.__name__ # MarkovChain reports failed constraints by name
+
+    def __call__(self, partition: Partition) -> bool:
+        scores: list[float] = [polsby_popper(partition, d) for d in changed_districts(partition)]
+        if self.bound is None:
+            self.bound = self.factor*min(scores)
+        return min(scores) >= self.bound
+
+
+CONSTRAINTS: dict[str, Callable[[float, float], Callable[[Partition], bool]]] = {
+    "contiguous": lambda epsilon, param: contiguous_changed_districts,
+    "pop_balance": lambda epsilon, param: PopulationBalance(param if param is not None else epsilon),
+    "cut_edge_bound": lambda epsilon, param: CutEdgeBound(param if param is not None else 2),
+    "polsby_popper_bound": lambda epsilon, param: PolsbyPopperBound(param if param is not None else 0.5),
+}
+
+
+def get_constraints(names: list[str], epsilon: float) -> list[Callable[[Partition], bool]]:
+    """
+    Builds fresh constraint callables for one chain from their names.
+
+    Arguments:
+        names: constraint names, each optionally followed by ":<parameter>"
+        epsilon: population error threshold of the chain, used by pop_balance
+        when no parameter is given
+    Returns:
+        list of constraints that can be passed to MarkovChain
+    """
+
+    constraints: list[Callable[[Partition], bool]] = []
+    for name in names:
+        key, _, param = name.partition(":")
+        if key not in CONSTRAINTS:
+            raise Exception(f"unknown constraint {name}; available constraints are {list(CONSTRAINTS.keys())}")
+        constraints.append(CONSTRAINTS[key](epsilon, float(param) if param else None))
+    return constraints
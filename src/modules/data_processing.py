@@ -1,18 +1,19 @@
 from gerrychain import Graph, Partition
-from geopandas import GeoSeries
 import os
 import consts
 from pathlib import Path
 import run_config
-from ..custom_types import VMDPartition, ElectionsResults, Ensemble, VotingComparator, Tabulator
-from gerrychain.updaters import Tally, cut_edges
+from ..custom_types import VMDPartition, MultiElectionsResults, ReplicateElectionsResults, Ensemble, VotingComparator, Tabulator, vmd_updaters
 import logging
 logger = logging.getLogger(__name__)
-from .ensemble_generation import gen_ensemble, gen_ensemble_parallel
+from .ensemble_generation import gen_ensemble, gen_ensemble_parallel, gen_ensembles_scheduled, EnsembleJob
 from .mmd_seed_generation import gen_mmd_seed_partition, pick_HR_3863_desired_mmd_config 
-from .election import run_many_statewide_elections_on_ensemble_parallel
+from .election import run_many_statewide_multi_elections_on_ensemble_scheduled, run_election_replicates_on_ensemble_scheduled, configured_vote_col_pairs
+from .outliers import OutlierAnalyzer, sketch_ensemble_files
+from .ensemble_view import MapRecord
 import json
 import jsonpickle
+from .artifact_io import BackgroundWriter, COMPRESSED_OPENERS, write_artifact
 
 """
 This module contains various methods for formatting data.
@@ -32,6 +33,8 @@ GeoSeries.to_file() method. The graph and geometries can be deserialized into
 the original GeoSeries and gerrychain.Graph using the
 gerrychain.Graph.from_json() and the GeoSeries.from_file() methods,
 respectively.
+The geometries are read through a columnar cache of the .gpkg (see
+geometry_cache.py), which is built on first use.
 
 Each uniquely partitioned map (seed district or element of an ensemble) is
 stored in a serialized VMDPartition .json file containing only the assignment
@@ -51,13 +54,14 @@ as well as the generated seed districts, ensembles in the serialized VMDPartitio
 """
 
 
-def gen_smd_seeds(states: list[str]) -> None: 
+def gen_smd_seeds(states: list[str]) -> list[Path]: 
     """
     Generates first serialized VMDPartition .json files by taking the
     original Graph and saving their seed .jsons. Walks through each state
-    directory and saves seed to seeds directory.
+    directory and saves seed to seeds directory. Returns the saved files.
     """
 
+    files: list[Path] = []
     for state in states:
         prec_graph: Graph = Graph.from_json(os.path.join(consts.STATE_DIRPATH(state), consts.STATE_GRAPH_FILENAME)) 
         n_districts: int = len(Partition(graph=prec_graph, assignment=consts.DISTRICT_NO_COL).parts) # find a cleaner way of counting the number of districts
@@ -65,40 +69,124 @@ def gen_smd_seeds(states: list[str]) -> None:
                                                assignment=consts.DISTRICT_NO_COL, 
                                                state=state, 
                                                district_reps=dict.fromkeys(range(1, n_districts+1), 1),
-                                               updaters={consts.CUT_EDGE_UPDATER: cut_edges, consts.POP_UPDATER: Tally(consts.POP_COL, consts.POP_UPDATER)})
+                                               updaters=vmd_updaters(),
+                                               use_default_updaters=False)
         os.makedirs(consts.SMD_SEEDS_DIRPATH(state), exist_ok=True)
-        partition.to_file(consts.SMD_SEEDS_DIRPATH(state) / "actual") 
+        files.append(consts.SMD_SEEDS_DIRPATH(state) / ("actual" + run_config.ARTIFACT_SUFFIX))
+        partition.to_file(files[-1])
+    return files
 
 
-def gen_mmd_seeds(mmd_choosing_strategy, states: list[str]) -> None:
+def gen_mmd_seeds(mmd_choosing_strategy, states: list[str]) -> list[Path]:
     """
     Loads each VMDPartition .json SMD seed, converts it to an MMD partition
-    using the mmd_choosing_strategy, and saves it to a file.
+    using the mmd_choosing_strategy, and saves it to a file. Returns the saved
+    files.
     """
 
+    files: list[Path] = []
     for state in states:
         smd_seed: VMDPartition = VMDPartition.from_file(consts.SMD_SEEDS_DIRPATH(state) / "actual")
         mmd_seed: VMDPartition = gen_mmd_seed_partition(smd_seed, mmd_choosing_strategy)
-        mmd_seed.to_file(consts.MMD_SEEDS_DIRPATH(state) / mmd_choosing_strategy.__name__)
+        files.append(consts.MMD_SEEDS_DIRPATH(state) / (mmd_choosing_strategy.__name__ + run_config.ARTIFACT_SUFFIX))
+        mmd_seed.to_file(files[-1])
+    return files
 
         
-def gen_smd_ensembles(ensemble_size: int, n_recom_steps: int, epsilon: float, seed_type: str, constraints: list[str], states: list[str], n_workers: int) -> None:
-    for state in states:
-        smd_seed: VMDPartition = VMDPartition.from_file(consts.SMD_SEEDS_DIRPATH(state) / seed_type)
-        ensemble: Ensemble = gen_ensemble_parallel(smd_seed, ensemble_size, n_recom_steps, epsilon, seed_type, constraints, n_workers)
-        # ensemble: Ensemble = gen_ensemble(smd_seed, ensemble_size, n_recom_steps, epsilon, seed_type, constraints)
-        ensemble.to_file(consts.SMD_ENSEMBLE_DIRPATH(state) / consts.ENSEMBLE_FILENAME(ensemble))
+def gen_ensembles(jobs: list[EnsembleJob], dirpaths: list[Path], n_workers: int) -> list[Path]:
+    """
+    Generates the ensembles of any mix of states, seed types and ensemble sizes
+    together on one worker pool (see gen_ensembles_scheduled), writing each
+    ensemble to its directory in the background as soon as it is done. Returns
+    the saved files in the order of the jobs.
+    """
 
+    files: list[Path] = [None]*len(jobs)
+    with BackgroundWriter() as writer:
+        def write(job_idx: int, ensemble: Ensemble) -> None:
+            files[job_idx] = dirpaths[job_idx] / (consts.ENSEMBLE_FILENAME(ensemble) + run_config.ARTIFACT_SUFFIX)
+            ensemble.to_file(files[job_idx], writer)
+        gen_ensembles_scheduled(jobs, n_workers, write)
+    return files
+
+        
+def trajectory_files(state: str, district_type: str, ensemble_size: int, n_recom_steps: int, epsilon: float, seed_type: str, constraints: list[str]) -> list[Path]:
+    """Files to save the chain trajectories of an ensemble to, if run_config.SAVE_TRAJECTORIES is set (otherwise None)."""
+
+    if not run_config.SAVE_TRAJECTORIES:
+        return None
+    dirpath: Path = consts.TRAJECTORY_DIRPATH(state) / f"{district_type}-{seed_type}-{ensemble_size}-{constraints}-{n_recom_steps}-{epsilon}"
+    return [dirpath / (f"chain_{i}" + run_config.ARTIFACT_SUFFIX) for i in range(ensemble_size)]
 
-def gen_mmd_ensembles(ensemble_size: int, n_recom_steps: int, epsilon: float, seed_type: str, constraints: list[str], states: list[str], n_workers: int) -> None:
-    for state in states:
-        mmd_seed: VMDPartition = VMDPartition.from_file(consts.MMD_SEEDS_DIRPATH(state) / seed_type)
-        ensemble: Ensemble = gen_ensemble_parallel(mmd_seed, ensemble_size, n_recom_steps, epsilon, seed_type, constraints, n_workers)
-        # ensemble: Ensemble = gen_ensemble(mmd_seed, ensemble_size, n_recom_steps, epsilon, seed_type, constraints)
-        ensemble.to_file(consts.MMD_ENSEMBLE_DIRPATH(state) / consts.ENSEMBLE_FILENAME(ensemble))
 
+def gen_smd_ensembles(ensemble_size: int, n_recom_steps: int, epsilon: float, seed_type: str, constraints: list[str], states: list[str], n_workers: int) -> list[Path]:
+    jobs: list[EnsembleJob] = [EnsembleJob(VMDPartition.from_file(consts.SMD_SEEDS_DIRPATH(state) / seed_type), ensemble_size, n_recom_steps, epsilon, seed_type,
+                                           constraints, run_config.TARGET_ESS, run_config.TARGET_RHAT,
+                                           trajectory_files=trajectory_files(state, "smd", ensemble_size, n_recom_steps, epsilon, seed_type, constraints),
+                                           coarsening=run_config.COARSENING, refine=run_config.REFINE_COARSE_MAPS) for state in states]
+    return gen_ensembles(jobs, [consts.SMD_ENSEMBLE_DIRPATH(state) for state in states], n_workers)
+
+
+def gen_mmd_ensembles(ensemble_size: int, n_recom_steps: int, epsilon: float, seed_type: str, constraints: list[str], states: list[str], n_workers: int) -> list[Path]:
+    jobs: list[EnsembleJob] = [EnsembleJob(VMDPartition.from_file(consts.MMD_SEEDS_DIRPATH(state) / seed_type), ensemble_size, n_recom_steps, epsilon, seed_type,
+                                           constraints, run_config.TARGET_ESS, run_config.TARGET_RHAT,
+                                           trajectory_files=trajectory_files(state, "mmd", ensemble_size, n_recom_steps, epsilon, seed_type, constraints),
+                                           coarsening=run_config.COARSENING, refine=run_config.REFINE_COARSE_MAPS) for state in states]
+    return gen_ensembles(jobs, [consts.MMD_ENSEMBLE_DIRPATH(state) for state in states], n_workers)
+
+
+def run_election(ensemble_path: Path, voting_model: VotingComparator, tabulator: Tabulator, n_workers: int, state: str, vote_col_pairs: list[tuple[str, str]] = None) -> Path:
+    """
+    Runs the elections given by vote_col_pairs (by default
+    run_config.ELECTION_VOTE_TALLY_COLS, or every election found in the state
+    graph if that is None) on every map of an ensemble in one pass, and saves
+    all of their results to one MultiElectionsResults file. Returns the file.
+    """
 
-def run_election(ensemble_path: Path, voting_model: VotingComparator, tabulator: Tabulator, n_workers: int, state: str) -> None:
     ensemble = Ensemble.from_file(ensemble_path)
-    electionsresults: ElectionsResults = run_many_statewide_elections_on_ensemble_parallel(ensemble, voting_model, tabulator, n_workers)
-    electionsresults.to_file(consts.ELECTIONSRESULTS_DIRPATH(state) / consts.ELECTIONSRESULTS_FILENAME(electionsresults))
+    vote_col_pairs = vote_col_pairs if vote_col_pairs is not None else configured_vote_col_pairs(ensemble.maps[0].graph)
+    electionsresults: MultiElectionsResults = run_many_statewide_multi_elections_on_ensemble_scheduled(ensemble, vote_col_pairs, voting_model, tabulator, n_workers)
+    file: Path = consts.ELECTIONSRESULTS_DIRPATH(state) / (consts.ELECTIONSRESULTS_FILENAME(electionsresults) + run_config.ARTIFACT_SUFFIX)
+    electionsresults.to_file(file)
+    return file
+
+
+def run_election_replicates(ensemble_path: Path, voting_model: VotingComparator, tabulator: Tabulator, n_replicates: int, seed: int, n_workers: int, state: str) -> Path:
+    """Runs n_replicates seeded replicates of the run_config election on every map of an ensemble and saves their ReplicateElectionsResults. Returns the file."""
+
+    ensemble = Ensemble.from_file(ensemble_path)
+    replicateresults: ReplicateElectionsResults = run_election_replicates_on_ensemble_scheduled(ensemble, voting_model, tabulator, n_replicates, seed, n_workers)
+    file: Path = consts.ELECTIONSRESULTS_DIRPATH(state) / (consts.ELECTIONSRESULTS_FILENAME(replicateresults) + f"-{n_replicates}_replicates-{seed}" + run_config.ARTIFACT_SUFFIX)
+    replicateresults.to_file(file)
+    return file
+
+
+def artifact_name(file: Path) -> str:
+    """Name of an artifact file without its compression suffix."""
+
+    return file.name[:-len(file.suffix)] if file.suffix in COMPRESSED_OPENERS else file.name
+
+
+def analyze_plan_outliers(plan_file: Path, ensemble_paths: list[Path], state: str, n_workers: int, sketch_paths: list[Path] = None, vote_col_pairs: list[tuple[str, str]] = None) -> list[Path]:
+    """
+    Places a plan (e.g. the enacted plan, smd_seeds/actual) in the distribution
+    of map metrics over one or more ensembles (see outliers.OutlierAnalyzer),
+    with the partisan metrics of the elections given by vote_col_pairs (by
+    default those of configured_vote_col_pairs).
+    The ensembles are sketched in parallel without loading their maps, and the
+    sketches saved by earlier runs in sketch_paths are merged in. Saves the
+    merged sketches, so later runs can merge them too, and the plan's report.
+    Returns the report and sketch files.
+    """
+
+    plan_partition: VMDPartition = VMDPartition.from_file(plan_file)
+    analyzer: OutlierAnalyzer = sketch_ensemble_files(ensemble_paths, state, vote_col_pairs if vote_col_pairs is not None else configured_vote_col_pairs(plan_partition.graph), n_workers)
+    for sketch_path in sketch_paths or []:
+        analyzer.merge(OutlierAnalyzer.from_file(sketch_path))
+    name: str = f"{artifact_name(plan_file)}-vs-{'+'.join(sorted(artifact_name(p) for p in ensemble_paths))}"
+    os.makedirs(consts.OUTLIERS_DIRPATH(state), exist_ok=True)
+    sketch_file: Path = consts.OUTLIERS_DIRPATH(state) / (f"{name}-sketches" + run_config.ARTIFACT_SUFFIX)
+    analyzer.to_file(sketch_file)
+    report_file: Path = consts.OUTLIERS_DIRPATH(state) / f"{name}-report.json"
+    write_artifact(report_file, json.dumps({"n_maps": analyzer.n_maps(), "metrics": analyzer.report(MapRecord.from_partition(plan_partition))}, indent=4))
+    return [report_file, sketch_file]
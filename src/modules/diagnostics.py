@@ -0,0 +1,172 @@
+from gerrychain import Partition
+from gerrychain.updaters import Tally
+from collections import deque
+from ..custom_types import VMDPartition
+from .election import party_line_stv_seats
+import numpy as np
+import math
+import run_config
+import consts
+import logging
+logger = logging.getLogger(__name__)
+
+"""
+This module contains streaming convergence diagnostics for ReCom chains. Summary
+statistics of every state of a chain (cut edge count and seat count) are fed
+into running estimators of their mean, variance and autocorrelation, from which
+the effective sample size (ESS) of the chain and the R-hat across chains are
+computed without storing the traces.
+"""
+
+
+DEM_TALLY_UPDATER: str = "dem_votes"
+REP_TALLY_UPDATER: str = "rep_votes"
+
+
+class StreamingStatistic:
+    """
+    Running estimator of the mean, variance and autocovariances (up to max_lag)
+    of a scalar trace. Uses Welford's algorithm for the mean and variance and
+    running lagged product sums for the autocovariances, keeping only the first
+    and last max_lag values of the trace.
+    """
+
+    n: int
+    mean: float
+    m2: float
+    max_lag: int
+    total: float
+    head: list[float]
+    tail: deque
+    lag_sums: list[float]
+
+    def __init__(self, max_lag: int = 50) -> None:
+        self.n = 0
+        self.mean = 0
+        self.m2 = 0
+        self.max_lag = max_lag
+        self.total = 0
+        self.head = []
+        self.tail = deque(maxlen=max_lag)
+        self.lag_sums = [0]*(max_lag+1)
+
+    def update(self, x: float) -> None:
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta/self.n
+        self.m2 += delta*(x - self.mean)
+        self.total += x
+        self.lag_sums[0] += x*x
+        for k, prev in enumerate(reversed(self.tail), start=1):
+            self.lag_sums[k] += x*prev
+        if len(self.head) < self.max_lag:
+            self.head.append(x)
+        self.tail.append(x)
+
+    def variance(self) -> float:
+        return self.m2/(self.n-1) if self.n > 1 else 0
+
+    def autocorrelation(self, k: int) -> float:
+        """Lag k autocorrelation, centered at the full trace mean."""
+
+        if self.m2 == 0 or k >= self.n:
+            return 0
+        head_sum = self.total - sum(self.head[:k]) # sum of x_t for t >= k
+        tail_sum = self.total - sum(list(self.tail)[len(self.tail)-k:]) if k > 0 else self.total # sum of x_t for t < n-k
+        autocov = self.lag_sums[k] - self.mean*(head_sum + tail_sum) + (self.n-k)*self.mean**2
+        return autocov/self.m2
+
+    def ess(self) -> float:
+        """
+        Effective sample size n/tau, where the integrated autocorrelation time
+        tau is summed over Geyer's initial positive sequence of autocorrelation
+        pairs, truncated at max_lag.
+        """
+
+        if self.n < 3 or self.m2 == 0:
+            return float(self.n)
+        tau: float = 1
+        for k in range(1, min(self.max_lag, self.n-1), 2):
+            pair = self.autocorrelation(k) + self.autocorrelation(k+1)
+            if pair <= 0:
+                break
+            tau += 2*pair
+        return min(self.n/tau, float(self.n))
+
+    def summary(self) -> dict:
+        return {"n": self.n, "mean": self.mean, "variance": self.variance(), "ess": self.ess()}
+
+
+def rhat(summaries: list[dict]) -> float:
+    """
+    Gelman-Rubin potential scale reduction factor of one statistic from the
+    summaries of several chains (as returned by StreamingStatistic.summary()).
+    Values close to 1 mean the chains have forgotten their starting point.
+    """
+
+    summaries = [s for s in summaries if s["n"] > 1]
+    if len(summaries) < 2:
+        return float("nan")
+    n: float = np.mean([s["n"] for s in summaries])
+    within: float = np.mean([s["variance"] for s in summaries])
+    between: float = np.var([s["mean"] for s in summaries], ddof=1)
+    if within == 0:
+        return 1.0 if between == 0 else float("inf")
+    return math.sqrt(((n-1)/n*within + between)/within)
+
+
+def with_diagnostic_updaters(partition: VMDPartition) -> VMDPartition:
+    """Returns a copy of a partition that also tallies the vote columns, so seat counts update incrementally along a chain."""
+
+    return VMDPartition(graph=partition.graph,
+                        assignment=dict(partition.assignment),
+                        state=partition.state,
+                        district_reps=partition.district_reps,
+                        updaters=partition.updaters | {DEM_TALLY_UPDATER: Tally(run_config.DEM_VOTE_TALLY_COL, DEM_TALLY_UPDATER),
+                                                       REP_TALLY_UPDATER: Tally(run_config.REP_VOTE_TALLY_COL, REP_TALLY_UPDATER)},
+                        use_default_updaters=False)
+
+
+def cut_edge_count(partition: Partition) -> float:
+    return partition[consts.DISTRICT_ADJACENCY_UPDATER].n_cut_edges()
+
+
+def dem_seat_count(partition: VMDPartition) -> float:
+    districtIDs: list[int] = sorted(partition.district_reps.keys())
+    return float(party_line_stv_seats(np.array([partition[DEM_TALLY_UPDATER][d] for d in districtIDs]),
+                                      np.array([partition[REP_TALLY_UPDATER][d] for d in districtIDs]),
+                                      np.array([partition.district_reps[d] for d in districtIDs])).sum())
+
+
+class ChainDiagnostics:
+    """
+    Streaming diagnostics of one chain. Call update() with every state of the
+    chain (including the initial state); partitions must carry the updaters
+    added by with_diagnostic_updaters().
+    """
+
+    stats: dict[str, StreamingStatistic]
+
+    STATISTICS = {"cut_edges": cut_edge_count, "dem_seats": dem_seat_count}
+
+    def __init__(self, max_lag: int = 50) -> None:
+        self.stats = {name: StreamingStatistic(max_lag) for name in self.STATISTICS}
+
+    def update(self, partition: VMDPartition) -> None:
+        for name, statistic in self.STATISTICS.items():
+            self.stats[name].update(statistic(partition))
+
+    def min_ess(self) -> float:
+        return min(s.ess() for s in self.stats.values())
+
+    def summary(self) -> dict:
+        return {name: s.summary() for name, s in self.stats.items()}
+
+
+def ensemble_diagnostics(chain_summaries: list[dict]) -> dict:
+    """Combines the summaries of the chains of an ensemble into the diagnostics recorded in its metadata."""
+
+    names = chain_summaries[0].keys() if chain_summaries else []
+    return {"rhat": {name: rhat([c[name] for c in chain_summaries]) for name in names},
+            "min_ess": {name: min(c[name]["ess"] for c in chain_summaries) for name in names},
+            "chains": chain_summaries}
@@ -1,18 +1,26 @@
+from __future__ import annotations
 from gerrychain import Partition
-from statistics import mode
+from collections import Counter
+from typing import Callable
 from linetimer import CodeTimer, linetimer
-from ..custom_types import VotingComparator, VMDPartition, RepsPerDistrict, Precinct, Voter, Party, ElectionsResults
+from ..custom_types import VotingComparator, VMDPartition, RepsPerDistrict, Precinct, Voter, Party, ElectionsResults, MultiElectionsResults, ReplicateElectionsResults
 import run_config
 import logging
 from functools import partial, cmp_to_key
 import consts
 from pprint import pprint
-from .utils import round_up, round_down
+from .utils import round_up, round_down, FIXED_POINT_SCALE, fixed_point_div_up, fixed_point_scale_down, load_state_graph, worker_context
 logger = logging.getLogger(__name__)
 from ..custom_types import Ballot, Candidate, Party, Tabulator, Ensemble
+from .voting_models import PrecinctVotingModel, RankingClass
+from .ensemble_view import EnsembleView, map_records
+from .plan_hashing import PlanIndex, ensemble_plan_index
 import itertools
+import os
+import random
 flatten = itertools.chain.from_iterable
-from multiprocessing import Pool
+from gerrychain import Graph
+import numpy as np
 
 
 # @linetimer(name=f"running multi seat ranked choice tabulation", logger_func=logger.debug)
@@ -32,7 +40,7 @@ def multi_seat_ranked_choice_tabulation(ballots: list[Ballot], candidates: set[C
     tabulation_round = 1
     continuing_candidates: set[Candidate] = candidates.copy()
     winners: set[Candidate] = set()
-    multi_seat_threshold: float = round_up(len(ballots)/(1+n_winners), 4)
+    multi_seat_threshold: float = round_up(sum(b.count for b in ballots)/(1+n_winners), 4)
     logger.debug(f"multi seat threshold: {multi_seat_threshold}")
 
     while len(continuing_candidates) + len(winners) > n_winners:
@@ -40,7 +48,7 @@ def multi_seat_ranked_choice_tabulation(ballots: list[Ballot], candidates: set[C
         # first, perform vote tabulation for this round and find candidates that exceed threshold
         tally: dict[Candidate, float] = {c:0 for c in continuing_candidates} # initializing votes of all continuing candidates to 0
         for ballot in ballots: 
-            tally[ballot.curr_choice()] += ballot.weight
+            tally[ballot.curr_choice()] += ballot.weight*ballot.count
         logger.debug(f"current tally: {tally}")
         above_threshold_candidates: set[Candidate] = {c for c, v in tally.items() if v > multi_seat_threshold}
 
@@ -78,9 +86,98 @@ def multi_seat_ranked_choice_tabulation(ballots: list[Ballot], candidates: set[C
     return list(winners | continuing_candidates)
 
 
+def multi_seat_ranked_choice_pile_tabulation(ballots: list[Ballot], candidates: set[Candidate], n_winners: int, fixed_point: bool = False) -> list[Candidate]:
+    """
+    Runs the same multi-seat ranked choice election as
+    multi_seat_ranked_choice_tabulation, but keeps every continuing candidate's
+    ballots in a pile along with the pile's running weighted total. Surplus and
+    elimination rounds only touch the ballots in the affected candidate's pile,
+    moving each of them onto the pile of its next continuing choice, so each
+    round costs time proportional to the number of ballots transferred instead
+    of the full electorate. Ballots with no continuing choices left are
+    exhausted and dropped from the count.
+
+    In fixed-point mode, ballot weights, totals and the threshold are integers
+    scaled by FIXED_POINT_SCALE (10^4). This reproduces the four decimal place
+    rounding rules of H.R. 3863 exactly, without building a decimal.Decimal for
+    every reweighted ballot. Ballot weights are left scaled after tabulation.
+
+    Arguments:
+        ballots: list of all ballots considered for election
+        candidates: set of all candidates being considered for election
+        n_winners: number of seats to fill for election
+        fixed_point: whether to tabulate with scaled integer weights
+    Returns:
+        set of winning election candidates
+    """
+
+    continuing_candidates: set[Candidate] = candidates.copy()
+    winners: set[Candidate] = set()
+    n_ballots: int = sum(b.count for b in ballots)
+    if fixed_point:
+        multi_seat_threshold: int = fixed_point_div_up(n_ballots*FIXED_POINT_SCALE, 1+n_winners)
+        for ballot in ballots:
+            ballot.weight = round(ballot.weight*FIXED_POINT_SCALE)
+    else:
+        multi_seat_threshold: float = round_up(n_ballots/(1+n_winners), 4)
+    logger.debug(f"multi seat threshold: {multi_seat_threshold}")
+    piles: dict[Candidate, list[Ballot]] = {c:[] for c in continuing_candidates}
+    totals: dict[Candidate, float] = {c:0 for c in continuing_candidates}
+    for ballot in ballots:
+        piles[ballot.curr_choice()].append(ballot)
+        totals[ballot.curr_choice()] += ballot.weight*ballot.count
+
+    def transfer(ballot: Ballot) -> None:
+        ballot.next_continuing_choice(continuing_candidates)
+        if not ballot.is_exhausted():
+            piles[ballot.curr_choice()].append(ballot)
+            totals[ballot.curr_choice()] += ballot.weight*ballot.count
+
+    while len(continuing_candidates) + len(winners) > n_winners:
+        logger.debug(f"current tally: {totals}")
+        above_threshold_candidates: set[Candidate] = {c for c, v in totals.items() if v > multi_seat_threshold}
+
+        # surplus tabulation round: every candidate above threshold wins, and their piles are reweighted and transferred
+        if len(above_threshold_candidates) > 0:
+            logger.debug("surplus tabulation round")
+            winners = winners | above_threshold_candidates
+            continuing_candidates -= above_threshold_candidates
+            candidate_votes: dict[Candidate, float] = {c:totals.pop(c) for c in above_threshold_candidates}
+            for above_threshold_candidate in above_threshold_candidates: 
+                logger.debug(f"transferring votes for above threshold candidate: {above_threshold_candidate}")
+                votes = candidate_votes[above_threshold_candidate]
+                surplus = votes - multi_seat_threshold
+                for ballot in piles.pop(above_threshold_candidate):
+                    if fixed_point:
+                        ballot.weight = fixed_point_scale_down(ballot.weight, surplus, votes)
+                    else:
+                        ballot.weight = round_down(ballot.weight*(surplus/votes), 4)
+                    transfer(ballot)
+
+        # candidate elimination round: the candidate with the fewest votes is removed and their pile is transferred
+        else: 
+            min_candidate: Candidate = min(totals, key=totals.get) 
+            logger.debug(f"candidate elimination round, removing {min_candidate}")
+            continuing_candidates.remove(min_candidate)
+            del totals[min_candidate]
+            for ballot in piles.pop(min_candidate):
+                transfer(ballot)
+
+    return list(winners | continuing_candidates)
+
+
+def multi_seat_ranked_choice_fixed_point_tabulation(ballots: list[Ballot], candidates: set[Candidate], n_winners: int) -> list[Candidate]:
+    """Pile-based multi-seat ranked choice tabulation with fixed-point ballot weights; see multi_seat_ranked_choice_pile_tabulation."""
+
+    return multi_seat_ranked_choice_pile_tabulation(ballots, candidates, n_winners, fixed_point=True)
+
+
 # @linetimer(name=f"running single seat plurality tabulation", logger_func=logger.debug)
 def single_seat_plurality_tabulation(ballots: list[Ballot], candidates: set[Candidate], n_winners: int) -> list[Candidate]:
-    return [mode([b.curr_choice() for b in ballots])]
+    tally: Counter = Counter()
+    for ballot in ballots:
+        tally[ballot.curr_choice()] += ballot.count
+    return [tally.most_common(1)[0][0]]
 
 
 # @linetimer(name=f"generating candidates", logger_func=logger.debug)
@@ -105,36 +202,176 @@ def gen_candidates(n_seats: int, districtID: int) -> set[Candidate]:
     return candidates
 
 
-def get_prec_voters(precinct: Precinct) -> list[Voter]:
-    return [Voter(Party.DEMOCRAT)]*int(precinct[run_config.DEM_VOTE_TALLY_COL]) + [Voter(Party.REPUBLICAN)]*int(precinct[run_config.REP_VOTE_TALLY_COL])
+def get_prec_voters(precinct: Precinct, dem_col: str = run_config.DEM_VOTE_TALLY_COL, rep_col: str = run_config.REP_VOTE_TALLY_COL) -> list[Voter]:
+    return [Voter(Party.DEMOCRAT)]*int(precinct[dem_col]) + [Voter(Party.REPUBLICAN)]*int(precinct[rep_col])
+
+
+def get_precincts_voters(graph: Graph, precIDs: list[int], dem_col: str = run_config.DEM_VOTE_TALLY_COL, rep_col: str = run_config.REP_VOTE_TALLY_COL) -> list[Voter]:
+    return list(flatten([get_prec_voters(graph.nodes[p], dem_col, rep_col) for p in precIDs]))
 
 
 def get_district_voters(partition: VMDPartition, districtID: int) -> list[Voter]:
     with CodeTimer(name=f"getting voters from district {districtID}", logger_func=logger.debug):
-        return list(flatten([get_prec_voters(partition.graph.nodes[p]) for p in partition.parts[districtID]]))
+        return get_precincts_voters(partition.graph, partition.parts[districtID])
 
 
-def voter_to_ballot(voter: Voter, candidates: list[Candidate], voting_model: VotingComparator) -> Ballot:
-    return Ballot(sorted(candidates, key=cmp_to_key(partial(voting_model, voter=voter))))
+def voter_to_ballot(voter: Voter, candidates: list[Candidate], voting_model: VotingComparator, rng: random.Random = None) -> Ballot:
+    comparator = partial(voting_model, voter=voter) if rng is None else partial(voting_model, voter=voter, rng=rng)
+    return Ballot(sorted(candidates, key=cmp_to_key(comparator)))
 
 
-def district_voters_to_ballots(voters: list[Voter], candidates: list[Candidate], voting_model: VotingComparator) -> list[Ballot]:
+def district_voters_to_ballots(voters: list[Voter], candidates: list[Candidate], voting_model: VotingComparator, rng: random.Random = None) -> list[Ballot]:
     with CodeTimer(name=f"getting ballots from {len(voters)} voters using {voting_model.__name__}", logger_func=logger.debug):
-       district_ballots: list[Ballot] = [voter_to_ballot(v, candidates, voting_model) for v in voters]
+       district_ballots: list[Ballot] = [voter_to_ballot(v, candidates, voting_model, rng) for v in voters]
     logger.debug(f"first 3 district ballots: {district_ballots[:3]}, last 3 district ballots: {district_ballots[-3:]}")
     return district_ballots
 
 
-def run_district_election(partition: VMDPartition, districtID: int, voting_model: VotingComparator, tabulator: Tabulator) -> list[Candidate]:
+def gen_precincts_ballot_groups(graph: Graph, precIDs: list[int], candidates: set[Candidate], voting_model: PrecinctVotingModel, rng: np.random.Generator = None) -> list[Ballot]:
+    """
+    Draws the ballots of a district from a precinct voting model. The voters of
+    every precinct are split among the model's ranking classes with one
+    vectorized multinomial draw per precinct, the class counts are summed over
+    the district, and each class's count is split among its rankings. Every
+    distinct ranking becomes one Ballot whose count is its number of voters.
+
+    Arguments:
+        graph: state graph
+        precIDs: precincts of the district
+        candidates: candidates running in the district
+        voting_model: precinct voting model
+        rng: random generator, a fresh one if not given
+    Returns:
+        list of ballot groups
+    """
+
+    precincts: list[Precinct] = [graph.nodes[p] for p in precIDs]
+    with CodeTimer(name=f"drawing ballots from {len(precincts)} precincts using {voting_model.__name__}", logger_func=logger.debug):
+        return draw_ballot_groups(voting_model.voter_counts(precincts), voting_model.class_probabilities(precincts), voting_model.ranking_classes(candidates),
+                                  rng if rng is not None else np.random.default_rng())
+
+
+def draw_ballot_groups(voter_counts: np.ndarray, class_probabilities: np.ndarray, ranking_classes: list[RankingClass], rng: np.random.Generator) -> list[Ballot]:
+    """Draws ballot groups from the voter counts and ranking class probabilities a precinct voting model gives a district's precincts (see gen_precincts_ballot_groups)."""
+
+    class_counts = rng.multinomial(voter_counts, class_probabilities).sum(axis=0)
+    ballots: list[Ballot] = [Ballot(list(ranking), count=n)
+                             for ranking_class, n_class in zip(ranking_classes, class_counts)
+                             for ranking, n in ranking_class.sample_rankings(int(n_class), rng)]
+    logger.debug(f"{len(ballots)} ballot groups for {int(class_counts.sum())} voters")
+    return ballots
+
+
+def run_precincts_election(graph: Graph, precIDs: list[int], n_reps: int, districtID: int, voting_model: VotingComparator, tabulator: Tabulator) -> list[Candidate]:
     with CodeTimer(f"running election on district {districtID}", logger_func=logger.debug):
-        candidates: list[Candidate] = gen_candidates(partition.district_reps[districtID], districtID)
-        voters: list[Voter] = get_district_voters(partition, districtID)
-        ballots: list[Ballot] = district_voters_to_ballots(voters, candidates, voting_model)
-        winners: list[Candidate] = tabulator(ballots, candidates, partition.district_reps[districtID])
+        candidates: list[Candidate] = gen_candidates(n_reps, districtID)
+        if isinstance(voting_model, PrecinctVotingModel):
+            ballots: list[Ballot] = gen_precincts_ballot_groups(graph, precIDs, candidates, voting_model)
+        else:
+            voters: list[Voter] = get_precincts_voters(graph, precIDs)
+            ballots: list[Ballot] = district_voters_to_ballots(voters, candidates, voting_model)
+        winners: list[Candidate] = tabulator(ballots, candidates, n_reps)
+        logger.debug(f"district {districtID} winners: {winners}")
+        return winners
+
+
+def run_precincts_elections(graph: Graph, precIDs: list[int], n_reps: int, districtID: int, voting_model: VotingComparator, tabulator: Tabulator, vote_col_pairs: list[tuple[str, str]]) -> list[list[Candidate]]:
+    """
+    Runs one election per vote column pair on the same district. The district's
+    precincts are read once and every vote column is tallied over the district
+    in the same pass; the voters of each election are then built from the
+    district tallies, since a VotingComparator only looks at a voter's party.
+    PrecinctVotingModels draw each election's ballots from the model for that
+    election's vote columns (see PrecinctVotingModel.with_vote_cols).
+
+    Arguments:
+        graph: state graph
+        precIDs: precincts of the district
+        n_reps: number of representatives of the district
+        districtID: district ID
+        voting_model: voting model used to generate ballots
+        tabulator: tabulation method
+        vote_col_pairs: (democrat, republican) precinct vote columns of each election
+    Returns:
+        the district winners of each election, in the order of vote_col_pairs
+    """
+
+    with CodeTimer(f"running {len(vote_col_pairs)} elections on district {districtID}", logger_func=logger.debug):
+        precincts: list[Precinct] = [graph.nodes[p] for p in precIDs]
+        tallies: dict[str, int] = {col: sum(int(p[col]) for p in precincts) for col in set(flatten(vote_col_pairs))}
+        winners: list[list[Candidate]] = []
+        for dem_col, rep_col in vote_col_pairs:
+            candidates: set[Candidate] = gen_candidates(n_reps, districtID)
+            if isinstance(voting_model, PrecinctVotingModel):
+                ballots: list[Ballot] = gen_precincts_ballot_groups(graph, precIDs, candidates, voting_model.with_vote_cols(dem_col, rep_col))
+            else:
+                voters: list[Voter] = [Voter(Party.DEMOCRAT)]*tallies[dem_col] + [Voter(Party.REPUBLICAN)]*tallies[rep_col]
+                ballots: list[Ballot] = district_voters_to_ballots(voters, candidates, voting_model)
+            winners.append(tabulator(ballots, candidates, n_reps))
         logger.debug(f"district {districtID} winners: {winners}")
         return winners
 
 
+def replicate_seed(seed: int, replicate: int, map_idx: int, districtID: int) -> np.random.SeedSequence:
+    """Seed of one replicate of one district election, so every draw is reproducible no matter which worker runs it or in what order."""
+
+    return np.random.SeedSequence(seed, spawn_key=(replicate, map_idx, districtID))
+
+
+def run_precincts_election_replicates(graph: Graph, precIDs: list[int], n_reps: int, districtID: int, voting_model: VotingComparator, tabulator: Tabulator,
+                                      vote_cols: tuple[str, str], n_replicates: int, seed: int, map_idx: int) -> np.ndarray:
+    """
+    Runs n_replicates random replicates of one district election. The district
+    is aggregated once for all replicates: PrecinctVotingModels compute the
+    voter counts and ranking class probabilities of its precincts once and
+    only redraw the ballots, and VotingComparators build the district's voters
+    once from its vote tallies and only re-rank them. Replicate r draws from
+    its own seed (see replicate_seed); VotingComparators break ties with a
+    random.Random seeded from it, passed as their rng keyword, so the global
+    random state is left alone. Candidates are sampled in party and name
+    order, as the order of a set of candidates changes from run to run.
+
+    Arguments:
+        graph: state graph
+        precIDs: precincts of the district
+        n_reps: number of representatives of the district
+        districtID: district ID
+        voting_model: voting model used to generate ballots
+        tabulator: tabulation method
+        vote_cols: (democrat, republican) precinct vote columns of the election
+        n_replicates: number of replicates
+        seed: seed of the whole replicate run
+        map_idx: index of the map in its ensemble, part of each replicate's seed
+    Returns:
+        array with the number of democrat seats won in each replicate
+    """
+
+    with CodeTimer(f"running {n_replicates} replicates of the election on district {districtID}", logger_func=logger.debug):
+        precincts: list[Precinct] = [graph.nodes[p] for p in precIDs]
+        dem_col, rep_col = vote_cols
+        if isinstance(voting_model, PrecinctVotingModel):
+            voting_model = voting_model.with_vote_cols(dem_col, rep_col)
+            voter_counts: np.ndarray = voting_model.voter_counts(precincts)
+            class_probabilities: np.ndarray = voting_model.class_probabilities(precincts)
+        else:
+            voters: list[Voter] = [Voter(Party.DEMOCRAT)]*sum(int(p[dem_col]) for p in precincts) + [Voter(Party.REPUBLICAN)]*sum(int(p[rep_col]) for p in precincts)
+        dem_seats = np.zeros(n_replicates, dtype=np.int64)
+        for replicate in range(n_replicates):
+            rng = np.random.default_rng(replicate_seed(seed, replicate, map_idx, districtID))
+            candidates: set[Candidate] = gen_candidates(n_reps, districtID)
+            ordered_candidates: list[Candidate] = sorted(candidates, key=lambda c: (c.party.value, c.name))
+            if isinstance(voting_model, PrecinctVotingModel):
+                ballots: list[Ballot] = draw_ballot_groups(voter_counts, class_probabilities, voting_model.ranking_classes(ordered_candidates), rng)
+            else:
+                ballots: list[Ballot] = district_voters_to_ballots(voters, ordered_candidates, voting_model, random.Random(int(rng.integers(2**63))))
+            dem_seats[replicate] = sum(c.party == Party.DEMOCRAT for c in tabulator(ballots, candidates, n_reps))
+        return dem_seats
+
+
+def run_district_election(partition: VMDPartition, districtID: int, voting_model: VotingComparator, tabulator: Tabulator) -> list[Candidate]:
+    return run_precincts_election(partition.graph, partition.parts[districtID], partition.district_reps[districtID], districtID, voting_model, tabulator)
+
+
 def run_statewide_district_elections_on_map(partition: VMDPartition, map_idx: int, voting_model: VotingComparator, tabulator: Tabulator) -> list[Candidate]:
     logger.info(f"running district elections on ensemble map {map_idx}")
     winners: list[Candidate] = list(flatten([run_district_election(partition, p, voting_model, tabulator) for p in sorted(partition.parts.keys())]))
@@ -142,6 +379,33 @@ def run_statewide_district_elections_on_map(partition: VMDPartition, map_idx: in
     return winners
 
 
+def verify_fixed_point_tabulation(ensemble: Ensemble, voting_model: VotingComparator) -> list[tuple[int, int]]:
+    """
+    Runs every MMD election of an ensemble with both the decimal and the
+    fixed-point pile tabulators on identical ballots, and returns the (map
+    index, district ID) of each election whose winners differ.
+    """
+
+    mismatches: list[tuple[int, int]] = []
+    for map_idx, partition in enumerate(ensemble.maps):
+        for districtID in sorted(partition.parts.keys()):
+            n_reps: int = partition.district_reps[districtID]
+            if n_reps == 1:
+                continue
+            candidates: set[Candidate] = gen_candidates(n_reps, districtID)
+            if isinstance(voting_model, PrecinctVotingModel):
+                ballots: list[Ballot] = gen_precincts_ballot_groups(partition.graph, list(partition.parts[districtID]), candidates, voting_model)
+            else:
+                ballots: list[Ballot] = district_voters_to_ballots(get_district_voters(partition, districtID), candidates, voting_model)
+            decimal_winners = multi_seat_ranked_choice_pile_tabulation([Ballot(b.choices, b.count) for b in ballots], candidates, n_reps)
+            fixed_point_winners = multi_seat_ranked_choice_fixed_point_tabulation([Ballot(b.choices, b.count) for b in ballots], candidates, n_reps)
+            if set(decimal_winners) != set(fixed_point_winners):
+                logger.warning(f"fixed-point winners differ on map {map_idx}, district {districtID}: {decimal_winners} vs {fixed_point_winners}")
+                mismatches.append((map_idx, districtID))
+    logger.info(f"fixed-point tabulation differed from decimal tabulation in {len(mismatches)} elections")
+    return mismatches
+
+
 def run_many_statewide_elections_on_ensemble(ensemble: list[Partition], voting_model: VotingComparator, tabulator: Tabulator) -> ElectionsResults: 
     return [run_statewide_district_elections_on_map(m, i, voting_model, tabulator) for i, m in enumerate(ensemble)]
     
@@ -156,6 +420,249 @@ def run_many_statewide_elections_on_ensemble_parallel(ensemble: Ensemble, voting
     args = []
     for i in range(len(ensemble.maps)):
         args.append((ensemble.maps[i].to_json_dict(), i, voting_model, tabulator))
-    with Pool(n_workers) as p:
+    with worker_context().Pool(n_workers) as p:
         results = p.starmap(run_statewide_district_elections_on_map_parallel, args)
-    return ElectionsResults(results, voting_model.__name__, consts.ENSEMBLE_FILENAME(ensemble), tabulator.__name__)
\ No newline at end of file
+    return ElectionsResults(results, voting_model.__name__, consts.ENSEMBLE_FILENAME(ensemble), tabulator.__name__)
+
+
+_worker_graph: Graph = None
+
+
+def _init_election_worker(state: str) -> None:
+    """Pool initializer that loads the state graph once per worker process instead of once per task."""
+
+    global _worker_graph
+    _worker_graph = load_state_graph(state)
+
+
+def _run_district_task(task: tuple) -> tuple[tuple[int, int], object]:
+    run, map_idx, districtID, precIDs, n_reps, args = task
+    return (map_idx, districtID), run(_worker_graph, precIDs, n_reps, districtID, *args)
+
+
+def run_district_tasks_scheduled(ensemble: Ensemble, index: PlanIndex, run: Callable, args: Callable[[int], tuple], cost_factor: int, n_workers: int) -> dict[tuple[int, int], object]:
+    """
+    Runs run(graph, precIDs, n_reps, districtID, *args(map_idx)) on every
+    district of every distinct map of an ensemble in parallel, scheduling each
+    map x district as its own task. District elections vary widely in cost
+    with their number of voters and reps, so tasks are handed to the workers
+    longest-processing-time-first by their estimated cost (times cost_factor,
+    e.g. the number of elections per task), which keeps every worker busy until
+    the end even for small ensembles of large MMDs. Maps that repeat an earlier
+    plan of the ensemble (see plan_hashing) are skipped; their results are
+    those of the first map with the same plan, index.duplicate_of[map_idx].
+
+    Returns:
+        the result of each task by (map index, district ID)
+    """
+
+    tasks: list[tuple] = []
+    costs: list[int] = []
+    for map_idx, partition in enumerate(ensemble.maps):
+        if index.is_duplicate(map_idx):
+            continue
+        for districtID in sorted(partition.parts.keys()):
+            precIDs: list[int] = list(partition.parts[districtID])
+            tasks.append((run, map_idx, districtID, precIDs, partition.district_reps[districtID], args(map_idx)))
+            costs.append(estimate_district_election_cost(partition.graph, precIDs, partition.district_reps[districtID])*cost_factor)
+    tasks = [task for _, task in sorted(zip(costs, tasks), key=lambda x: x[0], reverse=True)]
+    logger.info(f"scheduling {len(tasks)} district tasks on {n_workers} workers, total estimated cost {sum(costs)}, largest {max(costs)}")
+
+    district_results: dict[tuple[int, int], object] = {}
+    with worker_context().Pool(n_workers, initializer=_init_election_worker, initargs=(ensemble.maps[0].state,)) as p:
+        for key, result in p.imap_unordered(_run_district_task, tasks, chunksize=1):
+            district_results[key] = result
+    return district_results
+
+
+def estimate_district_election_cost(graph: Graph, precIDs: list[int], n_reps: int) -> int:
+    """Estimates the cost of a district election as its number of voters times its number of candidates."""
+
+    n_voters: int = sum(int(graph.nodes[p][run_config.DEM_VOTE_TALLY_COL]) + int(graph.nodes[p][run_config.REP_VOTE_TALLY_COL]) for p in precIDs)
+    return n_voters*len(Party)*n_reps
+
+
+def election_name(dem_col: str, rep_col: str) -> str:
+    """Names an election after the common prefix of its vote columns, e.g. 2020_PRES for 2020_PRES_DEM and 2020_PRES_REP."""
+
+    prefix: str = os.path.commonprefix([dem_col, rep_col]).rstrip("_")
+    return prefix if prefix else f"{dem_col}-{rep_col}"
+
+
+def discover_vote_col_pairs(graph: Graph) -> list[tuple[str, str]]:
+    """Finds the (democrat, republican) vote columns of every election in a state graph, as the *_DEM columns that have a matching *_REP column."""
+
+    cols: set[str] = set(graph.nodes[next(iter(graph.nodes))].keys())
+    return [(col, col[:-len("_DEM")] + "_REP") for col in sorted(cols) if col.endswith("_DEM") and col[:-len("_DEM")] + "_REP" in cols]
+
+
+def configured_vote_col_pairs(graph: Graph) -> list[tuple[str, str]]:
+    """The elections to run: run_config.ELECTION_VOTE_TALLY_COLS, or every election in the state graph if that is None."""
+
+    return run_config.ELECTION_VOTE_TALLY_COLS if run_config.ELECTION_VOTE_TALLY_COLS is not None else discover_vote_col_pairs(graph)
+
+
+def run_many_statewide_multi_elections_on_ensemble_scheduled(ensemble: Ensemble, vote_col_pairs: list[tuple[str, str]], voting_model: VotingComparator, tabulator: Tabulator, n_workers: int) -> MultiElectionsResults:
+    """
+    Runs the district elections of every map in an ensemble in parallel, for
+    several elections (vote column pairs) at once. Each map x district is one
+    task (see run_district_tasks_scheduled) that tallies the district once and
+    runs every election from that tally (see run_precincts_elections), so the
+    ensemble is loaded and partitioned once no matter how many elections are
+    run. Maps that repeat an earlier plan of the ensemble are not elected
+    again. Results are reassembled in map and district order.
+
+    Arguments:
+        ensemble: ensemble of maps on the same state
+        vote_col_pairs: (democrat, republican) precinct vote columns of each election
+        voting_model: voting model used to generate ballots
+        tabulator: tabulation method used for each district election
+        n_workers: number of worker processes
+    Returns:
+        MultiElectionsResults with the state winners of each map in ensemble
+        order, for each election
+    """
+
+    index: PlanIndex = ensemble_plan_index(ensemble)
+    district_winners: dict[tuple[int, int], list[list[Candidate]]] = run_district_tasks_scheduled(ensemble, index, run_precincts_elections,
+                                                                                                  lambda map_idx: (voting_model, tabulator, vote_col_pairs), len(vote_col_pairs), n_workers)
+    results: dict[str, list[list[Candidate]]] = {}
+    for election_idx, (dem_col, rep_col) in enumerate(vote_col_pairs):
+        results[election_name(dem_col, rep_col)] = [list(flatten([district_winners[(index.duplicate_of[map_idx], districtID)][election_idx]
+                                                                  for districtID in sorted(ensemble.maps[index.duplicate_of[map_idx]].parts.keys())]))
+                                                    for map_idx in range(len(ensemble.maps))]
+    return MultiElectionsResults(results, {election_name(*pair): pair for pair in vote_col_pairs}, voting_model.__name__, consts.ENSEMBLE_FILENAME(ensemble), tabulator.__name__)
+
+
+def run_many_statewide_elections_on_ensemble_scheduled(ensemble: Ensemble, voting_model: VotingComparator, tabulator: Tabulator, n_workers: int) -> ElectionsResults:
+    """Runs the election given by run_config's vote columns on every map of an ensemble (see run_many_statewide_multi_elections_on_ensemble_scheduled)."""
+
+    vote_cols: tuple[str, str] = (run_config.DEM_VOTE_TALLY_COL, run_config.REP_VOTE_TALLY_COL)
+    return run_many_statewide_multi_elections_on_ensemble_scheduled(ensemble, [vote_cols], voting_model, tabulator, n_workers).election(election_name(*vote_cols))
+
+
+def run_election_replicates_on_ensemble_scheduled(ensemble: Ensemble, voting_model: VotingComparator, tabulator: Tabulator, n_replicates: int, seed: int, n_workers: int,
+                                                  vote_cols: tuple[str, str] = (run_config.DEM_VOTE_TALLY_COL, run_config.REP_VOTE_TALLY_COL)) -> ReplicateElectionsResults:
+    """
+    Monte Carlo estimate of the outcome distribution of an election on every
+    map of an ensemble. Each map x district task runs all replicates of its
+    district election (see run_precincts_election_replicates), seeded per
+    replicate from seed, so a rerun with the same seed gives the same results
+    and the statewide seat count of replicate r combines the rth replicate of
+    every district.
+
+    Arguments:
+        ensemble: ensemble of maps on the same state
+        voting_model: voting model used to generate ballots
+        tabulator: tabulation method used for each district election
+        n_replicates: number of replicates of each district election
+        seed: seed of the replicate seeds
+        n_workers: number of worker processes
+        vote_cols: (democrat, republican) precinct vote columns of the election
+    Returns:
+        ReplicateElectionsResults with the democrat seats of every replicate of
+        every district of every map
+    """
+
+    index: PlanIndex = ensemble_plan_index(ensemble)
+    district_seats: dict[tuple[int, int], np.ndarray] = run_district_tasks_scheduled(ensemble, index, run_precincts_election_replicates,
+                                                                                     lambda map_idx: (voting_model, tabulator, vote_cols, n_replicates, seed, map_idx), n_replicates, n_workers)
+    dem_seats: list[list[list[int]]] = [[district_seats[(index.duplicate_of[map_idx], districtID)].tolist() for districtID in sorted(partition.parts.keys())]
+                                        for map_idx, partition in enumerate(ensemble.maps)]
+    return ReplicateElectionsResults(dem_seats, [partition.district_reps for partition in ensemble.maps], election_name(*vote_cols),
+                                     voting_model.__name__, consts.ENSEMBLE_FILENAME(ensemble), tabulator.__name__, seed)
+
+
+def get_precinct_vote_arrays(graph: Graph, dem_col: str, rep_col: str) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Reads the democrat and republican vote columns of every precinct into
+    arrays ordered the same way as graph.nodes.
+    """
+
+    dem_votes = np.array([graph.nodes[p][dem_col] for p in graph.nodes], dtype=float)
+    rep_votes = np.array([graph.nodes[p][rep_col] for p in graph.nodes], dtype=float)
+    return dem_votes, rep_votes
+
+
+def party_line_stv_seats(dem_votes: np.ndarray, rep_votes: np.ndarray, n_seats: np.ndarray) -> np.ndarray:
+    """
+    Fast counting path for the number of democrat seats won in multi-seat
+    ranked choice elections where every voter ranks all of their own party's
+    candidates above the other party's candidates (party_line_voting_comparator).
+
+    With full party-line ballots, votes never leave a party until all of its
+    candidates are elected or eliminated, so each party wins one seat per whole
+    multi-seat threshold (votes/(1+n_seats)) it exceeds. This is the Droop quota
+    outcome of SEC. 332 of H.R. 3863 and needs only the district tallies.
+    Works elementwise on arrays of any (broadcastable) shape.
+
+    Arguments:
+        dem_votes: democrat vote tallies
+        rep_votes: republican vote tallies
+        n_seats: number of seats in each election
+    Returns:
+        number of seats won by democrats in each election
+    """
+
+    total_votes = dem_votes + rep_votes
+    with np.errstate(divide="ignore", invalid="ignore"):
+        quotas = np.where(total_votes > 0, dem_votes*(1+n_seats)/total_votes, 0)
+    return np.clip(np.floor(quotas), 0, n_seats).astype(int)
+
+
+def ensemble_vote_seat_table(ensemble: Ensemble | EnsembleView, swings: np.ndarray, dem_col: str = run_config.DEM_VOTE_TALLY_COL, rep_col: str = run_config.REP_VOTE_TALLY_COL, quantiles: tuple = (0.05, 0.25, 0.5, 0.75, 0.95)) -> dict:
+    """
+    Computes a vote-seat curve for an ensemble under uniform partisan swing
+    without rerunning any elections. Each swing is added to the democrat vote
+    share of every precinct (clipped to [0, 1], keeping turnout fixed), and the
+    swung precinct votes of every district x swing of a map are aggregated with
+    a single sparse matrix product. SMDs are decided by plurality and MMDs by
+    party_line_stv_seats. Maps are read one at a time, so an EnsembleView is
+    never fully loaded.
+
+    Arguments:
+        ensemble: ensemble (or ensemble view) of maps on the same state graph
+        swings: array of uniform swings in democrat vote share, e.g. np.linspace(-0.1, 0.1, 21)
+        dem_col: precinct column with democrat votes
+        rep_col: precinct column with republican votes
+        quantiles: ensemble quantiles of the statewide seat count to report
+    Returns:
+        dict with the swings, statewide democrat vote share per swing, the
+        statewide democrat seat count of every map per swing, and its
+        ensemble quantiles
+    """
+
+    from scipy.sparse import csr_matrix # imported here so that election workers, which never build this table, don't import scipy
+
+    graph: Graph = ensemble.graph() if isinstance(ensemble, EnsembleView) else ensemble.maps[0].graph
+    dem_votes, rep_votes = get_precinct_vote_arrays(graph, dem_col, rep_col)
+    total_votes = dem_votes + rep_votes
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dem_shares = np.where(total_votes > 0, dem_votes/total_votes, 0)
+    swung_dem_votes = np.clip(dem_shares[:, None] + swings[None, :], 0, 1)*total_votes[:, None] # (precincts, swings)
+    precinct_votes = np.hstack([swung_dem_votes, total_votes[:, None]])
+    n_precincts: int = len(total_votes)
+
+    seats: list[np.ndarray] = []
+    n_seats: int = None
+    with CodeTimer(f"tallying swung district votes", logger_func=logger.debug):
+        for record in map_records(ensemble):
+            districtIDs: list[int] = sorted(record.district_reps.keys())
+            district_idx = np.searchsorted(districtIDs, record.assignment)
+            membership = csr_matrix((np.ones(n_precincts), (district_idx, np.arange(n_precincts))), shape=(len(districtIDs), n_precincts))
+            district_votes = membership @ precinct_votes # (districts, swings + 1)
+            district_dem_votes = district_votes[:, :-1]
+            district_rep_votes = district_votes[:, -1:] - district_dem_votes
+            reps = np.array([record.district_reps[d] for d in districtIDs])[:, None]
+            plurality_seats = (district_dem_votes > district_rep_votes).astype(int)
+            stv_seats = party_line_stv_seats(district_dem_votes, district_rep_votes, reps)
+            seats.append(np.where(reps == 1, plurality_seats, stv_seats).sum(axis=0))
+            n_seats = int(reps.sum())
+    seats = np.array(seats) # (maps, swings)
+
+    return {"swings": swings,
+            "vote_shares": swung_dem_votes.sum(axis=0)/total_votes.sum(),
+            "seats": seats,
+            "n_seats": n_seats,
+            "quantiles": np.array(quantiles),
+            "seat_quantiles": np.quantile(seats, quantiles, axis=0)}
@@ -1,21 +1,138 @@
+from __future__ import annotations
 import random
-from .utils import rand_spanning_tree
+from .utils import rand_spanning_tree, worker_context
+from .constraints import get_constraints
+from .diagnostics import ChainDiagnostics, with_diagnostic_updaters, ensemble_diagnostics
+from .plan_hashing import ensemble_plan_index
+from .trajectory import Trajectory
+from .coarsening import CoarseGraph, load_coarse_graph, refine_population
 from itertools import product
+import itertools
 from gerrychain import Partition, Graph, MarkovChain 
 from gerrychain.accept import always_accept
 from functools import partial
+from typing import Callable
+from pathlib import Path
 from ..custom_types import VMDPartition, Ensemble
 import networkx as nx
 import logging
 from linetimer import CodeTimer
 import consts
 logger = logging.getLogger(__name__)
-import multiprocessing
-from multiprocessing import Pool
-from multiprocessing.pool import ThreadPool
+from multiprocessing.pool import Pool
+from queue import SimpleQueue
 
 
-def vmd_recom(partition: VMDPartition, epsilon: float) -> Partition:
+class SplitFailedError(Exception):
+    """Raised when a merged district pair can't be split within the population tolerance."""
+
+
+class RecomStats:
+    """
+    Counts of the work done by the ReCom steps of one or more chains, and the
+    district pairs the current chain found can't be split. The counts add up
+    over every chain the stats are passed to, but the infeasible pairs are
+    forgotten when a new chain starts (see start_chain), so one chain's failed
+    searches never change the proposals of another. A pair is keyed by its two
+    districts and their precinct sets, so it stays known as infeasible only as
+    long as neither district changes; the precinct sets are the partition's
+    own frozensets, whose hashes are cached, so lookups are cheap.
+
+    Skipping pairs that failed 500 spanning trees (rather than pairs proven
+    infeasible) slightly changes the proposal distribution of tight-epsilon
+    chains, in exchange for not restarting the whole chain.
+
+    Fields:
+        n_steps: number of proposals
+        n_pairs: number of district pairs tried, at least one per proposal
+        n_precheck_rejections: pairs rejected by the feasibility precheck
+        n_split_failures: pairs whose spanning tree search failed
+        n_cached_skips: times a known infeasible pair was drawn and skipped
+        n_chain_restarts: chains started over after a proposal ran out of pairs
+        infeasible_pairs: keys of the known infeasible pairs of the current chain
+    """
+
+    n_steps: int
+    n_pairs: int
+    n_precheck_rejections: int
+    n_split_failures: int
+    n_cached_skips: int
+    n_chain_restarts: int
+    infeasible_pairs: set[tuple]
+
+    COUNTS: tuple[str] = ("n_steps", "n_pairs", "n_precheck_rejections", "n_split_failures", "n_cached_skips", "n_chain_restarts")
+    MAX_CACHED_PAIRS: int = 10000
+
+    def __init__(self) -> None:
+        for count in RecomStats.COUNTS:
+            setattr(self, count, 0)
+        self.infeasible_pairs = set()
+
+    def start_chain(self) -> None:
+        self.infeasible_pairs = set()
+
+    def mark_infeasible(self, key: tuple) -> None:
+        if len(self.infeasible_pairs) >= RecomStats.MAX_CACHED_PAIRS:
+            self.infeasible_pairs.clear()
+        self.infeasible_pairs.add(key)
+
+    def merge(self, counts: dict[str, int]) -> None:
+        """Adds counts (as returned by to_json_dict()) of another chain."""
+
+        for count in RecomStats.COUNTS:
+            setattr(self, count, getattr(self, count) + counts[count])
+
+    def to_json_dict(self) -> dict[str, int]:
+        return {count: getattr(self, count) for count in RecomStats.COUNTS}
+
+
+MAX_PAIR_REDRAWS: int = 10
+
+
+def pair_key(partition: Partition, partIDs: tuple[int, int]) -> tuple:
+    a, b = sorted(partIDs)
+    return (a, partition.parts[a], b, partition.parts[b])
+
+
+def choose_pair(partition: VMDPartition, stats: RecomStats) -> tuple[int, int]:
+    """
+    Draws the districts of a random cut edge, like plain ReCom, but skips
+    pairs known to be infeasible. After MAX_PAIR_REDRAWS skips, draws directly
+    from the remaining pairs, weighted by their number of boundary edges like
+    cut edge draws. Raises SplitFailedError if every adjacent pair is infeasible.
+    """
+
+    adjacency = partition[consts.DISTRICT_ADJACENCY_UPDATER]
+    district_pairs: dict[tuple[int, int], int] = None
+    for i in itertools.count():
+        if district_pairs is None:
+            edge = adjacency.random_cut_edge()
+            partIDs = (partition.assignment[edge[0]], partition.assignment[edge[1]])
+        else:
+            remaining = [pair for pair in district_pairs if pair_key(partition, pair) not in stats.infeasible_pairs]
+            if not remaining:
+                raise SplitFailedError(f"all {len(district_pairs)} adjacent district pairs are infeasible")
+            partIDs = random.choices(remaining, weights=[district_pairs[pair] for pair in remaining])[0]
+        if pair_key(partition, partIDs) not in stats.infeasible_pairs:
+            return partIDs
+        stats.n_cached_skips += 1
+        if district_pairs is None and i+1 >= MAX_PAIR_REDRAWS:
+            district_pairs = adjacency.district_pairs()
+
+
+def split_infeasible(graph: nx.Graph, pop_target: float, epsilon: float) -> bool:
+    """
+    Population granularity bound for splitting a merged subgraph: one side of
+    a split must have a population in the target range, and precincts larger
+    than the top of the range can only be on the other side, so the smaller
+    precincts must add up to at least the bottom of the range.
+    """
+
+    pop_rng = (pop_target * (1 - epsilon), pop_target * (1 + epsilon))
+    return sum(pop for _, pop in graph.nodes(data=consts.POP_COL) if pop <= pop_rng[1]) < pop_rng[0]
+
+
+def vmd_recom(partition: VMDPartition, epsilon: float, split: Callable = None, stats: RecomStats = None) -> Partition:
     """
     Modified version of ReCom that works additionally with MMDs. This is a
     "proposal" function that can be provided to the gerrychain MarkovChain
@@ -35,22 +152,42 @@ def vmd_recom(partition: VMDPartition, epsilon: float) -> Partition:
     throughout all steps of ReCom as specified by the district_reps field of the
     VMDPartition.
 
+    If the chosen pair fails the split_infeasible precheck or its spanning
+    tree search, it is recorded as infeasible in stats and another pair is
+    tried, instead of failing the step.
+
 
     Arguments:
         partition: a VMD partition
         epsilon: acceptable population error threshold for split
+        split: function splitting the merged subgraph, split_graph_by_pop by
+        default or a SpeculativeSplitter
+        stats: the chain's RecomStats, which keeps infeasible pairs across steps
     Returns:
         a new MMD partition after one step of ReCom
     """
 
-    edge = random.choice(list(partition[consts.CUT_EDGE_UPDATER]))
-    partIDs = (partition.assignment[edge[0]], partition.assignment[edge[1]])
-    logger.debug("doing recom on districts %d, %d" % (partIDs[0], partIDs[1]))
-    merged_subgraph = partition.graph.subgraph(partition.parts[partIDs[0]] | partition.parts[partIDs[1]])
-    subgraph_pop = partition["population"][partIDs[0]] + partition["population"][partIDs[1]] 
-    subgraph_reps = partition.district_reps[partIDs[0]] + partition.district_reps[partIDs[1]]
-    pop_target = (float(partition.district_reps[partIDs[0]])/subgraph_reps)*subgraph_pop
-    components, complement_or_not = split_graph_by_pop(merged_subgraph.graph, pop_target, subgraph_pop, epsilon)
+    stats = stats if stats is not None else RecomStats()
+    stats.n_steps += 1
+    while True:
+        partIDs = choose_pair(partition, stats)
+        stats.n_pairs += 1
+        logger.debug("doing recom on districts %d, %d" % (partIDs[0], partIDs[1]))
+        merged_subgraph = partition.graph.subgraph(partition.parts[partIDs[0]] | partition.parts[partIDs[1]])
+        subgraph_pop = partition["population"][partIDs[0]] + partition["population"][partIDs[1]] 
+        subgraph_reps = partition.district_reps[partIDs[0]] + partition.district_reps[partIDs[1]]
+        pop_target = (float(partition.district_reps[partIDs[0]])/subgraph_reps)*subgraph_pop
+        if split_infeasible(merged_subgraph.graph, pop_target, epsilon):
+            stats.n_precheck_rejections += 1
+            stats.mark_infeasible(pair_key(partition, partIDs))
+            continue
+        try:
+            components, complement_or_not = (split or split_graph_by_pop)(merged_subgraph.graph, pop_target, subgraph_pop, epsilon)
+            break
+        except SplitFailedError:
+            logger.debug("could not split districts %d, %d; trying another pair" % (partIDs[0], partIDs[1]))
+            stats.n_split_failures += 1
+            stats.mark_infeasible(pair_key(partition, partIDs))
     if complement_or_not: # component 0 matches the target pop
         flips = dict.fromkeys(components[0], partIDs[0]) | dict.fromkeys(components[1], partIDs[1]) 
     else:
@@ -62,16 +199,108 @@ def split_graph_by_pop(graph: nx.Graph, pop_target: int, graph_pop: int, epsilon
     pop_rng = (pop_target * (1 - epsilon), pop_target * (1 + epsilon))
     graph_edges = list(graph.edges)
     for i in range(node_repeats):
-        spanning_tree = rand_spanning_tree(graph, graph_edges)
-        root = random.choice(list(spanning_tree.nodes))
-        complement_or_not, cut_edge = find_cut(graph, spanning_tree, root, None, graph_pop, pop_rng)
-        if cut_edge:
-            logger.debug("finished recom after %d random spanning trees on %d nodes" % (i+1, len(spanning_tree.nodes)))
-            spanning_tree.remove_edge(cut_edge[0], cut_edge[1])
-            comp_1 = [node for node in nx.dfs_postorder_nodes(spanning_tree, source=cut_edge[0])]
-            comp_2 = [node for node in nx.dfs_postorder_nodes(spanning_tree, source=cut_edge[1])]
-            return((comp_1, comp_2), complement_or_not)
-    raise Exception("partitioning failed; could not find cut meeting population constraints")
+        split = try_split(graph, graph_edges, graph_pop, pop_rng)
+        if split is not None:
+            logger.debug("finished recom after %d random spanning trees on %d nodes" % (i+1, len(graph.nodes)))
+            return split
+    raise SplitFailedError("partitioning failed; could not find cut meeting population constraints")
+
+
+def try_split(graph: nx.Graph, graph_edges: list, graph_pop: int, pop_rng: tuple) -> tuple[tuple[list[int], list[int]], bool]:
+    """Draws one random spanning tree and returns the split along its first cut edge within pop_rng, or None if it has none."""
+
+    spanning_tree = rand_spanning_tree(graph, graph_edges)
+    root = random.choice(list(spanning_tree.nodes))
+    complement_or_not, cut_edge = find_cut(graph, spanning_tree, root, None, graph_pop, pop_rng)
+    if not cut_edge:
+        return None
+    spanning_tree.remove_edge(cut_edge[0], cut_edge[1])
+    comp_1 = [node for node in nx.dfs_postorder_nodes(spanning_tree, source=cut_edge[0])]
+    comp_2 = [node for node in nx.dfs_postorder_nodes(spanning_tree, source=cut_edge[1])]
+    return ((comp_1, comp_2), complement_or_not)
+
+
+_worker_split_graph: nx.Graph = None
+_worker_split_subgraph: tuple = (None, None, None)
+
+
+def _init_split_worker(graph: nx.Graph) -> None:
+    global _worker_split_graph
+    _worker_split_graph = nx.Graph()  # only what splits need, which is much faster to take subgraphs of
+    _worker_split_graph.add_nodes_from((n, {consts.POP_COL: graph.nodes[n][consts.POP_COL]}) for n in graph.nodes)
+    _worker_split_graph.add_edges_from(graph.edges)
+
+
+def _split_attempt_task(task: tuple) -> tuple[tuple[list[int], list[int]], bool]:
+    global _worker_split_subgraph
+    call_id, nodes, graph_pop, pop_rng, seed = task
+    if _worker_split_subgraph[0] != call_id: # a copy rather than a subgraph view, which is much slower to traverse
+        node_set: set[int] = set(nodes)
+        subgraph: nx.Graph = nx.Graph()
+        subgraph.add_nodes_from((n, _worker_split_graph.nodes[n]) for n in nodes)
+        subgraph.add_edges_from((u, v) for u in nodes for v in _worker_split_graph.adj[u] if v in node_set and u < v)
+        _worker_split_subgraph = (call_id, subgraph, list(subgraph.edges))
+    _, subgraph, edges = _worker_split_subgraph
+    random.seed(seed)
+    return try_split(subgraph, list(edges), graph_pop, pop_rng) # edges are shuffled in place, and every attempt must start from the same order
+
+
+class SpeculativeSplitter:
+    """
+    Parallel drop-in for split_graph_by_pop, for long single chains that can't
+    be sped up by running more chains at once. Each call draws spanning trees
+    in batches of batch_size attempts on a pool of worker processes (each with
+    its own copy of the graph), and takes the split of the lowest-index
+    successful attempt of the first batch that has one.
+
+    Attempts are independent, each seeded from the chain's random stream, so
+    the lowest-index success is exactly the first success of the sequential
+    loop, and the proposal distribution is unchanged: a single spanning tree
+    split conditioned on having a valid cut. Taking whichever attempt finishes
+    first instead would bias proposals towards trees that are fast to cut.
+    For a fixed batch_size, chains are reproducible from the main process's
+    random seed whatever the number of workers. Since pool workers can't start
+    pools of their own, it is only usable from the main process.
+
+    Fields:
+        n_workers: number of worker processes
+        batch_size: number of spanning trees drawn per round
+        pool: the worker pool
+        n_calls: number of splits done, which lets workers reuse the merged
+        subgraph across the batches of a split
+    """
+
+    n_workers: int
+    batch_size: int
+    pool: Pool
+    n_calls: int
+
+    def __init__(self, graph: nx.Graph, n_workers: int, batch_size: int = None) -> None:
+        self.n_workers = n_workers
+        self.batch_size = batch_size if batch_size is not None else n_workers
+        self.pool = worker_context().Pool(n_workers, initializer=_init_split_worker, initargs=(graph,))
+        self.n_calls = 0
+
+    def __call__(self, graph: nx.Graph, pop_target: int, graph_pop: int, epsilon: float, node_repeats: int = 500) -> tuple[tuple[list[int], list[int]], bool]:
+        pop_rng = (pop_target * (1 - epsilon), pop_target * (1 + epsilon))
+        nodes: list[int] = list(graph.nodes)
+        self.n_calls += 1
+        for start in range(0, node_repeats, self.batch_size):
+            seeds: list[int] = [random.getrandbits(64) for _ in range(min(self.batch_size, node_repeats - start))]
+            for i, split in enumerate(self.pool.map(_split_attempt_task, [(self.n_calls, nodes, graph_pop, pop_rng, seed) for seed in seeds])):
+                if split is not None:
+                    logger.debug("finished recom after %d random spanning trees on %d nodes" % (start+i+1, len(nodes)))
+                    return split
+        raise SplitFailedError("partitioning failed; could not find cut meeting population constraints")
+
+    def close(self) -> None:
+        self.pool.terminate()
+
+    def __enter__(self) -> SpeculativeSplitter:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
 
 
 def find_cut(graph: Graph, tree: Graph, curr_node: int, parent: int, graph_pop: int, pop_rng: tuple) -> tuple:
@@ -89,58 +318,290 @@ def find_cut(graph: Graph, tree: Graph, curr_node: int, parent: int, graph_pop:
     return (sum, None)
 
 
-def gen_random_map(seed_partition: VMDPartition, n_recom_steps: int, epsilon: float, constraints: list[str]) -> VMDPartition:
+def gen_random_map(seed_partition: VMDPartition, n_recom_steps: int, epsilon: float, constraints: list[str], diagnostics: ChainDiagnostics = None, target_ess: float = None, min_recom_steps: int = 10, trajectory: Trajectory = None, split: Callable = None, recom_stats: RecomStats = None) -> VMDPartition:
+    """
+    Runs a ReCom chain from the seed partition and returns its last map.
+
+    Arguments:
+        seed_partition: initial state of the chain
+        n_recom_steps: number of chain steps; the maximum number when target_ess is set
+        epsilon: acceptable population error threshold for each split
+        constraints: names of the constraints the chain must satisfy
+        diagnostics: if given, fed with every state of the chain
+        target_ess: if given along with diagnostics, the chain stops as soon as
+        the effective sample size of every diagnostic statistic reaches it
+        min_recom_steps: minimum number of steps before the chain may stop early
+        trajectory: if given (started at the seed partition with
+        Trajectory.from_partition()), every later state of the chain is
+        appended to it
+        split: function splitting merged districts, e.g. a SpeculativeSplitter
+        on the seed's graph; split_graph_by_pop by default
+        recom_stats: if given, counts the chain's pair attempts and failures
+        (on top of its earlier counts)
+    Returns:
+        the last map of the chain
+    """
+
+    if diagnostics is not None:
+        seed_partition = with_diagnostic_updaters(seed_partition)
+    recom_stats = recom_stats if recom_stats is not None else RecomStats()
+    recom_stats.start_chain()
     chain = MarkovChain( 
-        partial(vmd_recom, epsilon=epsilon),
-        constraints,
+        partial(vmd_recom, epsilon=epsilon, split=split, stats=recom_stats),
+        get_constraints(constraints, epsilon),
         always_accept,
         seed_partition,
         total_steps=n_recom_steps
     )
-    for partition in chain:
-        continue
+    for step, partition in enumerate(chain, start=1):
+        if trajectory is not None and step > 1:
+            trajectory.append(partition)
+        if diagnostics is None:
+            continue
+        diagnostics.update(partition)
+        if target_ess is not None and step >= min_recom_steps and diagnostics.min_ess() >= target_ess:
+            logger.debug(f"stopping chain after {step} steps with effective sample size {diagnostics.min_ess()}")
+            break
     return partition
     
 
-def gen_ensemble(seed_partition: VMDPartition, ensemble_size: int, n_recom_steps: int, epsilon: float, seed_type: str, constraints: list[str]) -> Ensemble:
+def gen_coarse_random_map(seed_partition: VMDPartition, coarse_graph: CoarseGraph, n_recom_steps: int, epsilon: float, constraints: list[str], diagnostics: ChainDiagnostics = None, target_ess: float = None, refine: bool = True, recom_stats: RecomStats = None) -> VMDPartition:
+    """
+    Runs a ReCom chain on the coarse version of a seed partition (see
+    coarsening.py) and returns its last map expanded to precincts. The coarse
+    chain splits with epsilon loosened to the super-node population cap, since
+    super-nodes can't be split; with refine, the map is then rebalanced to
+    within epsilon at precinct level. Diagnostics are computed on the coarse
+    chain.
+    """
+
+    coarse_epsilon: float = max(epsilon, coarse_graph.max_pop_fraction)
+    coarse_map: VMDPartition = gen_random_map(coarse_graph.coarsen_partition(seed_partition), n_recom_steps, coarse_epsilon, constraints, diagnostics, target_ess, recom_stats=recom_stats)
+    partition: VMDPartition = coarse_graph.uncoarsen_partition(coarse_map, seed_partition.graph)
+    return refine_population(partition, epsilon) if refine else partition
+
+
+def gen_ensemble(seed_partition: VMDPartition, ensemble_size: int, n_recom_steps: int, epsilon: float, seed_type: str, constraints: list[str], target_ess: float = None, n_split_workers: int = None) -> Ensemble:
+    """Generates an ensemble one chain at a time; with n_split_workers, each chain's splits are drawn in parallel by a SpeculativeSplitter."""
+
     logger.info(f"generating ensemble of size {ensemble_size}")
-    maps: list[VMDPartition] = [gen_random_map(seed_partition, n_recom_steps, epsilon, constraints) for _ in range(ensemble_size)]
-    return Ensemble(maps, n_recom_steps, epsilon, seed_type, constraints)
+    maps: list[VMDPartition] = []
+    chain_summaries: list[dict] = []
+    recom_stats = RecomStats()
+    splitter: SpeculativeSplitter = SpeculativeSplitter(seed_partition.graph.graph, n_split_workers) if n_split_workers is not None else None
+    try:
+        for _ in range(ensemble_size):
+            diagnostics = ChainDiagnostics()
+            maps.append(gen_random_map(seed_partition, n_recom_steps, epsilon, constraints, diagnostics, target_ess, split=splitter, recom_stats=recom_stats))
+            chain_summaries.append(diagnostics.summary())
+    finally:
+        if splitter is not None:
+            splitter.close()
+    ensemble = Ensemble(maps, n_recom_steps, epsilon, seed_type, constraints, {"diagnostics": ensemble_diagnostics(chain_summaries), "target_ess": target_ess,
+                                                                          "recom_stats": recom_stats.to_json_dict()})
+    ensemble.metadata["uniqueness"] = ensemble_plan_index(ensemble).stats()
+    return ensemble
+
 
+def gen_random_map_json_dict(seed_partition: dict, n_recom_steps: int, epsilon: float, constraints: list[str], target_ess: float = None, trajectory_file: Path = None, coarsening: float = None, refine: bool = True, random_seed: int = None) -> tuple[dict, dict, dict]:
+    """
+    Worker version of gen_random_map that takes and returns json dicts,
+    retrying failed chains. Also returns the chain's diagnostics summary and
+    its RecomStats counts, including those of failed attempts. If
+    trajectory_file is given, the whole trajectory of the chain is saved to it.
+    If coarsening is given, the chain runs on the seed's graph coarsened to
+    super-nodes of at most that fraction of the ideal district population (see
+    gen_coarse_random_map); the coarse graph is built once per worker.
+    Worker processes all start with the random state gerrychain seeds on
+    import, so each chain is given its own random_seed; otherwise the chains
+    run on different workers would be copies of each other.
+    """
 
-def gen_random_map_json_dict(seed_partition: dict, n_recom_steps: int, epsilon: float, constraints: list[str]) -> dict:
+    if random_seed is not None:
+        random.seed(random_seed)
     seed_partition = VMDPartition.from_json_dict(seed_partition)
-    chain = MarkovChain( 
-        partial(vmd_recom, epsilon=epsilon),
-        constraints,
-        always_accept,
-        seed_partition,
-        total_steps=n_recom_steps
-    )
+    if coarsening is not None and trajectory_file is not None:
+        raise Exception("trajectories of coarsened chains can't be saved")
+    coarse_graph: CoarseGraph = load_coarse_graph(seed_partition, coarsening) if coarsening is not None else None
+    recom_stats = RecomStats()
     for i in range(10):
         try:
-            for partition in chain:
-                continue
-            return partition.to_json_dict()
-        except:
-            logger.warning(f"generating random map failed; retrying")
+            diagnostics = ChainDiagnostics()
+            trajectory: Trajectory = Trajectory.from_partition(seed_partition) if trajectory_file is not None else None
+            if coarse_graph is not None:
+                partition = gen_coarse_random_map(seed_partition, coarse_graph, n_recom_steps, epsilon, constraints, diagnostics, target_ess, refine, recom_stats)
+            else:
+                partition = gen_random_map(seed_partition, n_recom_steps, epsilon, constraints, diagnostics, target_ess, trajectory=trajectory, recom_stats=recom_stats)
+            if trajectory is not None:
+                trajectory.to_file(trajectory_file)
+            return partition.to_json_dict(), diagnostics.summary(), recom_stats.to_json_dict()
+        except Exception as e:
+            logger.warning(f"generating random map failed ({e}); retrying")
+            recom_stats.n_chain_restarts += 1
     raise Exception("generating random map failed after many attempts")
 
 
-def gen_ensemble_parallel(seed_partition: VMDPartition, ensemble_size: int, n_recom_steps: int, epsilon: float, seed_type: str, constraints: list[str], n_workers: int) -> Ensemble:
+def gen_ensemble_parallel(seed_partition: VMDPartition, ensemble_size: int, n_recom_steps: int, epsilon: float, seed_type: str, constraints: list[str], n_workers: int, target_ess: float = None, target_rhat: float = None, min_chains: int = 4) -> Ensemble:
+    """
+    Generates an ensemble with one independent chain per map, in parallel.
+    Convergence diagnostics of every chain are recorded in the ensemble
+    metadata. If target_rhat is set, generation stops early (with fewer than
+    ensemble_size maps) once at least min_chains chains have finished and the
+    R-hat of every diagnostic statistic across them is at most target_rhat.
+    """
+
     logger.info(f"generating ensemble of size {ensemble_size} in parallel with {n_workers} workers")
-    args = (seed_partition.to_json_dict(), n_recom_steps, epsilon, constraints)
-    with Pool(n_workers) as p:
-        json_maps = p.starmap(gen_random_map_json_dict, [args for _ in range(ensemble_size)])
-    with CodeTimer("converting json_maps to VMDPartitions", logger_func=logger.debug):
-        # p = ThreadPool(n_workers)
-        # maps = p.map(VMDPartition.from_json_dict, json_maps)
-        maps = [VMDPartition.from_json_dict(json_map) for json_map in json_maps]
-    return Ensemble(maps, n_recom_steps, epsilon, seed_type, constraints)
+    job = EnsembleJob(seed_partition, ensemble_size, n_recom_steps, epsilon, seed_type, constraints, target_ess, target_rhat, min_chains)
+    return gen_ensembles_scheduled([job], n_workers)[0]
+
+
+class EnsembleJob:
+    """
+    One ensemble to generate with gen_ensembles_scheduled(), along with the
+    chains of it that have finished so far. The parameters are the same as
+    those of gen_ensemble_parallel(), plus trajectory_files: if given, the
+    file to save the trajectory of each chain to, and coarsening and refine
+    (see gen_random_map_json_dict).
+    """
+
+    seed_partition: VMDPartition
+    ensemble_size: int
+    n_recom_steps: int
+    epsilon: float
+    seed_type: str
+    constraints: list[str]
+    target_ess: float
+    target_rhat: float
+    min_chains: int
+    trajectory_files: list[Path]
+    coarsening: float
+    refine: bool
+    json_maps: list[dict]
+    chain_summaries: list[dict]
+    recom_stats: RecomStats
+    done: bool
+
+    def __init__(self, seed_partition: VMDPartition, ensemble_size: int, n_recom_steps: int, epsilon: float, seed_type: str, constraints: list[str], target_ess: float = None, target_rhat: float = None, min_chains: int = 4, trajectory_files: list[Path] = None, coarsening: float = None, refine: bool = True) -> None:
+        if coarsening is not None and trajectory_files is not None:
+            raise Exception("trajectories of coarsened chains can't be saved; unset SAVE_TRAJECTORIES or COARSENING")
+        self.seed_partition = seed_partition
+        self.ensemble_size = ensemble_size
+        self.n_recom_steps = n_recom_steps
+        self.epsilon = epsilon
+        self.seed_type = seed_type
+        self.constraints = constraints
+        self.target_ess = target_ess
+        self.target_rhat = target_rhat
+        self.min_chains = min_chains
+        self.trajectory_files = trajectory_files
+        self.coarsening = coarsening
+        self.refine = refine
+        self.json_maps = []
+        self.chain_summaries = []
+        self.recom_stats = RecomStats()
+        self.done = ensemble_size == 0
 
+    def chain_cost(self) -> int:
+        """Estimated cost of one chain of this job: each ReCom step takes time roughly proportional to the number of precincts."""
+
+        return len(self.seed_partition.graph.nodes)*self.n_recom_steps
+
+    def add_chain(self, json_map: dict, chain_summary: dict, recom_counts: dict[str, int]) -> None:
+        """Records a finished chain, and marks the job done once it has every map or, with target_rhat, once its chains have converged."""
+
+        self.json_maps.append(json_map)
+        self.chain_summaries.append(chain_summary)
+        self.recom_stats.merge(recom_counts)
+        if len(self.json_maps) >= self.ensemble_size:
+            self.done = True
+        elif self.target_rhat is not None and len(self.chain_summaries) >= self.min_chains:
+            rhats: dict[str, float] = ensemble_diagnostics(self.chain_summaries)["rhat"]
+            if all(r <= self.target_rhat for r in rhats.values()):
+                logger.info(f"stopping {self.seed_partition.state} ensemble generation after {len(self.json_maps)} maps with R-hat {rhats}")
+                self.done = True
+
+    def to_ensemble(self) -> Ensemble:
+        with CodeTimer("converting json_maps to VMDPartitions", logger_func=logger.debug):
+            maps = [VMDPartition.from_json_dict(json_map) for json_map in self.json_maps]
+        metadata: dict = {"diagnostics": ensemble_diagnostics(self.chain_summaries), "target_ess": self.target_ess, "target_rhat": self.target_rhat,
+                          "recom_stats": self.recom_stats.to_json_dict()}
+        if self.coarsening is not None:
+            metadata["coarsening"] = {"max_pop_fraction": self.coarsening, "refine": self.refine}
+        ensemble = Ensemble(maps, self.n_recom_steps, self.epsilon, self.seed_type, self.constraints, metadata)
+        logger.info(f"ReCom work of {self.seed_partition.state} ensemble: {metadata['recom_stats']}")
+        ensemble.metadata["uniqueness"] = ensemble_plan_index(ensemble).stats()
+        return ensemble
+
+
+def gen_ensembles_scheduled(jobs: list[EnsembleJob], n_workers: int, on_complete: Callable[[int, Ensemble], None] = None) -> list[Ensemble]:
+    """
+    Generates several ensembles (e.g. of different states, seed types or
+    sizes) on one worker pool. Every chain of every job is a separate task, and
+    tasks are handed out most expensive first (by chain_cost()), so the short
+    chains of small states fill in the gaps left while the last long chains
+    finish instead of leaving workers idle between ensembles. Workers cache each
+    state graph, so a worker loads it only once across all of its tasks.
+    Tasks are submitted one at a time as workers free up, skipping the chains
+    of jobs that are already done, so a job that stops early on R-hat stops
+    taking up workers. The random seed of every chain is drawn here, so the
+    ensembles only depend on the random state of the calling process.
+
+    Arguments:
+        jobs: ensembles to generate
+        n_workers: number of worker processes
+        on_complete: called with the index of each job and its ensemble as
+        soon as the job is done, e.g. to write the ensemble to its file. The
+        ensembles are then not kept, so only the unfinished ones are in memory.
+    Returns:
+        the ensemble of each job in the order of the jobs, or Nones if
+        on_complete is given
+    """
 
+    tasks: list[tuple] = []
+    for job_idx, job in enumerate(jobs):
+        seed_json: dict = job.seed_partition.to_json_dict()
+        tasks.extend((job_idx, seed_json, job.n_recom_steps, job.epsilon, job.constraints, job.target_ess, job.trajectory_files[i] if job.trajectory_files else None,
+                      job.coarsening, job.refine, random.getrandbits(64)) for i in range(job.ensemble_size))
+    tasks.sort(key=lambda task: jobs[task[0]].chain_cost(), reverse=True)
+    logger.info(f"scheduling {len(tasks)} chains of {len(jobs)} ensembles on {n_workers} workers")
 
+    ensembles: list[Ensemble] = [None]*len(jobs)
+    def complete(job_idx: int) -> None:
+        ensemble: Ensemble = jobs[job_idx].to_ensemble()
+        jobs[job_idx].json_maps = []
+        if on_complete is not None:
+            on_complete(job_idx, ensemble)
+        else:
+            ensembles[job_idx] = ensemble
 
+    for job_idx, job in enumerate(jobs):
+        if job.done:
+            complete(job_idx)
+    pending = (task for task in tasks if not jobs[task[0]].done) # checked as each task is submitted
+    results: SimpleQueue = SimpleQueue()
+    with worker_context().Pool(n_workers) as p:
+        def submit() -> bool:
+            task: tuple = next(pending, None)
+            if task is None:
+                return False
+            p.apply_async(_gen_scheduled_map_task, (task,), callback=results.put, error_callback=results.put)
+            return True
 
+        n_running: int = sum(submit() for _ in range(n_workers))
+        while n_running > 0 and not all(job.done for job in jobs):
+            result = results.get()
+            if isinstance(result, BaseException):
+                raise result
+            job_idx, json_map, chain_summary, recom_counts = result
+            job: EnsembleJob = jobs[job_idx]
+            if not job.done: # otherwise it stopped early on R-hat while this chain was running
+                job.add_chain(json_map, chain_summary, recom_counts)
+                if job.done:
+                    complete(job_idx)
+            n_running += submit() - 1
+    return ensembles
 
 
+def _gen_scheduled_map_task(task: tuple) -> tuple[int, dict, dict, dict]:
+    job_idx, *args = task
+    return (job_idx, *gen_random_map_json_dict(*args))
@@ -0,0 +1,257 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Iterator
+from contextlib import closing
+from gerrychain import Graph
+from ..custom_types import VMDPartition, RepsPerDistrict, Ensemble, vmd_updaters
+from .artifact_io import open_artifact
+from .utils import load_state_graph
+import numpy as np
+import json
+import consts
+import logging
+logger = logging.getLogger(__name__)
+
+"""
+This module contains a read-only, streaming view of a saved ensemble for
+analysis jobs (seat counts, histograms, district statistics) that don't need
+gerrychain Partitions. Ensemble.from_file() parses the whole file and builds a
+VMDPartition with updaters (and a freshly loaded state graph) for every map,
+while EnsembleView decodes the file incrementally and yields one MapRecord at a
+time, so iterating over an ensemble only holds one map in memory. A MapRecord
+is turned into a full VMDPartition only on request.
+"""
+
+
+READ_CHUNK_SIZE: int = 1 << 16
+WHITESPACE: str = " \t\n\r"
+DELIMITERS: str = WHITESPACE + ",:]}"
+HEADER_FIELDS: tuple[str] = ("n_recom_steps", "epsilon", "seed_type", "constraints", "metadata")
+
+
+class MapRecord:
+    """
+    Lightweight, read-only record of one ensemble map.
+
+    Fields:
+        assignment: array mapping each precinct (node) ID to its district ID
+        district_reps: number of representatives of each district
+        state: state the map is drawn on
+    """
+
+    assignment: np.ndarray
+    district_reps: RepsPerDistrict
+    state: str
+
+    def __init__(self, assignment: np.ndarray, district_reps: RepsPerDistrict, state: str) -> None:
+        self.assignment = assignment
+        self.district_reps = district_reps
+        self.state = state
+
+    @staticmethod
+    def from_json_dict(json_dict: dict) -> MapRecord:
+        n_precincts: int = len(json_dict["assignment"])
+        precIDs = np.fromiter((int(k) for k in json_dict["assignment"].keys()), dtype=np.int64, count=n_precincts)
+        districtIDs = np.fromiter(json_dict["assignment"].values(), dtype=np.int64, count=n_precincts)
+        assignment = np.full(max(n_precincts, int(precIDs.max())+1 if n_precincts > 0 else 0), -1, dtype=np.int64) # precincts missing from the map stay -1
+        assignment[precIDs] = districtIDs
+        return MapRecord(assignment, {int(k): v for k, v in json_dict["district_reps"].items()}, json_dict["state"])
+
+    @staticmethod
+    def from_partition(partition: VMDPartition) -> MapRecord:
+        assignment = np.empty(len(partition.graph.nodes), dtype=np.int64)
+        for precID, districtID in partition.assignment.items():
+            assignment[precID] = districtID
+        return MapRecord(assignment, partition.district_reps, partition.state)
+
+    def to_partition(self, graph: Graph = None) -> VMDPartition:
+        """Builds the full VMDPartition of this map, loading the state graph unless one is given."""
+
+        graph = graph if graph is not None else load_state_graph(self.state)
+        return VMDPartition(graph=graph,
+                            assignment={precID: int(districtID) for precID, districtID in enumerate(self.assignment)},
+                            state=self.state,
+                            district_reps=self.district_reps,
+                            updaters=vmd_updaters(),
+                            use_default_updaters=False)
+
+    def to_json_dict(self) -> dict:
+        return {"assignment": {precID: int(districtID) for precID, districtID in enumerate(self.assignment)},
+                "district_reps": self.district_reps,
+                "state": self.state}
+
+
+class _StreamingDecoder:
+    """
+    Incremental decoder of a JSON text stream that is read in chunks. Values
+    are decoded with json.JSONDecoder.raw_decode() from a buffer that only holds
+    the part of the stream that hasn't been consumed yet. While a value is
+    incomplete, each read is twice as large as the last, so a value spanning
+    many chunks is decoded a logarithmic number of times instead of once per
+    chunk.
+    """
+
+    def __init__(self, stream) -> None:
+        self.stream = stream
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _read(self, size: int = READ_CHUNK_SIZE) -> bool:
+        if self.eof:
+            return False
+        chunk: str = self.stream.read(size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Skips whitespace and returns the next character without consuming it."""
+
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read():
+                raise Exception("unexpected end of ensemble file")
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise Exception(f"malformed ensemble file: expected {char!r}, found {self.buffer[self.pos]!r}")
+        self.pos += 1
+
+    def value(self):
+        """
+        Decodes the next value. A value is only accepted once the character
+        after it has been read, since a value that ends at the end of the buffer
+        might be truncated (e.g. the number 0.25 read as far as "0.").
+        """
+
+        self.peek()
+        read_size: int = READ_CHUNK_SIZE
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                if (end < len(self.buffer) and self.buffer[end] in DELIMITERS) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._read(read_size)
+            read_size *= 2
+
+
+class EnsembleView:
+    """
+    Read-only view of a saved ensemble that streams its maps as MapRecords.
+    Iterating decodes the file one map at a time. The ensemble parameters are
+    read by a separate streaming pass the first time one is accessed (files
+    saved by Ensemble.to_file() list them before the maps, so this pass stops
+    right away).
+    """
+
+    file: Path
+
+    def __init__(self, file: Path) -> None:
+        self.file = file
+        self._header = None
+        self._graph = None
+
+    def _stream(self, decode_maps: bool) -> Iterator[dict]:
+        """
+        Yields the JSON dict of every map (only if decode_maps), and ends by
+        yielding the dict of the other top level fields.
+        """
+
+        header: dict = {}
+        with open_artifact(self.file) as f:
+            decoder = _StreamingDecoder(f)
+            decoder.expect("{")
+            while decoder.peek() != "}":
+                key: str = decoder.value()
+                decoder.expect(":")
+                if key != "maps":
+                    header[key] = decoder.value()
+                elif not decode_maps and all(field in header for field in HEADER_FIELDS):
+                    break # the parameters were saved before the maps, so there is no need to read them
+                else:
+                    decoder.expect("[")
+                    while decoder.peek() != "]":
+                        map_json: dict = decoder.value()
+                        if decode_maps:
+                            yield map_json
+                        if decoder.peek() == ",":
+                            decoder.expect(",")
+                    decoder.expect("]")
+                if decoder.peek() == ",":
+                    decoder.expect(",")
+        self._header = header
+        yield header
+
+    def __iter__(self) -> Iterator[MapRecord]:
+        logger.info(f"streaming maps of {self.file}")
+        with closing(self._stream(decode_maps=True)) as stream: # closes the file as soon as iteration stops, even if it stops early
+            for json_dict in stream:
+                if "assignment" in json_dict:
+                    yield MapRecord.from_json_dict(json_dict)
+
+    def header(self) -> dict:
+        if self._header is None:
+            for _ in self._stream(decode_maps=False):
+                pass
+        return self._header
+
+    @property
+    def n_recom_steps(self) -> int:
+        return self.header()["n_recom_steps"]
+
+    @property
+    def epsilon(self) -> float:
+        return self.header()["epsilon"]
+
+    @property
+    def seed_type(self) -> str:
+        return self.header()["seed_type"]
+
+    @property
+    def constraints(self) -> list[str]:
+        return self.header()["constraints"]
+
+    @property
+    def metadata(self) -> dict:
+        return self.header().get("metadata") or {}
+
+    def graph(self) -> Graph:
+        """Loads the state graph once, from the state of the first map."""
+
+        if self._graph is None:
+            with closing(iter(self)) as records:
+                state: str = next(records).state
+            self._graph = load_state_graph(state)
+        return self._graph
+
+    def partitions(self) -> Iterator[VMDPartition]:
+        """Streams the maps as full VMDPartitions, all sharing one state graph."""
+
+        graph: Graph = self.graph()
+        for record in self:
+            yield record.to_partition(graph)
+
+    def load(self) -> Ensemble:
+        """Loads the whole ensemble, with every map as a VMDPartition."""
+
+        return Ensemble(list(self.partitions()), self.n_recom_steps, self.epsilon, self.seed_type, self.constraints, self.metadata)
+
+
+def map_records(ensemble: Ensemble | EnsembleView) -> Iterator[MapRecord]:
+    """Iterates over the maps of a loaded ensemble or an ensemble view as MapRecords."""
+
+    if isinstance(ensemble, EnsembleView):
+        return iter(ensemble)
+    return (MapRecord.from_partition(m) for m in ensemble.maps)
@@ -0,0 +1,189 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from pathlib import Path
+from gerrychain import Partition
+from .utils import is_path_in_proj
+import numpy as np
+import shutil
+import uuid
+import json
+import os
+import consts
+import logging
+logger = logging.getLogger(__name__)
+if TYPE_CHECKING: # geopandas is slow to import, and only needed to build the cache or to get shapes
+    from geopandas import GeoSeries
+
+"""
+This module contains a columnar cache of each state's precinct geometries.
+Reading geometries.gpkg goes through GDAL and takes seconds for large states,
+on every run that plots or measures maps. Instead, the geometries are converted
+once into a directory of .npy columns next to the .gpkg: the WKB of every
+precinct concatenated into one byte array with the offset of each, and
+precomputed bounds, areas and centroids. Areas and centroids are computed in
+the state's UTM projection (the source CRS is usually longitude/latitude, in
+which areas are meaningless), and centroids are converted back to the source
+CRS so they can be drawn on the same axes as the geometries.
+
+Columns are memory-mapped, so opening a store reads almost nothing, and the
+numeric columns are used in place without copying; only getting shapely
+geometries back parses WKB. The cache records the size and modification time
+of the .gpkg it was built from and is rebuilt whenever they change. Each build
+goes into its own version directory named after that fingerprint: it is written
+to a temporary directory and renamed into place in one step, so readers never
+see a half-written cache, and processes that rebuild it at the same time all
+end up with the same directory (a rename that loses the race just uses the
+winner's). Versions of older sources are then deleted; readers that already
+mapped their files keep them until they close.
+"""
+
+
+GEOMETRY_CACHE_VERSION: int = 1
+GEOMETRY_COLUMNS: tuple[str] = ("wkb", "offsets", "bounds", "areas", "centroids", "index")
+GEOMETRY_CACHE_META_FILENAME: str = "meta.json"
+GEOMETRY_CACHE_TMP_PREFIX: str = "tmp-"
+
+
+def source_fingerprint(source: Path) -> dict:
+    stat = source.stat()
+    return {"version": GEOMETRY_CACHE_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def version_dirpath(dirpath: Path, fingerprint: dict) -> Path:
+    """Directory of the version of the cache in dirpath built from the source with the given fingerprint."""
+
+    return dirpath / f"v{fingerprint['version']}-{fingerprint['size']}-{fingerprint['mtime_ns']}"
+
+
+class GeometryStore:
+    """
+    Memory-mapped columns of the precinct geometries of one state, in the
+    order of the source GeoSeries (i.e. by precinct ID).
+
+    Fields:
+        dirpath: version directory of the cache
+        meta: fingerprint of the source file, and the source and projected CRS as WKT
+        wkb: WKB of every geometry, concatenated
+        offsets: (precincts + 1) array of the start of each geometry's WKB in wkb
+        bounds: (precincts, 4) array of the minx, miny, maxx, maxy of each geometry in the source CRS
+        areas: area of each geometry in the projected CRS's units (square meters)
+        centroids: (precincts, 2) array of the centroid of each geometry in the source CRS
+        index: index of the source GeoSeries
+    """
+
+    dirpath: Path
+    meta: dict
+    wkb: np.ndarray
+    offsets: np.ndarray
+    bounds: np.ndarray
+    areas: np.ndarray
+    centroids: np.ndarray
+    index: np.ndarray
+
+    def __init__(self, dirpath: Path) -> None:
+        self.dirpath = dirpath
+        with open(dirpath / GEOMETRY_CACHE_META_FILENAME) as f:
+            self.meta = json.load(f)
+        for column in GEOMETRY_COLUMNS:
+            setattr(self, column, np.load(dirpath / f"{column}.npy", mmap_mode="r"))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def geometry_wkb(self, i: int) -> memoryview:
+        """WKB of one geometry, without copying it out of the mapped file."""
+
+        return memoryview(self.wkb[self.offsets[i]:self.offsets[i+1]])
+
+    def geometries(self, precIDs: list[int] = None) -> GeoSeries:
+        """Parses the geometries (all of them, or those of the given precinct IDs) into a GeoSeries like the source one."""
+
+        from geopandas import GeoSeries
+        positions = np.arange(len(self)) if precIDs is None else np.asarray(precIDs)
+        return GeoSeries.from_wkb([self.geometry_wkb(i).tobytes() for i in positions], index=self.index[positions], crs=self.meta["crs"])
+
+    def district_centroids(self, partition: Partition) -> dict[int, tuple]:
+        """
+        Centroid of every district of a partition in the source CRS, as the
+        area-weighted mean of its precinct centroids, which is the centroid of
+        the union of the precincts since they don't overlap.
+        """
+
+        districtIDs: list[int] = sorted(partition.parts.keys())
+        district_idx = np.searchsorted(districtIDs, np.array([partition.assignment[p] for p in range(len(self))]))
+        district_areas = np.bincount(district_idx, weights=self.areas, minlength=len(districtIDs))
+        xs = np.bincount(district_idx, weights=self.areas*self.centroids[:, 0], minlength=len(districtIDs))/district_areas
+        ys = np.bincount(district_idx, weights=self.areas*self.centroids[:, 1], minlength=len(districtIDs))/district_areas
+        return {districtID: (float(x), float(y)) for districtID, x, y in zip(districtIDs, xs, ys)}
+
+    @staticmethod
+    def is_fresh(source: Path, dirpath: Path) -> bool:
+        """Whether the cache in dirpath has a version built from the current version of source."""
+
+        fingerprint: dict = source_fingerprint(source)
+        try:
+            with open(version_dirpath(dirpath, fingerprint) / GEOMETRY_CACHE_META_FILENAME) as f:
+                return json.load(f)["source"] == fingerprint
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return False
+
+    @staticmethod
+    def build(source: Path, dirpath: Path) -> GeometryStore:
+        """Converts a geometry file into a new version of the cache in dirpath, and deletes the other versions."""
+
+        if not is_path_in_proj(dirpath):
+            raise Exception("attempting to write in file outside of project directory")
+        from geopandas import GeoSeries
+        logger.info(f"building geometry cache of {source} in {dirpath}")
+        fingerprint: dict = source_fingerprint(source)
+        geometries: GeoSeries = GeoSeries.from_file(source)
+        projected: GeoSeries = geometries.to_crs(geometries.estimate_utm_crs()) if geometries.crs is not None and geometries.crs.is_geographic else geometries
+        centroids: GeoSeries = projected.centroid.to_crs(geometries.crs) if projected is not geometries else geometries.centroid
+        wkbs: list[bytes] = [geometry.wkb for geometry in geometries]
+        columns: dict[str, np.ndarray] = {
+            "wkb": np.frombuffer(b"".join(wkbs), dtype=np.uint8),
+            "offsets": np.concatenate([[0], np.cumsum([len(wkb) for wkb in wkbs])]).astype(np.int64),
+            "bounds": geometries.bounds.to_numpy(dtype=float),
+            "areas": projected.area.to_numpy(dtype=float),
+            "centroids": np.column_stack([centroids.x.to_numpy(dtype=float), centroids.y.to_numpy(dtype=float)]),
+            "index": geometries.index.to_numpy()}
+
+        tmp_dirpath: Path = dirpath / f"{GEOMETRY_CACHE_TMP_PREFIX}{uuid.uuid4().hex}"
+        tmp_dirpath.mkdir(parents=True)
+        for column, values in columns.items():
+            np.save(tmp_dirpath / f"{column}.npy", values, allow_pickle=False)
+        with open(tmp_dirpath / GEOMETRY_CACHE_META_FILENAME, "w") as f:
+            json.dump({"source": fingerprint,
+                       "crs": geometries.crs.to_wkt() if geometries.crs is not None else None,
+                       "projected_crs": projected.crs.to_wkt() if projected.crs is not None else None}, f)
+        version: Path = version_dirpath(dirpath, fingerprint)
+        try:
+            os.rename(tmp_dirpath, version)
+        except OSError:
+            shutil.rmtree(tmp_dirpath, ignore_errors=True)
+            if not (version / GEOMETRY_CACHE_META_FILENAME).exists(): # the rename didn't lose to a concurrent build of the same version
+                raise
+            logger.info(f"geometry cache {version} was built concurrently; using that one")
+        for entry in dirpath.iterdir():
+            if entry != version and not entry.name.startswith(GEOMETRY_CACHE_TMP_PREFIX): # other builds may still be writing their temporary directories
+                if entry.is_dir():
+                    shutil.rmtree(entry, ignore_errors=True)
+                else:
+                    entry.unlink(missing_ok=True)
+        return GeometryStore(version)
+
+
+def load_geometry_store(state: str) -> GeometryStore:
+    """Opens the geometry cache of a state, building it first if it is missing or its .gpkg changed."""
+
+    source: Path = consts.STATE_GEOMETRY_FILEPATH(state)
+    dirpath: Path = consts.STATE_GEOMETRY_CACHE_DIRPATH(state)
+    if not GeometryStore.is_fresh(source, dirpath):
+        return GeometryStore.build(source, dirpath)
+    return GeometryStore(version_dirpath(dirpath, source_fingerprint(source)))
+
+
+def load_state_geometries(state: str) -> GeoSeries:
+    """Drop-in for GeoSeries.from_file(consts.STATE_GEOMETRY_FILEPATH(state)) that reads the geometry cache."""
+
+    return load_geometry_store(state).geometries()
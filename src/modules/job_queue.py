@@ -0,0 +1,225 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Iterator
+from ..custom_types import Ensemble, VMDPartition
+from .diagnostics import ensemble_diagnostics
+from .ensemble_generation import RecomStats
+from .plan_hashing import ensemble_plan_index
+import sqlite3
+import time
+import json
+import consts
+import logging
+logger = logging.getLogger(__name__)
+
+"""
+This module contains a work queue for generating ensembles on any number of
+machines that share a filesystem, with nothing but an SQLite file on that
+filesystem. Each job is a batch of chains (state, seed, n_recom_steps,
+epsilon, constraints, batch size) whose maps are saved as one ensemble file.
+
+Workers lease jobs: a lease is taken in an immediate (write-locked)
+transaction, so no two workers can take the same job, and expires
+lease_seconds later unless the worker renews it with a heartbeat. Leases of
+crashed or disconnected workers expire and their jobs go back to the queue, up
+to max_attempts attempts. A worker that lost its lease can no longer heartbeat
+or complete the job. The file uses SQLite's default rollback journal rather
+than WAL, since WAL needs shared memory that network filesystems don't
+provide.
+"""
+
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    state TEXT NOT NULL,
+    district_type TEXT NOT NULL,
+    seed_type TEXT NOT NULL,
+    n_recom_steps INTEGER NOT NULL,
+    epsilon REAL NOT NULL,
+    constraints TEXT NOT NULL,
+    batch_size INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    lease_owner TEXT,
+    lease_expires REAL,
+    result_file TEXT,
+    error TEXT,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+"""
+JOB_STATUSES: tuple[str] = ("pending", "leased", "done", "failed")
+
+
+class QueueJob:
+    """
+    One batch of chains in the queue.
+
+    Fields:
+        state: state to generate maps on
+        district_type: "smd" or "mmd", which seeds directory seed_type is in
+        seed_type: seed file name, e.g. "actual" or an MMD config chooser name
+        n_recom_steps: number of steps of each chain
+        epsilon: population error threshold of each split
+        constraints: names of the chain constraints
+        batch_size: number of chains (maps) in the batch
+        id: ID of the job in the queue, None until submitted
+        attempts: number of times the job has been leased
+        result_file: ensemble file of the finished batch, relative to the project root
+    """
+
+    state: str
+    district_type: str
+    seed_type: str
+    n_recom_steps: int
+    epsilon: float
+    constraints: list[str]
+    batch_size: int
+    id: int
+    attempts: int
+    result_file: str
+
+    def __init__(self, state: str, district_type: str, seed_type: str, n_recom_steps: int, epsilon: float, constraints: list[str], batch_size: int,
+                 id: int = None, attempts: int = 0, result_file: str = None) -> None:
+        self.state = state
+        self.district_type = district_type
+        self.seed_type = seed_type
+        self.n_recom_steps = n_recom_steps
+        self.epsilon = epsilon
+        self.constraints = constraints
+        self.batch_size = batch_size
+        self.id = id
+        self.attempts = attempts
+        self.result_file = result_file
+
+    @staticmethod
+    def from_row(row: sqlite3.Row) -> QueueJob:
+        return QueueJob(row["state"], row["district_type"], row["seed_type"], row["n_recom_steps"], row["epsilon"], json.loads(row["constraints"]),
+                        row["batch_size"], row["id"], row["attempts"], row["result_file"])
+
+    def seed_file(self) -> Path:
+        seeds_dirpath = consts.SMD_SEEDS_DIRPATH if self.district_type == "smd" else consts.MMD_SEEDS_DIRPATH
+        return seeds_dirpath(self.state) / self.seed_type
+
+    def ensemble_dirpath(self) -> Path:
+        return consts.SMD_ENSEMBLE_DIRPATH(self.state) if self.district_type == "smd" else consts.MMD_ENSEMBLE_DIRPATH(self.state)
+
+    def params(self) -> tuple:
+        """The parameters that batches of the same ensemble share."""
+
+        return (self.state, self.district_type, self.seed_type, self.n_recom_steps, self.epsilon, tuple(self.constraints))
+
+    def __repr__(self) -> str:
+        return f"<QueueJob {self.id}: {self.batch_size} {self.district_type} maps of {self.state} from {self.seed_type}, {self.n_recom_steps} steps, epsilon {self.epsilon}, constraints {self.constraints}>"
+
+
+class JobQueue:
+    """SQLite-backed job queue; see the module docstring."""
+
+    file: Path
+    connection: sqlite3.Connection
+
+    def __init__(self, file: Path, timeout: float = 60) -> None:
+        self.file = file
+        file.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(file, timeout=timeout, isolation_level=None) # transactions are managed explicitly
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=DELETE")
+        self.connection.executescript(SCHEMA)
+
+    def _transaction(self) -> sqlite3.Connection:
+        """Starts a write transaction right away, so that reads in it can't race with other workers' writes."""
+
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def submit(self, job: QueueJob, max_attempts: int = 3) -> int:
+        cursor = self.connection.execute("INSERT INTO jobs (state, district_type, seed_type, n_recom_steps, epsilon, constraints, batch_size, max_attempts, updated) "
+                                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                         (job.state, job.district_type, job.seed_type, job.n_recom_steps, job.epsilon, json.dumps(job.constraints),
+                                          job.batch_size, max_attempts, time.time()))
+        job.id = cursor.lastrowid
+        return job.id
+
+    def _expire_leases(self, now: float) -> None:
+        expired: int = self.connection.execute("UPDATE jobs SET status = CASE WHEN attempts < max_attempts THEN 'pending' ELSE 'failed' END, "
+                                               "lease_owner = NULL, lease_expires = NULL, error = 'lease expired', updated = ? "
+                                               "WHERE status = 'leased' AND lease_expires < ?", (now, now)).rowcount
+        if expired > 0:
+            logger.warning(f"{expired} job leases expired")
+
+    def lease(self, worker_id: str, lease_seconds: float) -> QueueJob:
+        """Atomically takes the oldest pending job (after returning expired leases to the queue), or returns None if there is none."""
+
+        now: float = time.time()
+        connection = self._transaction()
+        try:
+            self._expire_leases(now)
+            row: sqlite3.Row = connection.execute("SELECT * FROM jobs WHERE status = 'pending' ORDER BY id LIMIT 1").fetchone()
+            if row is not None:
+                connection.execute("UPDATE jobs SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                                   (worker_id, now + lease_seconds, now, row["id"]))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        job: QueueJob = QueueJob.from_row(row)
+        job.attempts += 1
+        return job
+
+    def _update_leased(self, job_id: int, worker_id: str, assignments: str, params: tuple) -> bool:
+        """Updates a job only if worker_id still holds its lease; returns whether it did."""
+
+        return self.connection.execute(f"UPDATE jobs SET {assignments}, updated = ? WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+                                       (*params, time.time(), job_id, worker_id)).rowcount == 1
+
+    def heartbeat(self, job_id: int, worker_id: str, lease_seconds: float) -> bool:
+        """Extends a lease; returns False if the worker no longer holds it."""
+
+        return self._update_leased(job_id, worker_id, "lease_expires = ?", (time.time() + lease_seconds,))
+
+    def complete(self, job_id: int, worker_id: str, result_file: Path) -> bool:
+        return self._update_leased(job_id, worker_id, "status = 'done', lease_owner = NULL, lease_expires = NULL, result_file = ?",
+                                   (str(result_file.relative_to(consts.PROJ_ROOT)),))
+
+    def fail(self, job_id: int, worker_id: str, error: str) -> bool:
+        """Gives up a leased job after an error; it goes back to the queue unless it has used all of its attempts."""
+
+        return self._update_leased(job_id, worker_id, "status = CASE WHEN attempts < max_attempts THEN 'pending' ELSE 'failed' END, "
+                                   "lease_owner = NULL, lease_expires = NULL, error = ?", (error,))
+
+    def counts(self) -> dict[str, int]:
+        counts: dict[str, int] = dict.fromkeys(JOB_STATUSES, 0)
+        for row in self.connection.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"):
+            counts[row["status"]] = row["n"]
+        return counts
+
+    def jobs(self, status: str = None) -> Iterator[QueueJob]:
+        query: str = "SELECT * FROM jobs" + (" WHERE status = ?" if status is not None else "") + " ORDER BY id"
+        for row in self.connection.execute(query, (status,) if status is not None else ()):
+            yield QueueJob.from_row(row)
+
+
+def merge_results(jobs: list[QueueJob]) -> Ensemble:
+    """Combines the result files of finished batches of the same ensemble into one Ensemble, recomputing its diagnostics over all chains and summing their ReCom work counts."""
+
+    if len({job.params() for job in jobs}) != 1:
+        raise Exception("can only merge batches with the same state, seed, steps, epsilon and constraints")
+    batches: list[Ensemble] = [Ensemble.from_file(consts.PROJ_ROOT / job.result_file) for job in jobs]
+    maps: list[VMDPartition] = [m for batch in batches for m in batch.maps]
+    chain_summaries: list[dict] = [c for batch in batches for c in batch.metadata.get("diagnostics", {}).get("chains", [])]
+    recom_stats = RecomStats()
+    for batch in batches:
+        if "recom_stats" in batch.metadata:
+            recom_stats.merge(batch.metadata["recom_stats"])
+    ensemble = Ensemble(maps, jobs[0].n_recom_steps, jobs[0].epsilon, jobs[0].seed_type, jobs[0].constraints,
+                        {"diagnostics": ensemble_diagnostics(chain_summaries), "recom_stats": recom_stats.to_json_dict(), "queue_jobs": [job.id for job in jobs]})
+    ensemble.metadata["uniqueness"] = ensemble_plan_index(ensemble).stats()
+    return ensemble
@@ -2,12 +2,11 @@ from gerrychain import Partition
 from ..custom_types import VMDPartition
 import networkx as nx
 import random
-from gerrychain.updaters import Tally, cut_edges
 from linetimer import linetimer
 from .utils import rand_spanning_tree
 import itertools
 from linetimer import CodeTimer
-from ..custom_types import RepsPerDistrict, Assignment
+from ..custom_types import RepsPerDistrict, Assignment, vmd_updaters
 flatten = itertools.chain.from_iterable
 import consts
 import logging
@@ -66,13 +65,14 @@ def gen_smd_adjacency_graph(smd_partition: Partition) -> nx.Graph:
     Arguments:
         partition: gerrychain Partition initialized with an SMD assignment
     Returns:
-        adjacency graph of SMDs
+        adjacency graph of SMDs, with the number of precinct edges on each
+        shared boundary as the n_boundary_edges edge attribute
     """
 
-    edgelist = []
-    for edge in smd_partition[consts.CUT_EDGE_UPDATER]:
-        edgelist.append((smd_partition.assignment[edge[0]], smd_partition.assignment[edge[1]]))
-    return nx.Graph(edgelist)
+    smd_graph = nx.Graph()
+    for (u, v), n_boundary_edges in smd_partition[consts.DISTRICT_ADJACENCY_UPDATER].district_pairs().items():
+        smd_graph.add_edge(u, v, n_boundary_edges=n_boundary_edges)
+    return smd_graph
 
 
 @linetimer(name="cutting smd graph into proportions specified by config", logger_func=logger.info)
@@ -152,5 +152,6 @@ def gen_mmd_seed_partition(smd_partition: VMDPartition, mmd_choosing_strategy: "
         assignment=mmd_assignment,
         state=smd_partition.state,
         district_reps=mmd_config,
-        updaters={consts.CUT_EDGE_UPDATER: cut_edges, consts.POP_UPDATER: Tally(consts.POP_COL, consts.POP_UPDATER)}
+        updaters=vmd_updaters(),
+        use_default_updaters=False
     )
\ No newline at end of file
@@ -0,0 +1,282 @@
+from __future__ import annotations
+from pathlib import Path
+from gerrychain import Graph
+from ..custom_types import Ensemble
+from .ensemble_view import EnsembleView, MapRecord, map_records
+from .election import party_line_stv_seats, election_name
+from .artifact_io import BackgroundWriter, read_artifact, write_artifact
+from .utils import is_path_in_proj, load_state_graph, worker_context
+import numpy as np
+import random
+import math
+import json
+import logging
+logger = logging.getLogger(__name__)
+
+"""
+This module contains a constant-memory outlier analysis of a plan (usually the
+enacted one) against ensembles. Every map of an ensemble is reduced to a few
+metrics (its cut edge count, and for every election its democrat seat count and
+its sorted district democrat vote shares, i.e. the vote share of its least
+democratic district, second least, ...), and each metric is fed into a KLL
+quantile sketch instead of being stored. A sketch keeps O(k log(n/k)) values
+for n maps, answers rank and quantile queries with error around 1/k of the
+ensemble, and merges with other sketches of the same metric, so ensembles
+sketched by different workers or different runs combine into one analysis
+without their maps. Sketches of fewer than k maps are exact.
+"""
+
+
+DEFAULT_SKETCH_SIZE: int = 200
+COMPACTOR_DECAY: float = 2/3
+REPORT_QUANTILES: tuple = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+
+class KLLSketch:
+    """
+    KLL quantile sketch (Karnin, Lang and Liberty, 2016) of a stream of numbers.
+
+    Fields:
+        k: size of the top compactor, which sets the accuracy of the sketch
+        n: number of values seen
+        compactors: values kept at each level; a value at level h stands for
+        2^h values of the stream
+    """
+
+    k: int
+    n: int
+    compactors: list[list[float]]
+
+    def __init__(self, k: int = DEFAULT_SKETCH_SIZE) -> None:
+        self.k = k
+        self.n = 0
+        self.compactors = [[]]
+
+    def _capacity(self, level: int) -> int:
+        depth: int = len(self.compactors) - level - 1
+        return max(2, int(math.ceil(self.k*COMPACTOR_DECAY**depth)))
+
+    def _compress(self) -> None:
+        """Compacts every full level by sorting it and promoting every other value (from a random offset) to the next level."""
+
+        level: int = 0
+        while level < len(self.compactors):
+            if len(self.compactors[level]) >= self._capacity(level):
+                if level + 1 == len(self.compactors):
+                    self.compactors.append([])
+                values: list[float] = sorted(self.compactors[level])
+                kept: list[float] = [values.pop()] if len(values) % 2 == 1 else []
+                self.compactors[level+1].extend(values[random.randint(0, 1)::2])
+                self.compactors[level] = kept
+            level += 1
+
+    def update(self, x: float) -> None:
+        self.compactors[0].append(float(x))
+        self.n += 1
+        self._compress()
+
+    def merge(self, other: KLLSketch) -> None:
+        """Adds the values summarized by another sketch to this one."""
+
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+        for level, values in enumerate(other.compactors):
+            self.compactors[level].extend(values)
+        self.n += other.n
+        self._compress()
+
+    def __len__(self) -> int:
+        return self.n
+
+    def _weighted_values(self) -> tuple[np.ndarray, np.ndarray]:
+        values = np.array([x for compactor in self.compactors for x in compactor], dtype=float)
+        weights = np.array([2**level for level, compactor in enumerate(self.compactors) for _ in compactor], dtype=float)
+        order = np.argsort(values, kind="stable")
+        return values[order], weights[order]
+
+    def rank(self, x: float, inclusive: bool = True) -> float:
+        """Estimated fraction of the stream that is at most x (or below x if not inclusive)."""
+
+        if self.n == 0:
+            return float("nan")
+        values, weights = self._weighted_values()
+        below = values <= x if inclusive else values < x
+        return float(weights[below].sum()/weights.sum())
+
+    def quantile(self, q: float) -> float:
+        if self.n == 0:
+            return float("nan")
+        values, weights = self._weighted_values()
+        cumulative = np.cumsum(weights)
+        return float(values[min(np.searchsorted(cumulative, q*cumulative[-1]), len(values)-1)])
+
+    def to_json_dict(self) -> dict:
+        return {"k": self.k, "n": self.n, "compactors": self.compactors}
+
+    @staticmethod
+    def from_json_dict(json_dict: dict) -> KLLSketch:
+        sketch = KLLSketch(json_dict["k"])
+        sketch.n = json_dict["n"]
+        sketch.compactors = [list(compactor) for compactor in json_dict["compactors"]]
+        return sketch
+
+
+class PlanMetrics:
+    """
+    Computes the metrics of maps on one state graph for a set of elections.
+
+    Fields:
+        vote_col_pairs: (democrat, republican) precinct vote columns of each election
+        precinct_votes: (precincts, 2 x elections) array of the democrat and
+        republican votes of each election
+        edges: (edges, 2) array of the graph's edges
+    """
+
+    vote_col_pairs: list[tuple[str, str]]
+    precinct_votes: np.ndarray
+    edges: np.ndarray
+
+    def __init__(self, graph: Graph, vote_col_pairs: list[tuple[str, str]]) -> None:
+        self.vote_col_pairs = [tuple(pair) for pair in vote_col_pairs]
+        self.precinct_votes = np.array([[graph.nodes[p][col] for pair in self.vote_col_pairs for col in pair] for p in graph.nodes], dtype=float)
+        self.edges = np.array(list(graph.edges), dtype=np.int64).reshape(-1, 2)
+
+    def __call__(self, record: MapRecord) -> dict[str, float]:
+        districtIDs: list[int] = sorted(record.district_reps.keys())
+        district_idx = np.searchsorted(districtIDs, record.assignment)
+        district_votes = np.stack([np.bincount(district_idx, weights=col, minlength=len(districtIDs)) for col in self.precinct_votes.T], axis=1)
+        reps = np.array([record.district_reps[d] for d in districtIDs])
+        metrics: dict[str, float] = {"cut_edges": float(np.count_nonzero(record.assignment[self.edges[:, 0]] != record.assignment[self.edges[:, 1]]))}
+        for election_idx, (dem_col, rep_col) in enumerate(self.vote_col_pairs):
+            name: str = election_name(dem_col, rep_col)
+            dem_votes, rep_votes = district_votes[:, 2*election_idx], district_votes[:, 2*election_idx+1]
+            seats = np.where(reps == 1, (dem_votes > rep_votes).astype(int), party_line_stv_seats(dem_votes, rep_votes, reps))
+            metrics[f"{name}/dem_seats"] = float(seats.sum())
+            with np.errstate(divide="ignore", invalid="ignore"):
+                vote_shares = np.sort(np.where(dem_votes + rep_votes > 0, dem_votes/(dem_votes + rep_votes), 0))
+            for rank, vote_share in enumerate(vote_shares, start=1):
+                metrics[f"{name}/vote_share_{rank}"] = float(vote_share)
+        return metrics
+
+
+class OutlierAnalyzer:
+    """
+    Streaming quantile sketches of the metrics of ensemble maps on one state.
+
+    Fields:
+        state: state of the sketched maps
+        vote_col_pairs: (democrat, republican) precinct vote columns of each election
+        k: size of the sketches
+        sketches: one KLLSketch per metric
+    """
+
+    state: str
+    vote_col_pairs: list[tuple[str, str]]
+    k: int
+    sketches: dict[str, KLLSketch]
+
+    def __init__(self, state: str, vote_col_pairs: list[tuple[str, str]], k: int = DEFAULT_SKETCH_SIZE) -> None:
+        self.state = state
+        self.vote_col_pairs = [tuple(pair) for pair in vote_col_pairs]
+        self.k = k
+        self.sketches = {}
+        self._metrics = None
+
+    def metrics(self, record: MapRecord) -> dict[str, float]:
+        if self._metrics is None:
+            self._metrics = PlanMetrics(load_state_graph(self.state), self.vote_col_pairs)
+        return self._metrics(record)
+
+    def update(self, record: MapRecord) -> None:
+        for name, value in self.metrics(record).items():
+            self.sketches.setdefault(name, KLLSketch(self.k)).update(value)
+
+    def update_ensemble(self, ensemble: Ensemble | EnsembleView) -> None:
+        for record in map_records(ensemble):
+            self.update(record)
+
+    def merge(self, other: OutlierAnalyzer) -> None:
+        """Adds the maps sketched by another analyzer of the same state and elections."""
+
+        if other.state != self.state or other.vote_col_pairs != self.vote_col_pairs:
+            raise Exception(f"cannot merge sketches of {other.state} {other.vote_col_pairs} into sketches of {self.state} {self.vote_col_pairs}")
+        for name, sketch in other.sketches.items():
+            self.sketches.setdefault(name, KLLSketch(self.k)).merge(sketch)
+
+    def n_maps(self) -> int:
+        return max((len(s) for s in self.sketches.values()), default=0)
+
+    def report(self, plan: MapRecord) -> dict[str, dict]:
+        """
+        Places a plan in the sketched ensemble distribution of every metric.
+
+        Arguments:
+            plan: plan to analyze, e.g. MapRecord.from_partition of the enacted SMD seed
+        Returns:
+            dict with, for each metric sketched from the ensemble, the plan's
+            value, its percentile in the ensemble (ties count half) and the
+            ensemble quantiles in REPORT_QUANTILES. Metrics the plan doesn't
+            have (e.g. vote shares of districts it doesn't have) are left out.
+        """
+
+        report: dict[str, dict] = {}
+        for name, value in self.metrics(plan).items():
+            if name not in self.sketches:
+                continue
+            sketch: KLLSketch = self.sketches[name]
+            report[name] = {"value": value,
+                            "percentile": 50*(sketch.rank(value, inclusive=False) + sketch.rank(value, inclusive=True)),
+                            "quantiles": {q: sketch.quantile(q) for q in REPORT_QUANTILES}}
+        return report
+
+    def to_json_dict(self) -> dict:
+        return {"state": self.state,
+                "vote_col_pairs": self.vote_col_pairs,
+                "k": self.k,
+                "sketches": {name: sketch.to_json_dict() for name, sketch in self.sketches.items()}}
+
+    @staticmethod
+    def from_json_dict(json_dict: dict) -> OutlierAnalyzer:
+        analyzer = OutlierAnalyzer(json_dict["state"], json_dict["vote_col_pairs"], json_dict["k"])
+        analyzer.sketches = {name: KLLSketch.from_json_dict(sketch) for name, sketch in json_dict["sketches"].items()}
+        return analyzer
+
+    @staticmethod
+    def from_file(file: Path) -> OutlierAnalyzer:
+        logger.info(f"loading OutlierAnalyzer from {file}")
+        return OutlierAnalyzer.from_json_dict(json.loads(read_artifact(file)))
+
+    def to_file(self, file: Path, writer: BackgroundWriter = None) -> None:
+        """Saves the sketches, compressed according to the file extension, optionally through a BackgroundWriter."""
+
+        if not is_path_in_proj(file):
+            raise Exception("attempting to write in file outside of project directory")
+        logger.info(f"saving OutlierAnalyzer of {self.n_maps()} maps to {file}")
+        json_dict: dict = self.to_json_dict()
+        if writer is not None:
+            writer.submit(file, lambda: json.dumps(json_dict))
+        else:
+            write_artifact(file, json.dumps(json_dict))
+
+
+def _sketch_ensemble_file_task(task: tuple) -> dict:
+    file, state, vote_col_pairs, k = task
+    analyzer = OutlierAnalyzer(state, vote_col_pairs, k)
+    analyzer.update_ensemble(EnsembleView(file))
+    return analyzer.to_json_dict()
+
+
+def sketch_ensemble_files(files: list[Path], state: str, vote_col_pairs: list[tuple[str, str]], n_workers: int, k: int = DEFAULT_SKETCH_SIZE) -> OutlierAnalyzer:
+    """
+    Sketches several ensemble files of the same state in parallel, one file per
+    task streamed through an EnsembleView, and merges the sketches of all files.
+    """
+
+    analyzer = OutlierAnalyzer(state, vote_col_pairs, k)
+    if not files:
+        return analyzer
+    with worker_context().Pool(min(n_workers, len(files))) as p:
+        for json_dict in p.imap_unordered(_sketch_ensemble_file_task, [(file, state, vote_col_pairs, k) for file in files]):
+            analyzer.merge(OutlierAnalyzer.from_json_dict(json_dict))
+    logger.info(f"sketched {analyzer.n_maps()} maps from {len(files)} ensembles")
+    return analyzer
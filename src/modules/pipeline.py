@@ -0,0 +1,151 @@
+from pathlib import Path
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import consts
+import logging
+logger = logging.getLogger(__name__)
+
+"""
+This module contains a small cached pipeline runner. A pipeline is a list of
+stages in dependency order, each of which produces artifact files for one
+state from its parameters and the artifacts of its upstream stages. Every stage
+run is keyed by a content hash of the stage's parameters, its source files and
+its upstream artifacts. The key and the artifacts produced are recorded in a
+per-state manifest, so a stage whose key matches the manifest and whose
+artifacts still exist is skipped. Since stochastic stages (e.g. ensemble
+generation) produce new content each time they rerun, their downstream stages
+are invalidated and rerun too.
+"""
+
+
+MANIFEST_FILENAME: str = "pipeline_cache.json"
+MANIFEST_FILEPATH = lambda state: consts.STATE_DIRPATH(state) / MANIFEST_FILENAME
+
+
+class Stage:
+    """
+    One step of a pipeline.
+
+    Fields:
+        name: unique name of the stage, used as its manifest key
+        inputs: names of the upstream stages whose artifacts this stage reads
+        run: function (state, params, input files) -> output files, where the
+        input files are the artifacts of the upstream stages in order
+        sources: function state -> source files (not produced by any stage)
+        that the stage reads, e.g. the state graph
+    """
+
+    name: str
+    inputs: list[str]
+    run: Callable[[str, dict, list[Path]], list[Path]]
+    sources: Callable[[str], list[Path]]
+
+    def __init__(self, name: str, inputs: list[str], run: Callable[[str, dict, list[Path]], list[Path]], sources: Callable[[str], list[Path]] = lambda state: []) -> None:
+        self.name = name
+        self.inputs = inputs
+        self.run = run
+        self.sources = sources
+
+
+def file_hash(file: Path) -> str:
+    h = hashlib.sha256()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def stage_key(stage: Stage, params: dict, source_hashes: list[str], input_hashes: list[str]) -> str:
+    return hashlib.sha256(json.dumps({"stage": stage.name,
+                                      "params": params,
+                                      "sources": source_hashes,
+                                      "inputs": input_hashes}, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def load_manifest(state: str) -> dict:
+    file: Path = MANIFEST_FILEPATH(state)
+    return json.loads(file.read_text()) if file.exists() else {}
+
+
+def save_manifest(state: str, manifest: dict) -> None:
+    file: Path = MANIFEST_FILEPATH(state)
+    file.write_text(json.dumps(manifest, indent=2))
+
+
+def upstream_stages(stages: list[Stage], targets: list[str]) -> list[Stage]:
+    """Returns the target stages and everything upstream of them, in pipeline order."""
+
+    by_name: dict[str, Stage] = {s.name: s for s in stages}
+    needed: set[str] = set()
+    pending: list[str] = list(targets)
+    while pending:
+        name = pending.pop()
+        if name not in by_name:
+            raise Exception(f"unknown stage {name}; available stages are {list(by_name.keys())}")
+        if name not in needed:
+            needed.add(name)
+            pending.extend(by_name[name].inputs)
+    return [s for s in stages if s.name in needed]
+
+
+def run_state_pipeline(stages: list[Stage], params: dict[str, dict], state: str, force: bool = False) -> dict:
+    """
+    Runs the stages for one state, skipping every stage that is up to date
+    with the manifest unless force is set.
+
+    Arguments:
+        stages: stages to run, in dependency order
+        params: parameters of each stage, by stage name
+        state: state to run the stages on
+        force: rerun every stage regardless of the manifest
+    Returns:
+        the state's updated manifest
+    """
+
+    manifest: dict = load_manifest(state)
+    for stage in stages:
+        input_files: list[Path] = [consts.PROJ_ROOT / f for i in stage.inputs for f in manifest[i]["outputs"]]
+        input_hashes: list[str] = [h for i in stage.inputs for h in manifest[i]["output_hashes"]]
+        source_hashes: list[str] = [file_hash(f) for f in stage.sources(state)]
+        key: str = stage_key(stage, params.get(stage.name, {}), source_hashes, input_hashes)
+        entry: dict = manifest.get(stage.name)
+        if not force and entry is not None and entry["key"] == key and all((consts.PROJ_ROOT / f).exists() for f in entry["outputs"]):
+            logger.info(f"{state}: {stage.name} is up to date")
+            continue
+        logger.info(f"{state}: running {stage.name}")
+        outputs: list[Path] = stage.run(state, params.get(stage.name, {}), input_files)
+        manifest[stage.name] = {"key": key,
+                                "params": params.get(stage.name, {}),
+                                "outputs": [str(f.relative_to(consts.PROJ_ROOT)) for f in outputs],
+                                "output_hashes": [file_hash(f) for f in outputs]}
+        save_manifest(state, manifest)
+    return manifest
+
+
+def run_pipeline(stages: list[Stage], params: dict[str, dict], targets: list[str], states: list[str], n_concurrent_states: int, force: bool = False) -> dict[str, dict]:
+    """
+    Runs the target stages and their upstream stages for every state, running
+    up to n_concurrent_states states at the same time. Stages that spawn worker
+    pools do so from their state's thread, with utils.worker_context, so the
+    other states' threads are never forked into them. A failing state doesn't stop the
+    others; the first failure is raised once every state has finished. Returns
+    each state's manifest.
+    """
+
+    stages = upstream_stages(stages, targets)
+    logger.info(f"running stages {[s.name for s in stages]} on states {states}")
+    manifests: dict[str, dict] = {}
+    failures: dict[str, Exception] = {}
+    with ThreadPoolExecutor(max_workers=n_concurrent_states) as executor:
+        futures = {state: executor.submit(run_state_pipeline, stages, params, state, force) for state in states}
+        for state, future in futures.items():
+            try:
+                manifests[state] = future.result()
+            except Exception as e:
+                logger.error(f"{state}: pipeline failed: {e!r}")
+                failures[state] = e
+    if failures:
+        raise Exception(f"pipeline failed for states {list(failures.keys())}") from next(iter(failures.values()))
+    return manifests
@@ -0,0 +1,96 @@
+from __future__ import annotations
+from ..custom_types import Ensemble, RepsPerDistrict
+from .ensemble_view import EnsembleView, MapRecord, map_records
+import numpy as np
+import hashlib
+import logging
+logger = logging.getLogger(__name__)
+
+"""
+This module contains canonical hashing of districting plans, used to find
+repeated maps in an ensemble. Two maps are the same plan if they split the
+precincts into the same districts with the same number of representatives each,
+no matter how the districts are numbered; a relabeling can only swap districts
+with equal reps, since the reps are part of the plan. The canonical form numbers
+the districts in order of their first precinct, so it can be computed over an
+assignment array in a few vectorized passes.
+"""
+
+
+HASH_DIGEST_SIZE: int = 16
+
+
+def canonical_plan(assignment: np.ndarray, district_reps: RepsPerDistrict) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Relabels the districts of a plan in order of first occurrence in the
+    assignment array.
+
+    Arguments:
+        assignment: district ID of each precinct, indexed by precinct ID
+        district_reps: number of representatives of each district
+    Returns:
+        the relabeled assignment array, and the reps of each relabeled district
+    """
+
+    districtIDs, first_precincts, canonical_assignment = np.unique(assignment, return_index=True, return_inverse=True)
+    order = np.argsort(first_precincts)
+    relabel = np.empty(len(districtIDs), dtype=np.int32)
+    relabel[order] = np.arange(len(districtIDs), dtype=np.int32)
+    reps = np.array([district_reps[int(districtIDs[i])] for i in order], dtype=np.int32)
+    return relabel[canonical_assignment], reps
+
+
+def plan_hash(record: MapRecord) -> str:
+    """Hash of a map's canonical plan, equal for maps that only differ in district labels."""
+
+    canonical_assignment, reps = canonical_plan(record.assignment, record.district_reps)
+    h = hashlib.blake2b(digest_size=HASH_DIGEST_SIZE)
+    h.update(reps.tobytes())
+    h.update(canonical_assignment.tobytes())
+    return h.hexdigest()
+
+
+class PlanIndex:
+    """
+    Index of the distinct plans of an ensemble.
+
+    Fields:
+        first_map: index of the first map of each distinct plan, by plan hash
+        duplicate_of: for each map, the index of the first map with the same
+        plan (its own index if it is the first)
+    """
+
+    first_map: dict[str, int]
+    duplicate_of: list[int]
+
+    def __init__(self) -> None:
+        self.first_map = {}
+        self.duplicate_of = []
+
+    def add(self, record: MapRecord) -> int:
+        """Adds the next map of the ensemble and returns the index of the first map with its plan."""
+
+        map_idx: int = len(self.duplicate_of)
+        first: int = self.first_map.setdefault(plan_hash(record), map_idx)
+        self.duplicate_of.append(first)
+        return first
+
+    def is_duplicate(self, map_idx: int) -> bool:
+        return self.duplicate_of[map_idx] != map_idx
+
+    def stats(self) -> dict:
+        n_maps: int = len(self.duplicate_of)
+        multiplicities: np.ndarray = np.bincount(self.duplicate_of, minlength=n_maps) if n_maps > 0 else np.zeros(0, dtype=int)
+        return {"n_maps": n_maps,
+                "n_unique": len(self.first_map),
+                "duplicate_fraction": 1 - len(self.first_map)/n_maps if n_maps > 0 else 0,
+                "max_multiplicity": int(multiplicities.max()) if n_maps > 0 else 0}
+
+
+def ensemble_plan_index(ensemble: Ensemble | EnsembleView) -> PlanIndex:
+    index = PlanIndex()
+    for record in map_records(ensemble):
+        index.add(record)
+    stats: dict = index.stats()
+    logger.info(f"{stats['n_unique']} distinct plans among {stats['n_maps']} maps")
+    return index
@@ -1,19 +1,28 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from functools import cache
 from matplotlib.pyplot import hist
-from geopandas import GeoSeries
+from matplotlib.colors import ListedColormap
 from gerrychain import Partition 
 import matplotlib.pyplot as plt
 from ..custom_types import ElectionsResults
-from .election import Candidate, Party
-from pptx import Presentation
+from .election import Candidate, Party, ensemble_vote_seat_table
 from ..custom_types import Ensemble
+from .ensemble_view import EnsembleView
 from .utils import is_path_in_proj
+from .geometry_cache import load_geometry_store
 import logging 
 logger = logging.getLogger(__name__)
 import consts
 from pathlib import Path
+import numpy as np
+if TYPE_CHECKING: # only needed for type hints; pptx is slow to import
+    from pptx import Presentation
 
 
-prs = Presentation() 
+@cache
+def distinct_colormap() -> ListedColormap:
+    return ListedColormap(consts.DISTINCT_COLORS)
 
 
 def add_plot_to_pres(prs) -> None:
@@ -25,8 +34,8 @@ def add_plot_to_pres(prs) -> None:
 
 def plot_partition(partition: Partition, prs: Presentation=None, show: bool = False) -> None:
     logger.info(f"plotting {partition}")
-    partition.plot(cmap=consts.DISTINCT_COLORS)
-    centroids: dict[int, tuple] = get_district_centroids(partition, partition.graph.geometry)
+    partition.plot(cmap=distinct_colormap())
+    centroids: dict[int, tuple] = load_geometry_store(partition.state).district_centroids(partition)
     for districtID, coord in centroids.items():
         pop_frac = float(partition[consts.POP_UPDATER][districtID]/sum(partition[consts.POP_UPDATER].values())) * sum(partition.district_reps.values())
         plt.text(coord[0], coord[1], "District %d\nPopulation: %d\nPop Frac: %3f/18\nnum reps: %d" % (districtID, partition[consts.POP_UPDATER][districtID], pop_frac, partition.district_reps[districtID]))
@@ -41,14 +50,6 @@ def plot_ensemble(ensemble: Ensemble, prs: Presentation=None, show: bool = False
         plot_partition(map, prs=prs, show=show)
 
 
-def get_district_centroids(partition: Partition, precinct_geometries: GeoSeries) -> dict[int, tuple]:
-    district_centroids = {}
-    for part, nodes in partition.parts.items():
-        part_geometries = precinct_geometries.loc[precinct_geometries.index[list(nodes)]]
-        district_centroids[part] = tuple(part_geometries.unary_union.centroid.coords)[0]
-    return district_centroids
-
-
 def plot_party_split(elections_results: ElectionsResults, n_districts: int, file: Path): 
     dem_counts: list[int] = []
     for election_result in elections_results.results:
@@ -66,8 +67,32 @@ def plot_party_split(elections_results: ElectionsResults, n_districts: int, file
     plt.savefig(file)
 
 
-def vote_seat_share_curve():
-    pass
+def vote_seat_share_curve(ensemble: Ensemble | EnsembleView, file: Path, swings: np.ndarray = np.linspace(-0.15, 0.15, 31)) -> dict:
+    """
+    Plots the democrat seat share against the statewide democrat vote share
+    over a grid of uniform swings, with the ensemble median and quantile bands
+    from ensemble_vote_seat_table. Returns the table that was plotted.
+    """
+
+    table: dict = ensemble_vote_seat_table(ensemble, swings)
+    vote_shares = table["vote_shares"]
+    seat_shares = table["seat_quantiles"]/table["n_seats"]
+    n_bands = len(table["quantiles"])//2
+    for i in range(n_bands):
+        plt.fill_between(vote_shares, seat_shares[i], seat_shares[-i-1], color="tab:blue", alpha=0.2, 
+                         label=f"{table['quantiles'][i]:.0%}-{table['quantiles'][-i-1]:.0%} of ensemble")
+    plt.plot(vote_shares, np.median(table["seats"], axis=0)/table["n_seats"], color="tab:blue", label="ensemble median")
+    plt.plot([0, 1], [0, 1], linestyle="--", color="gray", label="proportionality")
+    plt.xlim(vote_shares.min(), vote_shares.max())
+    plt.xlabel("democrat vote share")
+    plt.ylabel("democrat seat share")
+    plt.legend()
+    if not is_path_in_proj(file):
+        raise Exception("attempting to write in file outside of project directory")
+    logger.info(f"saving plot to {file}")
+    file.parent.mkdir(exist_ok=True, parents=True)
+    plt.savefig(file)
+    return table
 
 
 def box_and_whisker_plot():
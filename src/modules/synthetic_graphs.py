@@ -0,0 +1,182 @@
+from __future__ import annotations
+from pathlib import Path
+from gerrychain import Graph
+from scipy.spatial import Delaunay
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from .utils import is_path_in_proj
+import numpy as np
+import run_config
+import consts
+import logging
+logger = logging.getLogger(__name__)
+
+"""
+This module contains a generator of synthetic state graphs of any size, for
+measuring how chains, seed generation and elections scale with the number of
+precincts. A synthetic state is written to consts.STATE_GRAPH_FILEPATH like a
+real one, so every stage runs on it unchanged (except those that need
+geometries, which synthetic states don't have).
+
+Precincts are points in the unit square, connected either as a square grid or
+as the Delaunay triangulation of uniformly random points (planar, with degrees
+like real precinct graphs). Populations are lognormal, with pop_skew as the
+standard deviation of their log (0 for equal populations). The democrat vote
+share of each precinct mixes a smooth random field (a sum of gaussian bumps)
+with independent noise; partisan_clustering is the fraction of its variance
+that comes from the smooth field, from 0 (no geography to partisanship) to 1
+(large one-party regions). The seed districts in DISTRICTNO are made by
+recursively bisecting the square by population along its longer side, and
+precincts get area and perimeter attributes (exact for grids, approximated
+from the point density for triangulations) for the compactness constraints.
+"""
+
+
+GRAPH_TYPES: tuple[str] = ("grid", "delaunay")
+VOTE_TURNOUT: float = 0.45 # votes per person
+PARTISAN_FIELD_BUMPS: int = 12
+PARTISAN_FIELD_SCALE: float = 0.15 # width of the bumps, as a fraction of the square's side
+
+
+def grid_graph(n_precincts: int) -> tuple[Graph, np.ndarray, np.ndarray]:
+    """
+    Square grid of about n_precincts precincts, with the exact areas and
+    perimeters of its cells. Also returns the coordinates of the cell centers
+    and the (edges, 2) array of the edges.
+    """
+
+    side: int = max(2, int(round(np.sqrt(n_precincts))))
+    cell: float = 1/side
+    ids = np.arange(side*side).reshape(side, side)
+    edges = np.concatenate([np.column_stack([ids[:-1, :].ravel(), ids[1:, :].ravel()]), np.column_stack([ids[:, :-1].ravel(), ids[:, 1:].ravel()])])
+    coords = (np.column_stack([ids.ravel() // side, ids.ravel() % side]) + 0.5)*cell
+    degrees = np.bincount(edges.ravel(), minlength=side*side)
+    graph = Graph()
+    graph.add_nodes_from((int(node), {"area": cell**2, "boundary_node": bool(degrees[node] < 4), "boundary_perim": float((4 - degrees[node])*cell)}) for node in range(side*side))
+    graph.add_edges_from(edges.tolist(), shared_perim=cell)
+    return graph, coords, edges
+
+
+def delaunay_graph(n_precincts: int, rng: np.random.Generator) -> tuple[Graph, np.ndarray, np.ndarray]:
+    """
+    Delaunay triangulation of n_precincts uniform random points, with areas
+    and perimeters approximated from the point density. Also returns the
+    points and the (edges, 2) array of the edges.
+    """
+
+    coords = rng.random((n_precincts, 2))
+    triangulation = Delaunay(coords)
+    triangles = triangulation.simplices
+    edges = np.unique(np.sort(np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [0, 2]]]), axis=1), axis=0)
+    shared_perims = np.linalg.norm(coords[edges[:, 0]] - coords[edges[:, 1]], axis=1)/np.sqrt(3) # Voronoi edge of an equilateral triangulation
+    spacing: float = 1/np.sqrt(n_precincts)
+    hull = set(np.unique(triangulation.convex_hull).tolist())
+    graph = Graph()
+    graph.add_nodes_from((node, {"area": spacing**2, "boundary_node": node in hull, "boundary_perim": spacing if node in hull else 0.0}) for node in range(n_precincts))
+    graph.add_edges_from((u, v, {"shared_perim": perim}) for (u, v), perim in zip(edges.tolist(), shared_perims.tolist()))
+    return graph, coords, edges
+
+
+def partisan_field(coords: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Smooth random field over the precincts, standardized to mean 0 and variance 1."""
+
+    centers = rng.random((PARTISAN_FIELD_BUMPS, 2))
+    heights = rng.normal(size=PARTISAN_FIELD_BUMPS)
+    field = np.zeros(len(coords))
+    for center, height in zip(centers, heights):
+        field += height*np.exp(-((coords - center)**2).sum(axis=1)/(2*PARTISAN_FIELD_SCALE**2))
+    return (field - field.mean())/field.std()
+
+
+def bisect_districts(coords: np.ndarray, pops: np.ndarray, n_districts: int) -> np.ndarray:
+    """Districts numbered from 1 by recursive bisection: each region is cut across its longer side where the population reaches the share of its districts."""
+
+    assignment = np.zeros(len(coords), dtype=np.int64)
+    regions: list[tuple[np.ndarray, int, int]] = [(np.arange(len(coords)), 1, n_districts)]
+    while regions:
+        precincts, first_districtID, n = regions.pop()
+        if n == 1:
+            assignment[precincts] = first_districtID
+            continue
+        axis: int = int(np.argmax(np.ptp(coords[precincts], axis=0)))
+        order = precincts[np.lexsort((coords[precincts, 1-axis], coords[precincts, axis]))]
+        cumulative = np.cumsum(pops[order])
+        cut: int = int(np.clip(np.searchsorted(cumulative, cumulative[-1]*(n//2)/n) + 1, 1, len(order) - 1))
+        regions.append((order[:cut], first_districtID, n//2))
+        regions.append((order[cut:], first_districtID + n//2, n - n//2))
+    return assignment
+
+
+def make_contiguous(edges: np.ndarray, assignment: np.ndarray, max_rounds: int = 1000) -> np.ndarray:
+    """
+    Makes every district contiguous by moving the precincts outside of its
+    largest piece, a layer at a time, to the adjacent districts' largest pieces.
+    """
+
+    n: int = len(assignment)
+    for _ in range(max_rounds):
+        inner_edges = edges[assignment[edges[:, 0]] == assignment[edges[:, 1]]]
+        _, labels = connected_components(coo_matrix((np.ones(len(inner_edges)), (inner_edges[:, 0], inner_edges[:, 1])), shape=(n, n)), directed=False)
+        sizes = np.bincount(labels)
+        order = np.lexsort((-sizes[labels], assignment))
+        first_of_district = order[np.r_[True, assignment[order][1:] != assignment[order][:-1]]]
+        main = np.isin(labels, labels[first_of_district])
+        if main.all():
+            return assignment
+        for u, v in ((edges[:, 0], edges[:, 1]), (edges[:, 1], edges[:, 0])):
+            stray = ~main[u] & main[v] & (assignment[u] != assignment[v])
+            assignment[u[stray]] = assignment[v[stray]]
+    raise Exception("could not make seed districts contiguous")
+
+
+def gen_synthetic_graph(graph_type: str, n_precincts: int, n_districts: int, pop_skew: float = 0.5, partisan_clustering: float = 0.5,
+                        dem_share: float = 0.5, seed: int = 0) -> Graph:
+    """
+    Generates a synthetic state graph.
+
+    Arguments:
+        graph_type: "grid" (rounded to a square number of precincts) or "delaunay"
+        n_precincts: number of precincts
+        n_districts: number of seed districts in DISTRICTNO
+        pop_skew: standard deviation of the log of the precinct populations
+        partisan_clustering: fraction (from 0 to 1) of the variance of the
+        democrat vote share's log-odds that is spatially smooth
+        dem_share: democrat vote share of a typical precinct
+        seed: random seed
+    Returns:
+        graph with TOTAL, DISTRICTNO, the run_config democrat and republican
+        vote columns, x and y, and the compactness attributes
+    """
+
+    if graph_type not in GRAPH_TYPES:
+        raise Exception(f"unknown synthetic graph type {graph_type}; expected one of {GRAPH_TYPES}")
+    rng = np.random.default_rng(seed)
+    graph, coords, edges = grid_graph(n_precincts) if graph_type == "grid" else delaunay_graph(n_precincts, rng)
+    n: int = len(coords)
+    pops = np.maximum(1, np.round(1000*rng.lognormal(0, pop_skew, n)))
+    log_odds = np.log(dem_share/(1 - dem_share)) + np.sqrt(partisan_clustering)*partisan_field(coords, rng) + np.sqrt(1 - partisan_clustering)*rng.normal(size=n)
+    votes = np.round(VOTE_TURNOUT*pops)
+    dem_votes = np.round(votes/(1 + np.exp(-log_odds)))
+    assignment = make_contiguous(edges, bisect_districts(coords, pops, n_districts))
+    for node in range(n):
+        graph.nodes[node].update({consts.POP_COL: float(pops[node]),
+                                  consts.DISTRICT_NO_COL: int(assignment[node]),
+                                  run_config.DEM_VOTE_TALLY_COL: int(dem_votes[node]),
+                                  run_config.REP_VOTE_TALLY_COL: int(votes[node] - dem_votes[node]),
+                                  "x": float(coords[node, 0]),
+                                  "y": float(coords[node, 1])})
+    logger.info(f"generated {graph_type} graph of {n} precincts and {graph.number_of_edges()} edges with {n_districts} districts")
+    return graph
+
+
+def gen_synthetic_state(state: str, *args, **kwargs) -> Path:
+    """Generates a synthetic state graph (see gen_synthetic_graph) and saves it as the graph of state. Returns the graph file."""
+
+    file: Path = consts.STATE_GRAPH_FILEPATH(state)
+    if not is_path_in_proj(file):
+        raise Exception("attempting to write in file outside of project directory")
+    graph: Graph = gen_synthetic_graph(*args, **kwargs)
+    file.parent.mkdir(parents=True, exist_ok=True)
+    logger.info(f"saving synthetic state graph to {file}")
+    graph.to_json(file)
+    return file
@@ -0,0 +1,162 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Iterator
+from gerrychain import Graph
+from ..custom_types import VMDPartition, RepsPerDistrict
+from .ensemble_view import MapRecord
+from .artifact_io import BackgroundWriter, read_artifact, write_artifact
+from .utils import is_path_in_proj, load_state_graph
+import numpy as np
+import json
+import logging
+logger = logging.getLogger(__name__)
+
+"""
+This module contains a compact format for whole ReCom chain trajectories. Each
+step of a chain only redraws the two districts vmd_recom merged, and usually
+moves only part of their precincts, so a trajectory is stored as the assignment
+of the first map plus, for every step, the precincts that changed district and
+their new districts. A full assignment (keyframe) is also kept every
+keyframe_interval steps, so any step can be recovered by replaying at most
+keyframe_interval steps of flips. Replaying from the start yields VMDPartitions
+through Partition.flip(), so the updaters stay incremental.
+"""
+
+
+def encode_flips(precIDs: np.ndarray, districtIDs: np.ndarray) -> list[list]:
+    """
+    Encodes the flips of one step for saving as a list of [district ID,
+    precinct ID gaps] pairs, one per district that gained precincts. The
+    precinct IDs of each district are sorted and stored as the differences
+    between consecutive IDs, which are small numbers that compress well.
+    """
+
+    encoded: list[list] = []
+    for districtID in np.unique(districtIDs):
+        district_precIDs = np.sort(precIDs[districtIDs == districtID])
+        encoded.append([int(districtID), np.diff(district_precIDs, prepend=0).tolist()])
+    return encoded
+
+
+def decode_flips(encoded: list[list]) -> tuple[np.ndarray, np.ndarray]:
+    precIDs: list[np.ndarray] = [np.cumsum(np.array(gaps, dtype=np.int64)) for _, gaps in encoded]
+    districtIDs: list[np.ndarray] = [np.full(len(gaps), districtID, dtype=np.int64) for districtID, gaps in encoded]
+    return (np.concatenate(precIDs), np.concatenate(districtIDs)) if encoded else (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+
+class Trajectory:
+    """
+    Delta-encoded trajectory of one chain.
+
+    Fields:
+        state: state the chain runs on
+        district_reps: number of representatives of each district
+        keyframe_interval: number of steps between stored full assignments
+        keyframes: full assignment arrays by step; step 0 is the initial map
+        flips: flips[i] holds the (precinct IDs, new district IDs) that turn
+        step i into step i+1
+    """
+
+    state: str
+    district_reps: RepsPerDistrict
+    keyframe_interval: int
+    keyframes: dict[int, np.ndarray]
+    flips: list[tuple[np.ndarray, np.ndarray]]
+
+    def __init__(self, state: str, district_reps: RepsPerDistrict, base_assignment: np.ndarray, keyframe_interval: int = 100) -> None:
+        self.state = state
+        self.district_reps = district_reps
+        self.keyframe_interval = keyframe_interval
+        self.keyframes = {0: base_assignment.copy()}
+        self.flips = []
+        self._current = base_assignment.copy()
+        self._last_partition = None
+
+    @staticmethod
+    def from_partition(partition: VMDPartition, keyframe_interval: int = 100) -> Trajectory:
+        """Starts a trajectory at the initial state of a chain."""
+
+        trajectory = Trajectory(partition.state, partition.district_reps, MapRecord.from_partition(partition).assignment, keyframe_interval)
+        trajectory._last_partition = partition
+        return trajectory
+
+    def __len__(self) -> int:
+        """Number of maps in the trajectory, including the initial one."""
+
+        return len(self.flips) + 1
+
+    def append(self, partition: VMDPartition) -> None:
+        """
+        Records the next state of the chain. Only the precincts whose district
+        differs from the previous step are stored; a state that repeats the
+        previous one (a rejected proposal) is stored as an empty step.
+        """
+
+        if partition is self._last_partition or not partition.flips:
+            changed: list[tuple[int, int]] = []
+        else:
+            changed = [(p, d) for p, d in partition.flips.items() if self._current[p] != d]
+        precIDs = np.array([p for p, _ in changed], dtype=np.int64)
+        districtIDs = np.array([d for _, d in changed], dtype=np.int64)
+        self._current[precIDs] = districtIDs
+        self.flips.append((precIDs, districtIDs))
+        self._last_partition = partition
+        if len(self.flips) % self.keyframe_interval == 0:
+            self.keyframes[len(self.flips)] = self._current.copy()
+
+    def assignment_at(self, step: int) -> np.ndarray:
+        """Recovers the assignment array of a step from the closest keyframe before it."""
+
+        if not 0 <= step < len(self):
+            raise Exception(f"step {step} is outside of trajectory with {len(self)} maps")
+        keyframe: int = max(k for k in self.keyframes if k <= step)
+        assignment: np.ndarray = self.keyframes[keyframe].copy()
+        for precIDs, districtIDs in self.flips[keyframe:step]:
+            assignment[precIDs] = districtIDs
+        return assignment
+
+    def record_at(self, step: int) -> MapRecord:
+        return MapRecord(self.assignment_at(step), self.district_reps, self.state)
+
+    def replay(self, graph: Graph = None, start: int = 0) -> Iterator[VMDPartition]:
+        """Yields the VMDPartition of every step from start on, applying each step's flips to the previous partition."""
+
+        partition: VMDPartition = self.record_at(start).to_partition(graph if graph is not None else load_state_graph(self.state))
+        yield partition
+        for precIDs, districtIDs in self.flips[start:]:
+            if len(precIDs) > 0:
+                partition = partition.flip(dict(zip(precIDs.tolist(), districtIDs.tolist())))
+            yield partition
+
+    def to_json_dict(self) -> dict:
+        return {"state": self.state,
+                "district_reps": self.district_reps,
+                "keyframe_interval": self.keyframe_interval,
+                "keyframes": {step: assignment.tolist() for step, assignment in self.keyframes.items()},
+                "flips": [encode_flips(precIDs, districtIDs) for precIDs, districtIDs in self.flips]}
+
+    @staticmethod
+    def from_json_dict(json_dict: dict) -> Trajectory:
+        keyframes: dict[int, np.ndarray] = {int(step): np.array(assignment, dtype=np.int64) for step, assignment in json_dict["keyframes"].items()}
+        trajectory = Trajectory(json_dict["state"], {int(k): v for k, v in json_dict["district_reps"].items()}, keyframes[0], json_dict["keyframe_interval"])
+        trajectory.keyframes = keyframes
+        trajectory.flips = [decode_flips(step_flips) for step_flips in json_dict["flips"]]
+        trajectory._current = trajectory.assignment_at(len(trajectory)-1)
+        return trajectory
+
+    @staticmethod
+    def from_file(file: Path) -> Trajectory:
+        logger.info(f"loading Trajectory from {file}")
+        return Trajectory.from_json_dict(json.loads(read_artifact(file)))
+
+    def to_file(self, file: Path, writer: BackgroundWriter = None) -> None:
+        """Saves the trajectory, compressed according to the file extension, optionally through a BackgroundWriter."""
+
+        if not is_path_in_proj(file):
+            raise Exception("attempting to write in file outside of project directory")
+        logger.info(f"saving Trajectory with {len(self)} maps to {file}")
+        json_dict: dict = self.to_json_dict()
+        if writer is not None:
+            writer.submit(file, lambda: json.dumps(json_dict))
+        else:
+            write_artifact(file, json.dumps(json_dict))
@@ -3,6 +3,9 @@ import random
 import networkx as nx
 import decimal
 from pathlib import Path
+from functools import cache
+from gerrychain import Graph
+import multiprocessing
 import consts
 
 
@@ -43,5 +46,46 @@ def round_down(x: float, place: int=0):
         return float(round(d, place))
 
 
+FIXED_POINT_PLACES: int = 4
+FIXED_POINT_SCALE: int = 10**FIXED_POINT_PLACES
+
+
+def fixed_point_div_up(numerator: int, denominator: int) -> int:
+    """Integer division rounding up. With a numerator scaled by FIXED_POINT_SCALE, gives the same result as round_up(numerator/denominator, FIXED_POINT_PLACES) without going through floats or decimals."""
+
+    return -(-numerator // denominator)
+
+
+def fixed_point_scale_down(x: int, numerator: int, denominator: int) -> int:
+    """Multiplies fixed-point x by numerator/denominator and truncates, matching round_down(x*numerator/denominator, FIXED_POINT_PLACES) on the unscaled values with plain integer arithmetic."""
+
+    return x*numerator // denominator
+
+
 def is_path_in_proj(path: Path):
-    return consts.PROJ_ROOT in path.parents
\ No newline at end of file
+    return consts.PROJ_ROOT in path.parents
+
+
+def worker_context():
+    """
+    Multiprocessing context for worker pools. Pools are created while other
+    threads are running (concurrent states in the pipeline, BackgroundWriter,
+    the job queue heartbeat), and forking then can copy locks (logging, gzip,
+    sqlite) in a held state into the workers, which deadlock on them. Workers
+    are started from a forkserver instead, or spawned where it is unavailable.
+    Such workers all start with the random state gerrychain seeds on import,
+    so tasks that draw random numbers must be given their own seeds.
+    """
+
+    return multiprocessing.get_context("forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+
+@cache
+def load_state_graph(state: str) -> Graph:
+    """
+    Loads a state graph once per process. Partitions never modify their graph,
+    so every map of a state shares the same one, and long-lived worker
+    processes that run jobs for several states load each graph only once.
+    """
+
+    return Graph.from_json(consts.STATE_GRAPH_FILEPATH(state))
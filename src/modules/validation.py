@@ -0,0 +1,136 @@
+from __future__ import annotations
+from pathlib import Path
+from gerrychain import Graph
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from .ensemble_view import EnsembleView, MapRecord
+from .utils import load_state_graph, worker_context
+import numpy as np
+import itertools
+import consts
+import logging
+logger = logging.getLogger(__name__)
+
+"""
+This module contains a bulk validator for saved ensembles. Chains retry failed
+maps and ensembles can be edited or merged by hand, so nothing else checks that
+the stored maps are valid districting plans. A map is valid if its assignment
+covers every precinct of the state graph, its districts are exactly those of
+its district_reps, every district is contiguous, and every district's
+population is within epsilon of the ideal population times its number of
+representatives.
+
+All checks are array operations over the whole map instead of graph searches:
+the precinct populations are summed per district with one bincount, and
+contiguity is checked by keeping only the edges inside districts and counting
+the connected components of that sparse graph, which must be one per
+district. Maps are streamed from the file through an EnsembleView and checked
+in parallel.
+"""
+
+
+VALIDATION_CHUNK_SIZE: int = 64
+
+
+class MapValidator:
+    """
+    Validity checks of maps on one state graph.
+
+    Fields:
+        n_precincts: number of precincts of the graph
+        edges: (edges, 2) array of the graph's edges
+        pops: population of each precinct
+    """
+
+    n_precincts: int
+    edges: np.ndarray
+    pops: np.ndarray
+
+    def __init__(self, graph: Graph, pop_col: str = consts.POP_COL) -> None:
+        self.n_precincts = len(graph.nodes)
+        self.edges = np.array(list(graph.edges), dtype=np.int64).reshape(-1, 2)
+        self.pops = np.array([graph.nodes[p][pop_col] for p in range(self.n_precincts)], dtype=float)
+
+    def problems(self, record: MapRecord, epsilon: float) -> list[str]:
+        """Returns what is wrong with a map, or an empty list if it is valid."""
+
+        assignment: np.ndarray = record.assignment
+        n_assigned: int = np.count_nonzero(assignment >= 0)
+        if len(assignment) != self.n_precincts or n_assigned != self.n_precincts:
+            return [f"assignment covers {n_assigned} of {self.n_precincts} precincts"]
+        districtIDs = np.array(sorted(record.district_reps.keys()))
+        district_idx = np.searchsorted(districtIDs, assignment)
+        unknown = (district_idx == len(districtIDs)) | (districtIDs[np.minimum(district_idx, len(districtIDs)-1)] != assignment)
+        if unknown.any():
+            return [f"precincts assigned to districts without reps: {sorted(set(assignment[unknown].tolist()))}"]
+
+        problems: list[str] = []
+        sizes = np.bincount(district_idx, minlength=len(districtIDs))
+        if (sizes == 0).any():
+            problems.append(f"empty districts: {districtIDs[sizes == 0].tolist()}")
+
+        reps = np.array([record.district_reps[d] for d in districtIDs.tolist()], dtype=float)
+        targets = self.pops.sum()/reps.sum()*reps
+        deviations = np.bincount(district_idx, weights=self.pops, minlength=len(districtIDs))/targets - 1
+        unbalanced = np.abs(deviations) > epsilon
+        if unbalanced.any():
+            problems.append(f"districts outside of population balance {epsilon}: "
+                            f"{dict(zip(districtIDs[unbalanced].tolist(), np.round(deviations[unbalanced], 4).tolist()))}")
+
+        inside = assignment[self.edges[:, 0]] == assignment[self.edges[:, 1]]
+        inner_edges = self.edges[inside]
+        adjacency = coo_matrix((np.ones(len(inner_edges)), (inner_edges[:, 0], inner_edges[:, 1])), shape=(self.n_precincts, self.n_precincts))
+        n_components, labels = connected_components(adjacency, directed=False)
+        if n_components != np.count_nonzero(sizes):
+            components_per_district = np.bincount(np.unique(np.stack([district_idx, labels]), axis=1)[0], minlength=len(districtIDs))
+            problems.append(f"noncontiguous districts: {dict(zip(districtIDs[components_per_district > 1].tolist(), components_per_district[components_per_district > 1].tolist()))}")
+        return problems
+
+
+_worker_validator: MapValidator = None
+
+
+def _init_validation_worker(state: str) -> None:
+    global _worker_validator
+    _worker_validator = MapValidator(load_state_graph(state))
+
+
+def _validate_maps_task(task: tuple) -> tuple[int, list[tuple[int, list[str]]]]:
+    epsilon, chunk = task
+    return len(chunk), [(map_idx, problems) for map_idx, record in chunk if (problems := _worker_validator.problems(record, epsilon))]
+
+
+def validate_ensemble_file(file: Path, n_workers: int, epsilon: float = None) -> dict:
+    """
+    Audits every map of a saved ensemble.
+
+    Arguments:
+        file: ensemble file
+        n_workers: number of worker processes
+        epsilon: population balance to check; by default the ensemble's
+        epsilon, loosened to the super-node population cap for coarsened
+        ensembles that weren't refined
+    Returns:
+        dict with the number of maps, the number of invalid ones, and the
+        problems of each invalid map by map index
+    """
+
+    view = EnsembleView(file)
+    if epsilon is None:
+        coarsening: dict = view.metadata.get("coarsening") if view.metadata else None
+        epsilon = view.epsilon if coarsening is None or coarsening["refine"] else max(view.epsilon, coarsening["max_pop_fraction"])
+    records = iter(view)
+    first: MapRecord = next(records, None)
+    if first is None:
+        return {"file": str(file), "epsilon": epsilon, "n_maps": 0, "n_invalid": 0, "invalid": {}}
+    maps = enumerate(itertools.chain([first], records))
+    chunks = iter(lambda: list(itertools.islice(maps, VALIDATION_CHUNK_SIZE)), [])
+
+    n_maps: int = 0
+    invalid: dict[int, list[str]] = {}
+    with worker_context().Pool(n_workers, initializer=_init_validation_worker, initargs=(first.state,)) as p:
+        for n_checked, results in p.imap_unordered(_validate_maps_task, ((epsilon, chunk) for chunk in chunks)):
+            n_maps += n_checked
+            invalid.update(results)
+    logger.info(f"{len(invalid)} of {n_maps} maps of {file} are invalid")
+    return {"file": str(file), "epsilon": epsilon, "n_maps": n_maps, "n_invalid": len(invalid), "invalid": dict(sorted(invalid.items()))}
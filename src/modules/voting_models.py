@@ -1,4 +1,8 @@
+from __future__ import annotations
+from abc import ABC, abstractmethod
 import random
+import itertools
+import numpy as np
 import run_config
 from ..custom_types import Party, Ballot, Candidate, Precinct, Voter, VotingComparator
 from linetimer import CodeTimer, linetimer
@@ -14,10 +18,116 @@ def curried_voting_comparator():
     pass
 
 
-def party_line_voting_comparator(x: Candidate, y: Candidate, voter: Voter):
+def party_line_voting_comparator(x: Candidate, y: Candidate, voter: Voter, rng: random.Random = None):
     if x.party == voter.party and y.party != voter.party:
-        return 1
-    elif x.party != voter.party and y.party == voter.party:
         return -1
+    elif x.party != voter.party and y.party == voter.party:
+        return 1
     elif x.party == y.party:
-        return random.choice([-1, 1])
+        return (rng if rng is not None else random).choice([-1, 1])
+
+
+class RankingClass:
+    """
+    A set of candidate rankings that a precinct voting model assigns one
+    probability to. The class is an ordered list of candidate groups: every
+    ranking in the class lists the candidates of the first group, then those of
+    the second group, and so on, with the order inside each group uniformly
+    random. For example, a party-line democrat ranks [democrats, republicans].
+    """
+
+    groups: list[list[Candidate]]
+
+    def __init__(self, groups: list[list[Candidate]]) -> None:
+        self.groups = [g for g in groups if len(g) > 0]
+
+    def sample_rankings(self, n_voters: int, rng: np.random.Generator) -> list[tuple[tuple[Candidate], int]]:
+        """
+        Splits n_voters voters of this class among its rankings, with one
+        multinomial draw per group over that group's orderings. Returns the
+        (ranking, count) pairs with a nonzero count.
+        """
+
+        def split(group_idx: int, prefix: tuple, n: int) -> list[tuple[tuple[Candidate], int]]:
+            if group_idx == len(self.groups):
+                return [(prefix, n)]
+            orders: list[tuple[Candidate]] = list(itertools.permutations(self.groups[group_idx]))
+            counts = rng.multinomial(n, np.full(len(orders), 1/len(orders)))
+            return list(itertools.chain.from_iterable(split(group_idx+1, prefix + order, int(k)) for order, k in zip(orders, counts) if k > 0))
+
+        return split(0, (), n_voters) if n_voters > 0 else []
+
+
+class PrecinctVotingModel(ABC):
+    """
+    Base class of voting models that work on whole precincts instead of single
+    voters. A model gives the number of voters in each precinct and, from the
+    precinct attributes, a probability distribution over its ranking classes.
+    Ballots are then drawn with one multinomial draw per precinct (see
+    election.gen_precincts_ballot_groups), so a district election costs
+    precincts x ranking classes instead of voters. Models that need more
+    parties only need to return more ranking classes.
+
+    Instances are used wherever a VotingComparator can be; __name__ names the
+    model in the election results.
+    """
+
+    __name__: str
+
+    @abstractmethod
+    def ranking_classes(self, candidates: set[Candidate]) -> list[RankingClass]:
+        """Returns the ranking classes of an election between the given candidates."""
+
+    @abstractmethod
+    def voter_counts(self, precincts: list[Precinct]) -> np.ndarray:
+        """Returns the number of voters of each precinct."""
+
+    @abstractmethod
+    def class_probabilities(self, precincts: list[Precinct]) -> np.ndarray:
+        """Returns a (precincts, ranking classes) array whose rows sum to 1."""
+
+    def with_vote_cols(self, dem_col: str, rep_col: str) -> PrecinctVotingModel:
+        """Returns the model for the election with the given precinct vote columns; models that don't read vote columns return themselves."""
+
+        return self
+
+
+class PartyLinePrecinctModel(PrecinctVotingModel):
+    """
+    Precinct version of party line voting: every voter ranks all of their own
+    party's candidates first, in random order. A crossover fraction of each
+    party's voters instead ranks the other party's candidates first.
+    """
+
+    dem_col: str
+    rep_col: str
+    crossover: float
+
+    def __init__(self, dem_col: str = run_config.DEM_VOTE_TALLY_COL, rep_col: str = run_config.REP_VOTE_TALLY_COL, crossover: float = 0) -> None:
+        self.dem_col = dem_col
+        self.rep_col = rep_col
+        self.crossover = crossover
+        self.__name__ = "party_line_precinct_model" if crossover == 0 else f"party_line_precinct_model_{crossover}"
+
+    def ranking_classes(self, candidates: set[Candidate]) -> list[RankingClass]:
+        dems: list[Candidate] = [c for c in candidates if c.party == Party.DEMOCRAT]
+        reps: list[Candidate] = [c for c in candidates if c.party == Party.REPUBLICAN]
+        return [RankingClass([dems, reps]), RankingClass([reps, dems])]
+
+    def with_vote_cols(self, dem_col: str, rep_col: str) -> PartyLinePrecinctModel:
+        return PartyLinePrecinctModel(dem_col, rep_col, self.crossover)
+
+    def voter_counts(self, precincts: list[Precinct]) -> np.ndarray:
+        return np.array([int(p[self.dem_col]) + int(p[self.rep_col]) for p in precincts], dtype=np.int64)
+
+    def class_probabilities(self, precincts: list[Precinct]) -> np.ndarray:
+        dem_votes = np.array([int(p[self.dem_col]) for p in precincts], dtype=float)
+        rep_votes = np.array([int(p[self.rep_col]) for p in precincts], dtype=float)
+        total_votes = dem_votes + rep_votes
+        with np.errstate(divide="ignore", invalid="ignore"):
+            dem_shares = np.where(total_votes > 0, dem_votes/total_votes, 0.5)
+        dem_first = dem_shares*(1-self.crossover) + (1-dem_shares)*self.crossover
+        return np.stack([dem_first, 1-dem_first], axis=1)
+
+
+party_line_precinct_model: PartyLinePrecinctModel = PartyLinePrecinctModel()
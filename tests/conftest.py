@@ -0,0 +1,14 @@
+import pytest
+from src.custom_types import VMDPartition, vmd_updaters
+from src.modules.utils import load_state_graph
+import consts
+
+
+@pytest.fixture
+def hi_seed() -> VMDPartition:
+    """Hawaii's enacted congressional plan, from the DISTRICTNO column of its graph (the smallest state graph in the repo)."""
+
+    graph = load_state_graph("HI")
+    assignment: dict[int, int] = {p: graph.nodes[p][consts.DISTRICT_NO_COL] for p in graph.nodes}
+    return VMDPartition(graph=graph, assignment=assignment, state="HI", district_reps={d: 1 for d in set(assignment.values())},
+                        updaters=vmd_updaters(), use_default_updaters=False)
@@ -0,0 +1,54 @@
+import random
+import consts
+from src.custom_types import VMDPartition, vmd_updaters
+from src.modules.adjacency import AdjacencyState
+from src.modules.synthetic_graphs import gen_synthetic_graph
+
+
+def grid_partition() -> VMDPartition:
+    graph = gen_synthetic_graph("grid", 100, 5, seed=1)
+    assignment: dict[int, int] = {p: graph.nodes[p][consts.DISTRICT_NO_COL] for p in graph.nodes}
+    return VMDPartition(graph=graph, assignment=assignment, state="XX", district_reps={d: 1 for d in set(assignment.values())},
+                        updaters=vmd_updaters(), use_default_updaters=False)
+
+
+def random_child(partition: VMDPartition, rng: random.Random) -> VMDPartition:
+    """Flips a few random cut edge endpoints into the district across the edge."""
+
+    cut_edges = sorted(AdjacencyState(partition).cut_edges)
+    flips: dict[int, int] = {}
+    for u, v in rng.sample(cut_edges, min(3, len(cut_edges))):
+        flips[u] = partition.assignment[v]
+    return partition.flip(flips)
+
+
+def assert_matches_rebuild(partition: VMDPartition) -> None:
+    adjacency = partition[consts.DISTRICT_ADJACENCY_UPDATER]
+    rebuilt = AdjacencyState(partition)
+    assert sorted(adjacency.cut_edges()) == sorted(rebuilt.cut_edges)
+    assert adjacency.district_pairs() == dict(rebuilt.pair_counts)
+    assert adjacency.n_cut_edges() == len(rebuilt.cut_edges)
+
+
+def test_apply_and_revert_match_rebuild():
+    rng = random.Random(0)
+    partition = grid_partition()
+    assert_matches_rebuild(partition)
+    for _ in range(30):
+        child, sibling = random_child(partition, rng), random_child(partition, rng)
+        assert_matches_rebuild(child) # forward to a child
+        assert_matches_rebuild(sibling) # over to a sibling
+        assert_matches_rebuild(partition) # back from a child
+        grandchild = random_child(child, rng)
+        assert_matches_rebuild(grandchild) # a jump, which rebuilds
+        partition = rng.choice([child, sibling, grandchild])
+        assert_matches_rebuild(partition)
+
+
+def test_random_cut_edge_is_a_cut_edge():
+    rng = random.Random(1)
+    partition = random_child(grid_partition(), rng)
+    adjacency = partition[consts.DISTRICT_ADJACENCY_UPDATER]
+    for _ in range(100):
+        u, v = adjacency.random_cut_edge()
+        assert partition.assignment[u] != partition.assignment[v]
@@ -0,0 +1,27 @@
+import pytest
+from src.modules.artifact_io import BackgroundWriter, read_artifact, resolve_artifact, write_artifact
+
+
+def test_resolve_artifact_accepts_str_paths(tmp_path):
+    write_artifact(tmp_path / "map.json.gz", "{}")
+    assert resolve_artifact(str(tmp_path / "map.json")) == tmp_path / "map.json.gz"
+    assert read_artifact(str(tmp_path / "map.json")) == "{}"
+
+
+def test_writer_error_does_not_replace_propagating_exception(tmp_path):
+    def fail() -> str:
+        raise ValueError("serialization failed")
+
+    with pytest.raises(KeyError):
+        with BackgroundWriter() as writer:
+            writer.submit(tmp_path / "bad.json", fail)
+            raise KeyError("caller failed")
+
+
+def test_writer_error_is_raised_on_clean_exit(tmp_path):
+    def fail() -> str:
+        raise ValueError("serialization failed")
+
+    with pytest.raises(ValueError):
+        with BackgroundWriter() as writer:
+            writer.submit(tmp_path / "bad.json", fail)
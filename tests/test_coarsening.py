@@ -0,0 +1,20 @@
+import random
+import pytest
+from src.modules.coarsening import coarsen_graph
+from src.modules.constraints import polsby_popper
+
+
+def test_coarsening_is_reproducible(hi_seed):
+    random.seed(1)
+    first = coarsen_graph(hi_seed, 0.05)
+    random.seed(2)
+    second = coarsen_graph(hi_seed, 0.05)
+    assert first.members == second.members
+    assert len(first.members) < len(hi_seed.graph.nodes)
+
+
+def test_coarse_compactness_matches_precincts(hi_seed):
+    coarse_graph = coarsen_graph(hi_seed, 0.05)
+    coarse = coarse_graph.coarsen_partition(hi_seed)
+    for districtID in hi_seed.parts:
+        assert polsby_popper(coarse, districtID) == pytest.approx(polsby_popper(hi_seed, districtID))
@@ -0,0 +1,62 @@
+import random
+import networkx as nx
+import numpy as np
+import pytest
+from src.custom_types import Ballot, Candidate, Ensemble, VMDPartition, vmd_updaters
+from src.modules.election import (gen_candidates, multi_seat_ranked_choice_tabulation, multi_seat_ranked_choice_pile_tabulation,
+                                  multi_seat_ranked_choice_fixed_point_tabulation, verify_fixed_point_tabulation, run_precincts_election_replicates)
+from src.modules.voting_models import party_line_precinct_model, party_line_voting_comparator, PartyLinePrecinctModel
+
+
+def random_ballots(rng: random.Random, candidates: set[Candidate], full_rankings: bool) -> list[Ballot]:
+    """Random ranking groups with random counts; without full_rankings, ballots rank a random number of candidates and can be exhausted."""
+
+    ballots: list[Ballot] = []
+    for _ in range(rng.randint(1, 40)):
+        ranking: list[Candidate] = rng.sample(sorted(candidates, key=lambda c: c.name), len(candidates))
+        ballots.append(Ballot(ranking if full_rankings else ranking[:rng.randint(1, len(ranking))], rng.randint(1, 5000)))
+    return ballots
+
+
+def copy_ballots(ballots: list[Ballot]) -> list[Ballot]:
+    return [Ballot(b.choices, b.count) for b in ballots]
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_fixed_point_tabulation_matches_decimal_tabulation(seed):
+    rng = random.Random(seed)
+    n_reps: int = rng.randint(2, 5)
+    candidates: set[Candidate] = gen_candidates(n_reps, 1)
+    ballots: list[Ballot] = random_ballots(rng, candidates, full_rankings=seed % 2 == 0)
+    decimal_winners = multi_seat_ranked_choice_pile_tabulation(copy_ballots(ballots), candidates, n_reps)
+    fixed_point_winners = multi_seat_ranked_choice_fixed_point_tabulation(copy_ballots(ballots), candidates, n_reps)
+    assert set(fixed_point_winners) == set(decimal_winners)
+    assert len(fixed_point_winners) == n_reps
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_pile_tabulation_matches_reference_tabulation(seed):
+    rng = random.Random(seed)
+    n_reps: int = rng.randint(2, 5)
+    candidates: set[Candidate] = gen_candidates(n_reps, 1)
+    ballots: list[Ballot] = random_ballots(rng, candidates, full_rankings=True) # the reference tabulation doesn't handle exhausted ballots
+    assert set(multi_seat_ranked_choice_pile_tabulation(copy_ballots(ballots), candidates, n_reps)) == set(multi_seat_ranked_choice_tabulation(copy_ballots(ballots), candidates, n_reps))
+
+
+def test_verify_fixed_point_tabulation(hi_seed):
+    at_large = VMDPartition(graph=hi_seed.graph, assignment={p: 1 for p in hi_seed.graph.nodes}, state="HI", district_reps={1: 2},
+                            updaters=vmd_updaters(), use_default_updaters=False)
+    assert verify_fixed_point_tabulation(Ensemble([at_large], 0, 0, "test", []), party_line_precinct_model) == []
+
+
+@pytest.mark.parametrize("voting_model", [party_line_voting_comparator, PartyLinePrecinctModel(crossover=0.2)])
+def test_replicates_are_reproducible_and_leave_global_random_alone(voting_model):
+    graph = nx.Graph()
+    graph.add_nodes_from((p, {"2020_PRES_DEM": 40 + 7*p, "2020_PRES_REP": 60 - 3*p}) for p in range(4))
+    args = (graph, list(graph.nodes), 3, 1, voting_model, multi_seat_ranked_choice_pile_tabulation, ("2020_PRES_DEM", "2020_PRES_REP"), 20, 7, 0)
+    state = random.getstate()
+    expected: float = random.random()
+    random.setstate(state)
+    first: np.ndarray = run_precincts_election_replicates(*args)
+    assert random.random() == expected
+    assert np.array_equal(first, run_precincts_election_replicates(*args))
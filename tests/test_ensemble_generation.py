@@ -0,0 +1,18 @@
+import random
+from src.modules.ensemble_generation import RecomStats, gen_ensemble_parallel, gen_random_map, pair_key
+from src.modules.plan_hashing import ensemble_plan_index
+
+
+def test_parallel_chains_are_distinct(hi_seed):
+    random.seed(1) # chain seeds come from the global random; Hawaii has few 2-district plans, so some seeds give two chains the same end map
+    ensemble = gen_ensemble_parallel(hi_seed, 6, 5, 0.05, "test", [], n_workers=2)
+    assert len(ensemble.maps) == 6
+    assert ensemble_plan_index(ensemble).stats()["n_unique"] == 6
+
+
+def test_infeasible_pairs_are_forgotten_between_chains(hi_seed):
+    stats = RecomStats()
+    stats.mark_infeasible(pair_key(hi_seed, (1, 2)))
+    gen_random_map(hi_seed, 3, 0.05, [], recom_stats=stats) # would have no pair to propose if the cache carried over
+    gen_random_map(hi_seed, 3, 0.05, [], recom_stats=stats)
+    assert stats.n_steps == 4 and stats.n_cached_skips == 0
@@ -0,0 +1,39 @@
+import json
+import numpy as np
+import pytest
+from src.custom_types import Ensemble
+from src.modules import ensemble_view
+from src.modules.artifact_io import write_artifact, open_artifact
+from src.modules.ensemble_view import EnsembleView, MapRecord
+
+
+@pytest.fixture
+def ensemble_file(hi_seed, tmp_path):
+    moved = hi_seed.flip({next(iter(hi_seed.parts[1])): 2})
+    file = tmp_path / "ensemble.json"
+    write_artifact(file, json.dumps(Ensemble([hi_seed, moved, hi_seed], 10, 0.05, "test", ["contiguous"], {"note": 0.25}).to_json_dict()))
+    return file
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 16])
+def test_streams_the_saved_maps(hi_seed, ensemble_file, monkeypatch, chunk_size):
+    monkeypatch.setattr(ensemble_view, "READ_CHUNK_SIZE", chunk_size) # values split across many reads
+    view = EnsembleView(ensemble_file)
+    records: list[MapRecord] = list(view)
+    assert len(records) == 3
+    assert (records[0].assignment == MapRecord.from_partition(hi_seed).assignment).all()
+    assert (records[2].assignment == records[0].assignment).all()
+    assert np.count_nonzero(records[1].assignment != records[0].assignment) == 1
+    assert (view.n_recom_steps, view.epsilon, view.constraints, view.metadata) == (10, 0.05, ["contiguous"], {"note": 0.25})
+
+
+def test_graph_closes_the_file(ensemble_file, monkeypatch):
+    opened: list = []
+    def tracked_open(file):
+        f = open_artifact(file)
+        opened.append(f)
+        return f
+    monkeypatch.setattr(ensemble_view, "open_artifact", tracked_open)
+    view = EnsembleView(ensemble_file)
+    view.graph()
+    assert len(opened) == 1 and opened[0].closed
@@ -0,0 +1,55 @@
+import pytest
+import consts
+from src.modules.job_queue import JobQueue, QueueJob
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(tmp_path / "queue.sqlite")
+    yield queue
+    queue.close()
+
+
+def job() -> QueueJob:
+    return QueueJob("HI", "smd", "actual", 10, 0.05, ["contiguous"], 4)
+
+
+def test_each_job_is_leased_once(queue):
+    first_id: int = queue.submit(job())
+    second_id: int = queue.submit(job())
+    first, second = queue.lease("a", 60), queue.lease("b", 60)
+    assert (first.id, second.id) == (first_id, second_id)
+    assert queue.lease("c", 60) is None
+    assert queue.counts() == {"pending": 0, "leased": 2, "done": 0, "failed": 0}
+    assert first.constraints == ["contiguous"] and first.attempts == 1
+
+
+def test_expired_lease_is_reclaimed(queue):
+    queue.submit(job())
+    lost: QueueJob = queue.lease("a", -1) # expires right away
+    reclaimed: QueueJob = queue.lease("b", 60)
+    assert reclaimed.id == lost.id and reclaimed.attempts == 2
+    assert not queue.heartbeat(lost.id, "a", 60)
+    assert not queue.complete(lost.id, "a", consts.PROJ_ROOT / "a.json")
+    assert queue.heartbeat(reclaimed.id, "b", 60)
+    assert queue.complete(reclaimed.id, "b", consts.PROJ_ROOT / "b.json")
+    assert [j.result_file for j in queue.jobs("done")] == ["b.json"]
+
+
+def test_jobs_fail_after_max_attempts(queue):
+    queue.submit(job(), max_attempts=2)
+    first: QueueJob = queue.lease("a", 60)
+    assert queue.fail(first.id, "a", "error")
+    assert queue.counts()["pending"] == 1
+    queue.lease("b", -1)
+    assert queue.lease("c", 60) is None # the expired lease was the last attempt
+    assert queue.counts() == {"pending": 0, "leased": 0, "done": 0, "failed": 1}
+
+
+def test_leases_are_shared_across_connections(queue):
+    other = JobQueue(queue.file)
+    queue.submit(job())
+    leased: QueueJob = other.lease("a", 60)
+    assert queue.lease("b", 60) is None
+    assert queue.heartbeat(leased.id, "a", 60) # any connection of the lease owner can heartbeat
+    other.close()
@@ -0,0 +1,36 @@
+import numpy as np
+from src.custom_types import Ensemble
+from src.modules.ensemble_view import MapRecord
+from src.modules.plan_hashing import canonical_plan, plan_hash, ensemble_plan_index
+
+
+def test_relabeled_districts_hash_the_same():
+    assignment = np.array([3, 3, 1, 1, 2, 2, 3])
+    relabeled = np.array([7, 7, 5, 5, 9, 9, 7])
+    assert plan_hash(MapRecord(assignment, {1: 1, 2: 1, 3: 1}, "XX")) == plan_hash(MapRecord(relabeled, {5: 1, 7: 1, 9: 1}, "XX"))
+    canonical, reps = canonical_plan(assignment, {1: 1, 2: 1, 3: 1})
+    assert canonical.tolist() == [0, 0, 1, 1, 2, 2, 0]
+    assert reps.tolist() == [1, 1, 1]
+
+
+def test_different_plans_hash_differently():
+    assignment = np.array([1, 1, 2, 2, 3, 3])
+    reps = {1: 1, 2: 1, 3: 1}
+    moved = assignment.copy()
+    moved[1] = 2
+    assert plan_hash(MapRecord(assignment, reps, "XX")) != plan_hash(MapRecord(moved, reps, "XX"))
+
+
+def test_reps_are_part_of_the_plan():
+    assignment = np.array([1, 1, 2, 2])
+    swapped = np.array([2, 2, 1, 1])
+    assert plan_hash(MapRecord(assignment, {1: 3, 2: 2}, "XX")) != plan_hash(MapRecord(swapped, {1: 3, 2: 2}, "XX"))
+    assert plan_hash(MapRecord(assignment, {1: 3, 2: 2}, "XX")) == plan_hash(MapRecord(swapped, {1: 2, 2: 3}, "XX"))
+
+
+def test_plan_index_finds_duplicates(hi_seed):
+    relabeled = hi_seed.flip({p: 3 - d for p, d in hi_seed.assignment.items()})
+    moved = hi_seed.flip({next(iter(hi_seed.parts[1])): 2})
+    index = ensemble_plan_index(Ensemble([hi_seed, moved, relabeled, moved], 0, 0, "test", []))
+    assert index.duplicate_of == [0, 1, 0, 1]
+    assert index.stats()["n_unique"] == 2
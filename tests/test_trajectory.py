@@ -0,0 +1,44 @@
+import random
+from functools import partial
+from gerrychain import MarkovChain
+from gerrychain.accept import always_accept
+from src.modules.ensemble_generation import vmd_recom
+from src.modules.ensemble_view import MapRecord
+from src.modules.trajectory import Trajectory
+
+
+def run_chain(seed_partition, n_steps: int, keyframe_interval: int) -> tuple[Trajectory, list]:
+    """Runs a short ReCom chain, recording it both in a Trajectory and as the full assignment of every step."""
+
+    random.seed(0)
+    trajectory = Trajectory.from_partition(seed_partition, keyframe_interval)
+    assignments: list = []
+    for step, partition in enumerate(MarkovChain(partial(vmd_recom, epsilon=0.05), [], always_accept, seed_partition, total_steps=n_steps)):
+        if step > 0:
+            trajectory.append(partition)
+        assignments.append(MapRecord.from_partition(partition).assignment)
+    return trajectory, assignments
+
+
+def test_every_step_is_recovered(hi_seed):
+    trajectory, assignments = run_chain(hi_seed, 12, keyframe_interval=5)
+    assert len(trajectory) == len(assignments)
+    assert sorted(trajectory.keyframes) == [0, 5, 10]
+    assert any((assignment != assignments[0]).any() for assignment in assignments) # the chain moved
+    for step, assignment in enumerate(assignments):
+        assert (trajectory.assignment_at(step) == assignment).all()
+
+
+def test_json_round_trip(hi_seed):
+    trajectory, assignments = run_chain(hi_seed, 8, keyframe_interval=3)
+    loaded = Trajectory.from_json_dict(trajectory.to_json_dict())
+    for step, assignment in enumerate(assignments):
+        assert (loaded.assignment_at(step) == assignment).all()
+
+
+def test_replay_matches_chain(hi_seed):
+    trajectory, assignments = run_chain(hi_seed, 8, keyframe_interval=3)
+    replayed = list(trajectory.replay(hi_seed.graph, start=2))
+    assert len(replayed) == len(assignments) - 2
+    for partition, assignment in zip(replayed, assignments[2:]):
+        assert (MapRecord.from_partition(partition).assignment == assignment).all()
@@ -0,0 +1,45 @@
+import json
+import numpy as np
+from src.custom_types import Ensemble
+from src.modules.artifact_io import write_artifact
+from src.modules.ensemble_view import MapRecord
+from src.modules.validation import MapValidator, validate_ensemble_file
+
+
+def interior_precinct(partition, districtID: int) -> int:
+    """A precinct of the district whose neighbors are all in the same district."""
+
+    return next(p for p in sorted(partition.parts[districtID]) if all(partition.assignment[n] == districtID for n in partition.graph.neighbors(p)))
+
+
+def test_valid_map_has_no_problems(hi_seed):
+    assert MapValidator(hi_seed.graph).problems(MapRecord.from_partition(hi_seed), 0.05) == []
+
+
+def test_invalid_maps(hi_seed):
+    validator = MapValidator(hi_seed.graph)
+    record = MapRecord.from_partition(hi_seed)
+
+    missing = record.assignment.copy()
+    missing[0] = -1
+    assert "covers 261 of 262" in validator.problems(MapRecord(missing, record.district_reps, "HI"), 0.05)[0]
+
+    unknown = record.assignment.copy()
+    unknown[0] = 7
+    assert "without reps: [7]" in validator.problems(MapRecord(unknown, record.district_reps, "HI"), 0.05)[0]
+
+    island = record.assignment.copy()
+    island[interior_precinct(hi_seed, 1)] = 2
+    problems = validator.problems(MapRecord(island, record.district_reps, "HI"), 0.5)
+    assert len(problems) == 1 and problems[0].startswith("noncontiguous districts: {2: 2}")
+
+    unbalanced = np.where(record.assignment == 1, 1, 2)
+    assert validator.problems(MapRecord(unbalanced, {1: 1, 2: 3}, "HI"), 0.05)[0].startswith("districts outside of population balance")
+
+
+def test_validate_ensemble_file(hi_seed, tmp_path):
+    island = hi_seed.flip({interior_precinct(hi_seed, 1): 2})
+    file = tmp_path / "ensemble.json"
+    write_artifact(file, json.dumps(Ensemble([hi_seed, island, hi_seed], 0, 0.5, "test", []).to_json_dict()))
+    report: dict = validate_ensemble_file(file, n_workers=2)
+    assert (report["n_maps"], report["n_invalid"], list(report["invalid"].keys())) == (3, 1, [1])